@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+
+Prerequisite:
+Python3.7 or later, pysam, and the tools required by the pipeline (samtools, bcftools, hisat2). Picard and GATK are not required with -shims.
+
+Usage: python run_benchmark.py -outdir bench -sizes 100000,1000000 -p 1,4 -shims
+
+Usage details:
+For each case (-cases) and size (-sizes, number of read pairs), a synthetic sample is made by simulate_reads.py and kept in outdir/data for reuse. Then quick_check.py (BAM and CRAM input), quick_check.py -kmer (program quick_check_kmer) and main.py (BAM, CRAM and FASTQ input) are run for each -p. The report (outdir/benchmark_report.tsv) has one line per run with wall time, per-stage wall time, time of each stage not spent in external commands, the result and whether it matches the simulated truth.
+Cases are written as <virus>_<integration>, e.g. A_full, B_DR, or "none".
+When both quick_check and quick_check_kmer are run, outdir/kmer_calibration.tsv compares the numbers of reads and HHV-6 alignments and the calls of the k-mer engine with those of hisat2 for each sample. The k-mer engine is calibrated when the calls are the same and the numbers of alignments are close.
+With -shims, helper_scripts/benchmark/shims is put first in PATH, so Picard and GATK are replaced by lightweight stand-ins (see shims/java and shims/gatk). Use it to benchmark the pipeline without a JVM; stage times of reconstruction are not comparable to real runs.
+
+Show help message:
+python run_benchmark.py -h
+'''
+
+import os,sys,json,time,argparse,subprocess
+import simulate_reads
+
+
+base=os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+prog=os.path.abspath(os.path.join(base, '../..'))
+expected_quick_check={'full': 'likely_Full-length', 'DR': 'likely_solo-DR', 'none': 'False'}
+
+
+def parse_args():
+    parser=argparse.ArgumentParser(description='')
+    parser.add_argument('-cases', metavar='str', type=str, help='Optional. Comma-separated cases. Default: A_full,B_full,A_DR,B_DR,none', default='A_full,B_full,A_DR,B_DR,none')
+    parser.add_argument('-sizes', metavar='str', type=str, help='Optional. Comma-separated numbers of read pairs. Default: 100000,1000000', default='100000,1000000')
+    parser.add_argument('-p', metavar='str', type=str, help='Optional. Comma-separated numbers of threads. Default: 1,4', default='1,4')
+    parser.add_argument('-formats', metavar='str', type=str, help='Optional. Comma-separated input formats (bam, cram, fastq). Default: bam,cram,fastq', default='bam,cram,fastq')
+    parser.add_argument('-programs', metavar='str', type=str, help='Optional. Comma-separated programs (quick_check, quick_check_kmer, main). Default: quick_check,quick_check_kmer,main', default='quick_check,quick_check_kmer,main')
+    parser.add_argument('-depth', metavar='float', type=float, help='Optional. Depth of HHV-6 reads. Default: 15', default=15)
+    parser.add_argument('-divergence', metavar='float', type=float, help='Optional. Substitution rate of the HHV-6 haplotype from the reference. Default: 0.001', default=0.001)
+    parser.add_argument('-unmapped_frac', metavar='float', type=float, help='Optional. Fraction of background pairs which are unmapped. Default: 0.005', default=0.005)
+    parser.add_argument('-seed', metavar='int', type=int, help='Optional. Random seed. Default: 1', default=1)
+    parser.add_argument('-vref', metavar='str', type=str, help='Optional. Default: /path/to/prog/lib/hhv6.fa', default=os.path.join(prog, 'lib/hhv6.fa'))
+    parser.add_argument('-vrefindex', metavar='str', type=str, help='Optional. Default: /path/to/prog/lib/hisat2_index/hhv6', default=os.path.join(prog, 'lib/hisat2_index/hhv6'))
+    parser.add_argument('-picard', metavar='str', type=str, help='Required unless -shims is specified. Specify full path to picard.jar.')
+    parser.add_argument('-shims', help='Optional. Specify if you replace Picard and GATK with the stand-ins in shims/.', action='store_true')
+    parser.add_argument('-outdir', metavar='str', type=str, help='Optional. Default: ./result_benchmark', default='./result_benchmark')
+    args=parser.parse_args()
+    if args.shims is False and args.picard is None:
+        print('Error: Please specify -picard or -shims.')
+        exit(1)
+    if args.shims is True and args.picard is None:
+        args.picard=os.path.join(base, 'shims/java')   # must exist; ignored by the java shim
+    return args
+
+
+def make_data(args, case, size):
+    outdir=os.path.join(args.outdir, 'data', '%s_%d' % (case, size))
+    truth_path=os.path.join(outdir, 'truth.json')
+    if os.path.exists(truth_path) is True:
+        with open(truth_path) as infile:
+            return json.load(infile)
+    virus,integration=(case.split('_') + ['full'])[:2] if not case == 'none' else ['none', 'full']
+    sargs=simulate_reads.parser().parse_args(['-virus', virus, '-integration', integration, '-pairs', str(size), '-depth', str(args.depth),
+                                              '-divergence', str(args.divergence), '-unmapped_frac', str(args.unmapped_frac), '-seed', str(args.seed), '-outdir', outdir])
+    print('Info: simulating %s with %d read pairs.' % (case, size))
+    return simulate_reads.simulate(sargs)
+
+
+def command(args, program, fmt, truth, p, outdir):
+    files=truth['files']
+    if program in ['quick_check', 'quick_check_kmer']:
+        cmd=[sys.executable, os.path.join(prog, 'quick_check.py'), '-outdir', outdir, '-overwrite', '-p', str(p)]
+        if program == 'quick_check_kmer':
+            cmd.append('-kmer')
+        if fmt == 'bam':
+            return cmd + ['-b', files['bam']]
+        return cmd + ['-c', files['cram'], '-fa', files['background']]
+    cmd=[sys.executable, os.path.join(prog, 'main.py'), '-vref', args.vref, '-vrefindex', args.vrefindex, '-picard', args.picard, '-outdir', outdir, '-overwrite', '-p', str(p)]
+    if fmt == 'bam':
+        return cmd + ['-alignmentin', '-b', files['bam']]
+    elif fmt == 'cram':
+        return cmd + ['-alignmentin', '-c', files['cram'], '-fa', files['background']]
+    return cmd + ['-fastqin', '-fq1', files['fq1'], '-fq2', files['fq2']]
+
+
+def stage_times(outdir):
+    # latest record of each stage; "in_process" is the part of a stage not spent waiting for external commands
+    path=os.path.join(outdir, 'performance.json')
+    if os.path.exists(path) is False:
+        return {}
+    with open(path) as infile:
+        d=json.load(infile)
+    latest={}
+    for r in d['stages']:
+        latest[r['stage']]=r
+    return { name:[r['wall_sec'], max(0, r['wall_sec'] - sum([ c['wall_sec'] for c in r['commands'] ]))] for name,r in latest.items() }
+
+
+def read_fasta_seq(path):
+    seq=[]
+    with open(path) as infile:
+        for line in infile:
+            if not line[0] == '>':
+                seq.append(line.strip().upper())
+    return ''.join(seq)
+
+
+def identity(truth_fa, reconstructed):
+    # substitutions only, so positions are comparable; N is not counted
+    if os.path.exists(reconstructed) is False:
+        return 'NA', 'NA'
+    t=read_fasta_seq(truth_fa)
+    r=read_fasta_seq(reconstructed)
+    if not len(t) == len(r):
+        return 'NA', 'NA'
+    called=[ (a, b) for a,b in zip(t, r) if not b == 'N' ]
+    if len(called) == 0:
+        return 'NA', '0'
+    return '%.6f' % (sum([ a == b for a,b in called ]) / len(called)), '%.4f' % (len(called) / len(t))
+
+
+def quick_check_result(outdir):
+    # reads analyzed, HHV-6 alignments and call of the last file in HHV6_check_results.txt
+    result=['NA', 'NA', 'NA']
+    path=os.path.join(outdir, 'HHV6_check_results.txt')
+    if os.path.exists(path) is True:
+        with open(path) as infile:
+            for line in infile:
+                if not line[0] == '#':
+                    result=line.split()[-3:]
+    return result
+
+
+def judge(program, truth, outdir):
+    # returns result, expected, correct, identity, fraction of the haplotype reconstructed
+    integration=truth['integration']
+    if program in ['quick_check', 'quick_check_kmer']:
+        call=quick_check_result(outdir)[2]
+        expected=expected_quick_check[integration]
+        return call, expected, str(call == expected), 'NA', 'NA'
+    detected=[]
+    path=os.path.join(outdir, 'virus_detection_summary.txt')
+    if os.path.exists(path) is True:
+        with open(path) as infile:
+            for line in infile:
+                ls=line.split()
+                if ls[1] == 'virus_exist=True' and ls[0] in simulate_reads.refids.values():
+                    detected.append(ls[0])
+    expected=truth['refid'] if truth['refid'] is not None else 'none'
+    result=';'.join(detected) if len(detected) >= 1 else 'none'
+    ident,frac='NA','NA'
+    if truth['refid'] is not None:
+        name='hhv6%s' % truth['virus'].lower()
+        reconstructed=os.path.join(outdir, '%s_DR_reconstructed.fa' % name if integration == 'DR' else '%s_reconstructed.fa' % name)
+        ident,frac=identity(truth['files']['truth_fa'], reconstructed)
+    return result, expected, str(result == expected), ident, frac
+
+
+def main():
+    args=parse_args()
+    os.makedirs(os.path.join(args.outdir, 'runs'), exist_ok=True)
+    env=dict(os.environ)
+    if args.shims is True:
+        env['PATH']=os.path.join(base, 'shims') + os.pathsep + env['PATH']
+    cases=args.cases.split(',')
+    sizes=[ int(s) for s in args.sizes.split(',') ]
+    threads=[ int(p) for p in args.p.split(',') ]
+    formats=args.formats.split(',')
+    programs=args.programs.split(',')
+    report=os.path.join(args.outdir, 'benchmark_report.tsv')
+    calibration=[]
+    with open(report, 'w') as outfile:
+        outfile.write('#case\tpairs\tformat\tp\tprogram\tstatus\twall_sec\tpairs_per_sec\tstage_wall_sec\tstage_in_process_sec\tresult\texpected\tcorrect\tidentity\tfrac_reconstructed\n')
+        for case in cases:
+            for size in sizes:
+                truth=make_data(args, case, size)
+                for program in programs:
+                    for fmt in formats:
+                        if program in ['quick_check', 'quick_check_kmer'] and fmt == 'fastq':
+                            continue
+                        for p in threads:
+                            outdir=os.path.join(args.outdir, 'runs', '%s_%d_%s_p%d_%s' % (case, size, fmt, p, program))
+                            cmd=command(args, program, fmt, truth, p, outdir)
+                            print('Info: running %s' % os.path.basename(outdir))
+                            start=time.time()
+                            with open(outdir +'.log', 'w') as logfile:
+                                returncode=subprocess.run(cmd, env=env, stdout=logfile, stderr=subprocess.STDOUT).returncode
+                            wall=time.time() - start
+                            status='ok' if returncode == 0 else 'failed(%d)' % returncode
+                            times=stage_times(outdir)
+                            result,expected,correct,ident,frac=judge(program, truth, outdir)
+                            outfile.write('%s\t%d\t%s\t%d\t%s\t%s\t%.2f\t%.0f\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n' % (
+                                case, size, fmt, p, program, status, wall, size / wall,
+                                ';'.join([ '%s=%.2f' % (k, v[0]) for k,v in times.items() ]) if len(times) >= 1 else 'NA',
+                                ';'.join([ '%s=%.2f' % (k, v[1]) for k,v in times.items() ]) if len(times) >= 1 else 'NA',
+                                result, expected, correct, ident, frac))
+                            outfile.flush()
+                            if program == 'quick_check_kmer':
+                                calibration.append([case, size, fmt, p, outdir])
+    print('Info: benchmark report was written to %s.' % report)
+    if len(calibration) >= 1:
+        path=os.path.join(args.outdir, 'kmer_calibration.tsv')
+        with open(path, 'w') as outfile:
+            outfile.write('#case\tpairs\tformat\tp\thisat2_reads\tkmer_reads\thisat2_alignments\tkmer_alignments\thisat2_call\tkmer_call\tsame_call\n')
+            for case,size,fmt,p,outdir in calibration:
+                h,k=quick_check_result(outdir[:-len('_kmer')]),quick_check_result(outdir)
+                outfile.write('%s\t%d\t%s\t%d\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n' % (case, size, fmt, p, h[0], k[0], h[1], k[1], h[2], k[2], str(h[2] == k[2])))
+        print('Info: k-mer calibration against hisat2 was written to %s.' % path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+
+Prerequisite:
+Python3.7 or later, pysam.
+
+Usage: python simulate_reads.py -virus A -integration full -pairs 1000000 -outdir sim_A_full
+
+Usage details:
+This script makes a synthetic paired-end WGS sample for benchmarking. A human-like background chromosome (random sequence with 41% GC and diverged copies of a 300-bp interspersed repeat) is made, and most read pairs are sampled from it and written as proper pairs. A fraction of background pairs (-unmapped_frac) is sampled from a non-reference sequence and written as unmapped pairs. HHV-6A or HHV-6B read pairs are sampled from a diverged haplotype of the full-length genome (-integration full) or of DR only (-integration DR) at -depth and written as unmapped pairs.
+Output files in -outdir:
+sample.bam, sample.cram (coordinate-sorted with index), sample_1.fq, sample_2.fq (unmapped pairs only, as for -fastqin), background.fa, truth.fa (diverged HHV-6 haplotype) and truth.json.
+
+Show help message:
+python simulate_reads.py -h
+'''
+
+import os,sys,json,random,argparse
+
+
+base=os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+refids={'A': 'NC_001664.4', 'B': 'NC_000898.1'}
+complement=str.maketrans('ACGTN', 'TGCAN')
+
+
+def load_fasta(path):
+    seqs={}
+    name=None
+    with open(path) as infile:
+        for line in infile:
+            if line[0] == '>':
+                name=line[1:].split()[0]
+                seqs[name]=[]
+            else:
+                seqs[name].append(line.strip().upper())
+    return { name:''.join(seq) for name,seq in seqs.items() }
+
+
+def write_fasta(path, name, seq):
+    with open(path, 'w') as outfile:
+        outfile.write('>%s\n' % name)
+        for i in range(0, len(seq), 60):
+            outfile.write(seq[i:i + 60] +'\n')
+
+
+def revcomp(seq):
+    return seq.translate(complement)[::-1]
+
+
+def mutate(rng, seq, rate):
+    # substitutions only, so the haplotype stays colinear with the reference
+    seq=list(seq)
+    for pos in rng.sample(range(len(seq)), int(len(seq) * rate)):
+        seq[pos]=rng.choice([ b for b in 'ACGT' if not b == seq[pos] ])
+    return ''.join(seq)
+
+
+def random_seq(rng, length, gc):
+    return ''.join(rng.choices('ACGT', weights=[1 - gc, gc, gc, 1 - gc], k=length))
+
+
+def human_like(rng, length, gc=0.41, repeat_len=300, repeat_every=3000, repeat_div=0.15):
+    # random sequence with diverged copies of one interspersed repeat, like Alu
+    repeat=random_seq(rng, repeat_len, 0.52)
+    chunks=[]
+    total=0
+    while total < length:
+        n=rng.randint(repeat_every // 2, repeat_every * 3 // 2)
+        chunks.append(random_seq(rng, n, gc))
+        chunks.append(mutate(rng, repeat, repeat_div))
+        total += n + repeat_len
+    return ''.join(chunks)[:length]
+
+
+def add_errors(rng, seq, rate):
+    n=len(seq) * rate
+    k=int(n) + (1 if rng.random() < n - int(n) else 0)
+    if k == 0:
+        return seq
+    seq=list(seq)
+    for pos in rng.sample(range(len(seq)), k):
+        seq[pos]=rng.choice([ b for b in 'ACGT' if not b == seq[pos] ])
+    return ''.join(seq)
+
+
+def fragments(rng, seq, n, args):
+    # start and forward-strand sequence of each fragment
+    for _ in range(n):
+        insert=max(args.read_len, min(len(seq), int(rng.gauss(args.insert_mean, args.insert_sd))))
+        start=rng.randint(0, len(seq) - insert)
+        yield start, seq[start:start + insert]
+
+
+def unmapped_segment(pysam, name, seq, qual, flag):
+    r=pysam.AlignedSegment()
+    r.query_name=name
+    r.flag=flag
+    r.reference_id=-1
+    r.reference_start=-1
+    r.next_reference_id=-1
+    r.next_reference_start=-1
+    r.query_sequence=seq
+    r.query_qualities=pysam.qualitystring_to_array(qual)
+    return r
+
+
+def mapped_segment(pysam, name, seq, qual, flag, pos, mate_pos, tlen):
+    r=pysam.AlignedSegment()
+    r.query_name=name
+    r.flag=flag
+    r.reference_id=0
+    r.reference_start=pos
+    r.mapping_quality=60
+    r.cigartuples=[(0, len(seq))]
+    r.next_reference_id=0
+    r.next_reference_start=mate_pos
+    r.template_length=tlen
+    r.query_sequence=seq
+    r.query_qualities=pysam.qualitystring_to_array(qual)
+    return r
+
+
+def simulate(args):
+    import pysam
+    rng=random.Random(args.seed)
+    os.makedirs(args.outdir, exist_ok=True)
+    L=args.read_len
+    qual='F' * L
+    files={ k:os.path.join(args.outdir, v) for k,v in [['bam', 'sample.bam'], ['cram', 'sample.cram'], ['fq1', 'sample_1.fq'], ['fq2', 'sample_2.fq'],
+                                                       ['background', 'background.fa'], ['truth_fa', 'truth.fa'], ['truth', 'truth.json']] }
+
+    # sequences
+    background=human_like(rng, args.bg_len)
+    write_fasta(files['background'], 'chr1', background)
+    pysam.faidx(files['background'])
+    non_reference=human_like(rng, max(args.bg_len // 20, 100000))
+    virus=None
+    if args.virus in refids:
+        ref=args.dr if args.integration == 'DR' else args.vref
+        virus=mutate(rng, load_fasta(ref)[refids[args.virus]], args.divergence)
+        write_fasta(files['truth_fa'], refids[args.virus], virus)
+    unmapped_n=int(args.pairs * args.unmapped_frac)
+    virus_n=0 if virus is None else int(args.depth * len(virus) / (2 * L))
+    mapped_n=max(0, args.pairs - unmapped_n - virus_n)
+
+    # reads
+    header={'HD': {'VN': '1.6', 'SO': 'unsorted'}, 'SQ': [{'SN': 'chr1', 'LN': len(background)}]}
+    tmp_bam=files['bam'] +'.unsorted.bam'
+    with pysam.AlignmentFile(tmp_bam, 'wb', header=header) as bam, open(files['fq1'], 'w') as fq1, open(files['fq2'], 'w') as fq2:
+        for n,(start,frag) in enumerate(fragments(rng, background, mapped_n, args)):
+            name='bg%d' % n
+            s1=add_errors(rng, frag[:L], args.error_rate)
+            s2=add_errors(rng, frag[-L:], args.error_rate)
+            p2=start + len(frag) - L
+            if rng.random() < 0.5:
+                bam.write(mapped_segment(pysam, name, s1, qual, 99, start, p2, len(frag)))
+                bam.write(mapped_segment(pysam, name, s2, qual, 147, p2, start, -len(frag)))
+            else:
+                bam.write(mapped_segment(pysam, name, s1, qual, 163, start, p2, len(frag)))
+                bam.write(mapped_segment(pysam, name, s2, qual, 83, p2, start, -len(frag)))
+        for prefix,seq,n_pairs in [['un', non_reference, unmapped_n], ['hhv6', virus, virus_n]]:
+            if n_pairs == 0:
+                continue
+            for n,(_,frag) in enumerate(fragments(rng, seq, n_pairs, args)):
+                name='%s%d' % (prefix, n)
+                s1=add_errors(rng, frag[:L], args.error_rate)
+                s2=add_errors(rng, revcomp(frag[-L:]), args.error_rate)
+                bam.write(unmapped_segment(pysam, name, s1, qual, 77))
+                bam.write(unmapped_segment(pysam, name, s2, qual, 141))
+                fq1.write('@%s/1\n%s\n+\n%s\n' % (name, s1, qual))
+                fq2.write('@%s/2\n%s\n+\n%s\n' % (name, s2, qual))
+    pysam.sort('-@', '%d' % (args.p - 1), '-o', files['bam'], tmp_bam)
+    os.remove(tmp_bam)
+    pysam.index(files['bam'])
+    pysam.view('-@', '%d' % (args.p - 1), '-C', '-T', files['background'], '-o', files['cram'], files['bam'], catch_stdout=False)
+    pysam.index(files['cram'])
+
+    truth={'virus': args.virus, 'refid': refids.get(args.virus), 'integration': args.integration if virus is not None else 'none',
+           'pairs': args.pairs, 'mapped_pairs': mapped_n, 'unmapped_background_pairs': unmapped_n, 'virus_pairs': virus_n,
+           'virus_depth': args.depth if virus is not None else 0, 'divergence': args.divergence, 'read_len': L,
+           'background_depth': 2 * L * mapped_n / len(background), 'seed': args.seed, 'files': files}
+    with open(files['truth'], 'w') as outfile:
+        json.dump(truth, outfile, indent=1)
+    return truth
+
+
+def parser():
+    p=argparse.ArgumentParser(description='')
+    p.add_argument('-virus', metavar='str', type=str, help='Optional. A, B or none. Default: A', default='A', choices=['A', 'B', 'none'])
+    p.add_argument('-integration', metavar='str', type=str, help='Optional. full or DR. Default: full', default='full', choices=['full', 'DR'])
+    p.add_argument('-pairs', metavar='int', type=int, help='Optional. Total number of read pairs. Default: 1000000', default=1000000)
+    p.add_argument('-unmapped_frac', metavar='float', type=float, help='Optional. Fraction of background pairs which are unmapped. Default: 0.005', default=0.005)
+    p.add_argument('-depth', metavar='float', type=float, help='Optional. Depth of HHV-6 reads. Default: 15', default=15)
+    p.add_argument('-divergence', metavar='float', type=float, help='Optional. Substitution rate of the HHV-6 haplotype from the reference. Default: 0.001', default=0.001)
+    p.add_argument('-error_rate', metavar='float', type=float, help='Optional. Sequencing error rate. Default: 0.001', default=0.001)
+    p.add_argument('-read_len', metavar='int', type=int, help='Optional. Read length. Default: 150', default=150)
+    p.add_argument('-insert_mean', metavar='int', type=int, help='Optional. Mean insert size. Default: 400', default=400)
+    p.add_argument('-insert_sd', metavar='int', type=int, help='Optional. SD of insert size. Default: 60', default=60)
+    p.add_argument('-bg_len', metavar='int', type=int, help='Optional. Length of the background chromosome. Default: 5000000', default=5000000)
+    p.add_argument('-vref', metavar='str', type=str, help='Optional. HHV-6 reference. Default: /path/to/prog/lib/hhv6.fa', default=os.path.join(base, '../../lib/hhv6.fa'))
+    p.add_argument('-dr', metavar='str', type=str, help='Optional. HHV-6 DR reference. Default: /path/to/prog/lib/HHV6_only_DR.fa', default=os.path.join(base, '../../lib/HHV6_only_DR.fa'))
+    p.add_argument('-seed', metavar='int', type=int, help='Optional. Random seed. Default: 1', default=1)
+    p.add_argument('-p', metavar='int', type=int, help='Optional. Number of threads for sorting and CRAM conversion. Default: 1', default=1)
+    p.add_argument('-outdir', metavar='str', type=str, help='Optional. Output directory. Default: ./simulated', default='./simulated')
+    return p
+
+
+if __name__ == '__main__':
+    args=parser().parse_args()
+    truth=simulate(args)
+    print('Info: %d read pairs (%d HHV-6 pairs) were written to %s.' % (truth['pairs'], truth['virus_pairs'], args.outdir))
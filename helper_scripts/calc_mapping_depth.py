@@ -14,17 +14,25 @@ Exmaple:
 samtools coverage --reference ref.fa in.cram > in.txt
 python calc_mapping_depth.py -i in.txt -chr /path/to/prog/lib/human_autosomes_ucsc_style.txt -o out.txt
 
+Cohort mode:
+python calc_mapping_depth.py -l files.txt -fa ref.fa -p 8 -o depth.tsv
+
 Usage details:
 Before using this script, you need to run 'samtools coverage' to calculate depth of each chromosome. You need to use samtools 1.10 or later to use 'coverage' function. The output from 'samtools coverage' contains mean depth of each chromosome. This program takes the output file from 'samtools coverage' to calculate mean depth of autosomes. You can specify the output file with '-i' option. You can specify names of autosomes by specifying a file containing names of autosomes with -chr option.
 
+In cohort mode, specify a file listing BAM/CRAM files or outputs of 'samtools coverage' (one per line) with '-l' option. 'samtools coverage' is run for BAM/CRAM files in parallel with '-p' processes (reference genome is required for CRAM files with '-fa' option). A coverage output can be followed by its BAM/CRAM file in the second tab-separated column; otherwise "file" is NA, and a bam or cram column has to be filled in before the table is used as a sample sheet. The output is a tab-delimited table with "sample", "depth" and "file" columns, which can be directly used as a sample sheet of batch.py. Depth is NA when it could not be calculated.
+
 Show help message:
 python calc_mapping_depth.py -h
 '''
 
-import os,sys,argparse
+import os,sys,argparse,subprocess,multiprocessing
 
 parser=argparse.ArgumentParser(description='')
-parser.add_argument('-i', metavar='str', type=str, help='Required. Specify output file from samtools coverage.')
+parser.add_argument('-i', metavar='str', type=str, help='Either -i or -l is Required. Specify output file from samtools coverage.')
+parser.add_argument('-l', metavar='str', type=str, help='Either -i or -l is Required. Specify a file listing BAM/CRAM files or output files from samtools coverage, one per line.')
+parser.add_argument('-fa', metavar='str', type=str, help='Optional. Specify reference genome of CRAM files in -l.')
+parser.add_argument('-p', metavar='int', type=int, help='Optional. Number of files processed in parallel in cohort mode. Default: 1', default=1)
 parser.add_argument('-chr', metavar='str', type=str, help='Required. Specify a file containing autosomes. Default=/path/to/prog/lib/human_autosomes_ucsc_style.txt')
 parser.add_argument('-o', metavar='str', type=str, help='Optional. Specify output file name. Otherwise, output result as stdout.')
 parser.add_argument('-overwrite', help='Optional. Specify if you overwrite previous results.', action='store_true')
@@ -32,12 +40,12 @@ args=parser.parse_args()
 
 
 # initial check
-if args.i is None:
-    print('Error: You need to specify input file with "-i" option.')
+if args.i is None and args.l is None:
+    print('Error: You need to specify input file with "-i" or "-l" option.')
     exit(1)
-else:
-    if os.path.exists(args.i) is not True:
-        print('Error: Input file does not exist.')
+for path in [args.i, args.l, args.fa]:
+    if path is not None and os.path.exists(path) is not True:
+        print('Error: Input file (%s) does not exist.' % path)
         exit(1)
 
 if args.chr is None:
@@ -63,22 +71,82 @@ with open(args.chr) as infile:
     for line in infile:
         chrs.add(line.strip())
 
-genome_len=0
-cov_dep=0
-chrs_used=[]
-with open(args.i) as infile:
-    for line in infile:
+
+def mean_depth(lines):
+    genome_len=0
+    cov_dep=0
+    chrs_used=[]
+    for line in lines:
         if not line[0] == '#':
             ls=line.strip().split('\t')
             if ls[0] in chrs:
                 genome_len += int(ls[4])
                 cov_dep += int(ls[4]) * float(ls[6])
                 chrs_used.append(ls[0])
-mean_dep= cov_dep / genome_len
-mean_dep= round(mean_dep)
+    mean_dep= cov_dep / genome_len
+    mean_dep= round(mean_dep)
+    return mean_dep, chrs_used
 
-if args.o is not None:
-    with open(args.o, 'w') as outfile:
-        outfile.write('%d\t%s\t%s\n' % (mean_dep, os.path.abspath(args.i), ';'.join(chrs_used)))
+
+def sample_name(path):
+    name=os.path.basename(path)
+    for ext in ['.bam', '.cram', '.txt']:
+        if name.endswith(ext):
+            return name[:-len(ext)]
+    return name
+
+
+def cohort_job(entry):
+    # entry: [input file, BAM/CRAM written to the "file" column, or None]
+    path,alignment=entry
+    try:
+        if path.endswith('.bam') or path.endswith('.cram'):
+            cmd=['samtools', 'coverage']
+            if path.endswith('.cram') and args.fa is not None:
+                cmd.extend(['--reference', args.fa])
+            out=subprocess.run(cmd + [path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            if not out.returncode == 0:
+                return None, [], 'samtools coverage failed: %s' % out.stderr.strip()
+            lines=out.stdout.splitlines()
+        else:
+            with open(path) as infile:
+                lines=infile.readlines()
+        mean_dep,chrs_used=mean_depth(lines)
+        return mean_dep, chrs_used, None
+    except (OSError, ValueError, IndexError, ZeroDivisionError) as e:
+        return None, [], str(e)
+
+
+if args.l is None:
+    with open(args.i) as infile:
+        mean_dep,chrs_used=mean_depth(infile)
+    if args.o is not None:
+        with open(args.o, 'w') as outfile:
+            outfile.write('%d\t%s\t%s\n' % (mean_dep, os.path.abspath(args.i), ';'.join(chrs_used)))
+    else:
+        print('%d\t%s\t%s' % (mean_dep, os.path.abspath(args.i), ';'.join(chrs_used)))
 else:
-    print('%d\t%s\t%s' % (mean_dep, os.path.abspath(args.i), ';'.join(chrs_used)))
+    entries=[]
+    with open(args.l) as infile:
+        for line in infile:
+            ls=line.strip().split('\t')
+            if ls[0] == '' or ls[0][0] == '#':
+                continue
+            if len(ls) >= 2:
+                entries.append([ls[0], ls[1]])
+            elif ls[0].endswith('.bam') or ls[0].endswith('.cram'):
+                entries.append([ls[0], ls[0]])
+            else:
+                entries.append([ls[0], None])   # coverage output without BAM/CRAM; "file" is NA
+    with multiprocessing.Pool(args.p) as pool:
+        results=pool.map(cohort_job, entries, chunksize=1)
+    rows=['sample\tdepth\tfile\tautosomes\n']
+    for (path,alignment),(mean_dep,chrs_used,error) in zip(entries, results):
+        if error is not None:
+            sys.stderr.write('Warning: depth of %s could not be calculated. %s\n' % (path, error))
+        rows.append('%s\t%s\t%s\t%s\n' % (sample_name(path if alignment is None else alignment), 'NA' if mean_dep is None else '%d' % mean_dep, 'NA' if alignment is None else os.path.abspath(alignment), ';'.join(chrs_used) if len(chrs_used) >= 1 else 'NA'))
+    if args.o is not None:
+        with open(args.o, 'w') as outfile:
+            outfile.write(''.join(rows))
+    else:
+        sys.stdout.write(''.join(rows))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+
+Prerequisite:
+Python3 or later.
+
+Usage: python coverage_to_bedgraph.py -i mapped_to_virus.cov -o mapped_to_virus.bedgraph
+
+Usage details:
+The pipeline writes per-base coverage (mapped_to_virus.cov and mapped_to_DR.cov) in a compact binary format with a per-contig index. This script converts it to bedgraph (contig, start, end, depth; 0-based, half-open), the same content as 'bamCoverage --outFileFormat bedgraph --binSize 1'. Specify -summary to print contig length, covered bases and mean depth from the index without reading the runs.
+
+Show help message:
+python coverage_to_bedgraph.py -h
+'''
+
+import os,sys,argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '../scripts'))
+import covfile
+
+parser=argparse.ArgumentParser(description='')
+parser.add_argument('-i', metavar='str', type=str, help='Required. Specify coverage file (.cov) written by the pipeline.', required=True)
+parser.add_argument('-o', metavar='str', type=str, help='Optional. Specify output file name. Otherwise, output result as stdout.')
+parser.add_argument('-summary', help='Optional. Specify if you output per-contig summary instead of bedgraph.', action='store_true')
+parser.add_argument('-overwrite', help='Optional. Specify if you overwrite previous results.', action='store_true')
+args=parser.parse_args()
+
+if args.o is not None and os.path.exists(args.o) is True and args.overwrite is False:
+    print('Error: %s already exists. Please specify -overwrite if you overwrite it.' % args.o)
+    exit(1)
+
+try:
+    contigs=covfile.read_index(args.i)
+except ValueError as e:
+    print('Error: %s' % e)
+    exit(1)
+
+outfile=open(args.o, 'w') if args.o is not None else sys.stdout
+if args.summary is True:
+    outfile.write('#contig\tlength\tcovered\tmean_depth\n')
+    for c in contigs:
+        outfile.write('%s\t%d\t%d\t%f\n' % (c.name, c.length, c.covered, c.depth_sum / c.length))
+else:
+    for c in contigs:
+        for s,e,d in covfile.read_runs(args.i, c):
+            outfile.write('%s\t%d\t%d\t%d\n' % (c.name, s, e, d))
+if args.o is not None:
+    outfile.close()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+
+Prerequisite:
+Python3 or later.
+
+Usage: python query_results.py -db results.sqlite -virus B -dr -min_depth 10
+
+Example:
+python query_results.py -db results.sqlite -ingest result_batch/batch_status.txt
+python query_results.py -db results.sqlite -virus A -exist
+python query_results.py -db results.sqlite -virus B -dr -min_depth 10 -o hhv6b_dr.tsv
+python query_results.py -db results.sqlite -quick_check likely_Full-length
+python query_results.py -db results.sqlite -sql "select stage, avg(wall_sec) from stages group by stage"
+
+Usage details:
+The results database is written by main.py, batch.py, worker.py and quick_check.py with -results_db option. Output directories of earlier runs can be added with -ingest: specify a file listing output directories, one per line, optionally preceded by a sample name and a tab. Samples are named after their output directory unless a name is given, as main.py, batch.py, worker.py and quick_check.py do. batch_status.txt of batch.py can be used as it is; only completed samples are added. All directories are added in one transaction, and a directory added again replaces its previous rows.
+Queries print a tab-delimited table. -virus accepts A, B or a reference ID. Without -dr, rows of virus_detection_summary.txt are searched; with -dr, rows of mapping_DR_summary.txt. -quick_check searches quick check calls instead. -sql runs any SQL on the tables: runs, virus_summary, dr_summary, quick_check, stages and outputs.
+
+Show help message:
+python query_results.py -h
+'''
+
+import os,sys,argparse,sqlite3
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '../scripts'))
+import results_db
+
+hhv6_refids={'A': 'NC_001664.4', 'B': 'NC_000898.1'}
+
+parser=argparse.ArgumentParser(description='')
+parser.add_argument('-db', metavar='str', type=str, help='Required. Specify results database (SQLite).', required=True)
+parser.add_argument('-ingest', metavar='str', type=str, help='Optional. Specify a file listing output directories to add to the database.')
+parser.add_argument('-virus', metavar='str', type=str, help='Optional. Specify A, B or a reference ID of a virus.')
+parser.add_argument('-dr', help='Optional. Specify if you search DR mapping summary instead of virus detection summary.', action='store_true')
+parser.add_argument('-exist', help='Optional. Specify if you output only viruses judged as virus_exist=True. Not available with -dr.', action='store_true')
+parser.add_argument('-min_depth', metavar='float', type=float, help='Optional. Minimum average depth.')
+parser.add_argument('-min_perc', metavar='float', type=float, help='Optional. Minimum percentage of genome mapped.')
+parser.add_argument('-quick_check', metavar='str', type=str, help='Optional. Specify a quick check call (e.g. likely_Full-length) to output.')
+parser.add_argument('-sql', metavar='str', type=str, help='Optional. Specify a SQL query to run.')
+parser.add_argument('-o', metavar='str', type=str, help='Optional. Specify output file name. Otherwise, output result as stdout.')
+args=parser.parse_args()
+
+
+def build_query(args):
+    if args.sql is not None:
+        return args.sql, []
+    if args.quick_check is not None:
+        return 'select r.sample, q.file, q.num_unmapped_read_analyzed, q.num_read_mapped_to_HHV6, q.call, r.outdir from quick_check q join runs r using (run_id) where q.call = ? order by r.sample, q.file', [args.quick_check]
+    table='dr_summary' if args.dr is True else 'virus_summary'
+    conditions,values=[],[]
+    if args.virus is not None:
+        conditions.append('v.refid = ?')
+        values.append(hhv6_refids.get(args.virus, args.virus))
+    if args.exist is True:
+        conditions.append('v.virus_exist = 1')
+    if args.min_depth is not None:
+        conditions.append('v.average_depth >= ?')
+        values.append(args.min_depth)
+    if args.min_perc is not None:
+        conditions.append('v.perc_genome_mapped >= ?')
+        values.append(args.min_perc)
+    where='' if len(conditions) == 0 else ' where '+ ' and '.join(conditions)
+    return 'select r.sample, v.*, r.outdir from %s v join runs r using (run_id)%s order by r.sample, v.refid' % (table, where), values
+
+
+if args.dr is True and args.exist is True:
+    print('Error: -exist is not available with -dr.')
+    exit(1)
+
+if args.ingest is not None:
+    if os.path.exists(args.ingest) is False:
+        print('Error: %s was not found.' % args.ingest)
+        exit(1)
+    runs=[]
+    for sample,outdir in results_db.load_outdirs(args.ingest):
+        if os.path.isdir(outdir) is False:
+            print('Warning: %s was not found. Skipped.' % outdir, file=sys.stderr)
+            continue
+        runs.append(results_db.collect(sample, outdir))
+    conn=results_db.connect(args.db)
+    results_db.insert(conn, runs)
+    conn.close()
+    print('Info: %d output directories were added to %s.' % (len(runs), args.db), file=sys.stderr)
+    if args.sql is None and args.quick_check is None and args.virus is None and args.min_depth is None and args.min_perc is None and args.exist is False:
+        exit(0)
+
+if os.path.exists(args.db) is False:
+    print('Error: %s was not found.' % args.db)
+    exit(1)
+query,values=build_query(args)
+conn=results_db.connect(args.db)
+try:
+    cur=conn.execute(query, values)
+except sqlite3.Error as e:
+    print('Error: %s' % e)
+    exit(1)
+outfile=open(args.o, 'w') if args.o is not None else sys.stdout
+if cur.description is not None:
+    outfile.write('#'+ '\t'.join([ d[0] for d in cur.description if not d[0] == 'run_id' ]) +'\n')
+    keep=[ i for i,d in enumerate(cur.description) if not d[0] == 'run_id' ]
+    for row in cur:
+        outfile.write('\t'.join([ 'NA' if row[i] is None else str(row[i]) for i in keep ]) +'\n')
+conn.commit()
+conn.close()
+if args.o is not None:
+    outfile.close()
@@ -22,7 +22,7 @@ def init(args, version):
     sys.path.insert(0, os.path.join(base, 'scripts'))
 
     # make output dir
-    if args.overwrite is False:
+    if args.overwrite is False and args.resume is False:
         if os.path.exists(args.outdir) is True:
             print('Error: %s already exists. Please specify another directory name.' % args.outdir)
             exit(1)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,sys,datetime,argparse,glob,logging
+
+
+# version
+version='2021/April/27'
+
+
+# args
+parser=argparse.ArgumentParser(description='')
+parser.add_argument('-l', metavar='str', type=str, help='Required. Specify a file listing output directories of main.py or batch.py, one per line, optionally preceded by a sample name and a tab. batch_status.txt of batch.py can be used as it is.')
+parser.add_argument('-vref', metavar='str', type=str, help='Optional. Specify reference of virus genomes, including HHV-6A and B. Default: -vref of the previous runs')
+parser.add_argument('-picard', metavar='str', type=str, help='Required. Specify full path to picard.jar. Example: /path/to/picard/picard.jar')
+parser.add_argument('-reconst_minimum_depth', metavar='int', type=int, help='Optional. Minimum depth for a base to be reconstructed; other bases are masked. Default: 1')
+parser.add_argument('-outdir', metavar='str', type=str, help='Optional. Specify output directory. Default: ./result_joint_call', default='./result_joint_call')
+parser.add_argument('-overwrite', help='Optional. Specify if you overwrite previous results.', action='store_true')
+parser.add_argument('-keep', help='Optional. Specify if you do not want to delete temporary files.', action='store_true')
+parser.add_argument('-p', metavar='int', type=int, help='Optional. Number of threads. Default: 2', default=2)
+parser.add_argument('-v', '--version', help='Print version.', action='store_true')
+parser.set_defaults(resume=False, ONT_bamin=False, ONT_recon_min_depth=None)
+args=parser.parse_args()
+
+
+# start
+import init
+init.init(args, version)
+
+
+# logging
+import log
+args.logfilename='for_debug_joint_call.log'
+if os.path.exists(os.path.join(args.outdir, args.logfilename)) is True:
+    os.remove(os.path.join(args.outdir, args.logfilename))
+log.start_log(args)
+log.logger.debug('Logging started.')
+
+
+# initial check
+import initial_check
+print()
+log.logger.info('You are using version "%s"' % version)
+log.logger.info('Initial check started.')
+initial_check.check_joint_call(args, sys.argv, init.base)
+
+
+# set up
+import setup
+setup.setup(args, init.base)
+params=setup.params
+
+
+# joint calling of HHV-6 carriers and per-sample consensus
+import joint_calling
+joint_calling.run(args, params, init.base)
+
+log.logger.info('All analysis finished!')
@@ -25,8 +25,17 @@ parser.add_argument('-outdir', metavar='str', type=str, help='Optional. Specify
 parser.add_argument('-overwrite', help='Optional. Specify if you overwrite previous results.', action='store_true')
 parser.add_argument('-keep', help='Optional. Specify if you do not want to delete temporary files.', action='store_true')
 parser.add_argument('-p', metavar='int', type=int, help='Optional. Number of threads. 3 or more is recommended. Default: 1', default=1)
+parser.add_argument('-stream', help='Optional. Specify if you stream unmapped reads of all input files into one hisat2 process via stdin. No intermediate FASTQ or SAM file will be written.', action='store_true')
+parser.add_argument('-kmer', help='Optional. Specify if you count HHV-6 reads with the alignment-free k-mer classifier instead of hisat2. The k-mer index of HHV-6 is built once and cached.', action='store_true')
+parser.add_argument('-early_stop', help='Optional. Specify if you stop reading a file as soon as the confidence interval of HHV-6 hit rate falls into one category. The interval is checked after every batch of reads and is Bonferroni-corrected for the number of checks. Only works when specifing -kmer option.', action='store_true')
+parser.add_argument('-resume', help='Optional. Specify if you resume a previous run in -outdir. Files already analyzed (same path, size and mtime) will be skipped and errors in individual files will not stop the analysis.', action='store_true')
+parser.add_argument('-workers', metavar='int', type=int, help='Optional. Number of input files analyzed in parallel. -p is divided among workers. Not available with -stream. Default: 1', default=1)
+parser.add_argument('-results_db', metavar='str', type=str, help='Optional. Specify a SQLite file to store quick check results of all input files. The file is created if absent and can be shared by runs. Query it with helper_scripts/query_results.py.')
+parser.add_argument('-profile', help='Optional. Specify if you profile Python code of each stage with cProfile. Profiles (.pstats) are written to outdir/profile and the hottest functions are shown at the end. With -workers 2 or more, only the main process is profiled; analysis of input files in worker processes is not included.', action='store_true')
+parser.add_argument('-profile_mem', help='Optional. Specify if you also trace memory allocations of each stage with tracemalloc. Only works with -profile. Slows down Python code.', action='store_true')
 parser.add_argument('-v', '--version', help='Print version.', action='store_true')
 parser.add_argument('-singularity', action='store_true', help=argparse.SUPPRESS)
+parser.set_defaults(ONT_bamin=False)
 args=parser.parse_args()
 
 
@@ -38,7 +47,7 @@ init.init(args, version)
 # logging
 import log
 args.logfilename='for_debug_quick_check.log'
-if os.path.exists(os.path.join(args.outdir, args.logfilename)) is True:
+if os.path.exists(os.path.join(args.outdir, args.logfilename)) is True and args.resume is False:
     os.remove(os.path.join(args.outdir, args.logfilename))
 log.start_log(args)
 log.logger.debug('Logging started.')
@@ -65,12 +74,25 @@ filenames=utils.empclass()
 filenames.unmapped       =os.path.join(args.outdir, 'unmapped.fq')
 filenames.mapped_sam     =os.path.join(args.outdir, 'mapped_to_hhv6.sam')
 filenames.final_result   =os.path.join(args.outdir, 'HHV6_check_results.txt')
+filenames.checkpoint     =os.path.join(args.outdir, 'HHV6_check_checkpoint.txt')
+filenames.performance    =os.path.join(args.outdir, 'performance.json')
+filenames.kmer_index     =args.vref +'.k%d.kmer_index.npz' % params.quick_check_kmer_len
+filenames.kmer_index_outdir=os.path.join(args.outdir, os.path.basename(filenames.kmer_index))
 
 
 # quick check
 import quick_checking
 log.logger.info('Quick checking started.')
-quick_checking.load_files(args, params, filenames)
-quick_checking.checking(args, params, filenames)
+import profiling
+with profiling.stage(args, 'quick_check'):
+    quick_checking.load_files(args, params, filenames)
+    quick_checking.checking(args, params, filenames)
+import perf
+perf.save(filenames.performance)
+perf.report(filenames.performance)
+profiling.report(args)
+if args.results_db is not None:
+    import results_db
+    results_db.ingest(args.results_db, [[results_db.sample_name(args.outdir), args.outdir]])
 
 log.logger.info('Quick checking finished!')
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,sys,datetime,argparse,glob,logging
+
+
+# version
+version='2021/April/27'
+
+
+# args
+parser=argparse.ArgumentParser(description='')
+parser.add_argument('-prev_outdir', metavar='str', type=str, help='Required. Specify output directory of a previous run of main.py or batch.py. Dedup BAM, coverage and variant calls in it will be reused.')
+parser.add_argument('-genome_cov_thresholds', metavar='float', type=float, help='Optional. Minimum fraction of a virus genome covered by reads to call the virus as high coverage. Default: 0.05')
+parser.add_argument('-ave_depth_of_mapped_region_threshold', metavar='float', type=float, help='Optional. Minimum average depth of covered regions to call the virus as high coverage. Default: 3')
+parser.add_argument('-reconst_minimum_depth', metavar='int', type=int, help='Optional. Minimum depth for a base to be reconstructed; other bases are masked. Default: 1 (5 for ONT)')
+parser.add_argument('-depth', metavar='int', type=int, help='Optional. Average depth of input BAM/CRAM file. Default: value used in the previous run')
+parser.add_argument('-outdir', metavar='str', type=str, help='Optional. Specify output directory. Default: ./result_reanalysis', default='./result_reanalysis')
+parser.add_argument('-overwrite', help='Optional. Specify if you overwrite previous results.', action='store_true')
+parser.add_argument('-keep', help='Optional. Specify if you do not want to delete temporary files.', action='store_true')
+parser.add_argument('-p', metavar='int', type=int, help='Optional. Number of threads. Default: 2', default=2)
+parser.add_argument('-profile', help='Optional. Specify if you profile Python code of each stage with cProfile. Profiles (.pstats) are written to outdir/profile and the hottest functions are shown at the end.', action='store_true')
+parser.add_argument('-profile_mem', help='Optional. Specify if you also trace memory allocations of each stage with tracemalloc. Only works with -profile. Slows down Python code.', action='store_true')
+parser.add_argument('-v', '--version', help='Print version.', action='store_true')
+parser.set_defaults(resume=False, tmpdir=None, tmpdir_shm=False, cache_dir=None)
+args=parser.parse_args()
+
+
+# start
+import init
+init.init(args, version)
+
+
+# logging
+import log
+args.logfilename='for_debug_reanalysis.log'
+if os.path.exists(os.path.join(args.outdir, args.logfilename)) is True:
+    os.remove(os.path.join(args.outdir, args.logfilename))
+log.start_log(args)
+log.logger.debug('Logging started.')
+
+
+# initial check
+import initial_check
+print()
+log.logger.info('You are using version "%s"' % version)
+log.logger.info('Initial check started.')
+initial_check.check_reanalysis(args, sys.argv, init.base)
+
+
+# options of the previous run, with thresholds and output of this run
+import copy,pipeline
+prev_args=pipeline.load_run_args(os.path.join(args.prev_outdir, 'run_args.json'))
+# scratch and cache of the previous run are not used; its -tmpdir may not exist on this node
+for key in ['tmpdir', 'tmpdir_shm', 'cache_dir']:
+    setattr(prev_args, key, getattr(args, key))
+rargs=copy.copy(prev_args)
+for key in ['outdir', 'logfilename', 'p', 'keep', 'profile', 'profile_mem', 'prev_outdir', 'genome_cov_thresholds', 'ave_depth_of_mapped_region_threshold', 'reconst_minimum_depth', 'tmpdir', 'tmpdir_shm', 'cache_dir']:
+    setattr(rargs, key, getattr(args, key))
+if args.depth is not None:
+    rargs.depth=args.depth
+
+
+# set up
+import setup
+setup.setup(rargs, init.base)
+params=setup.params
+
+
+# identification of high-coverage viruses and consensus
+import reanalysis
+reanalysis.run(rargs, params, prev_args, init.base)
+
+log.logger.info('All analysis finished!')
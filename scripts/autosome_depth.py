@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os
+import log,traceback
+
+
+# flags not counted by `samtools coverage`: unmapped, secondary, QC fail, duplicate
+excluded_flags=0x4 | 0x100 | 0x200 | 0x400
+
+
+def load_autosomes(base, references):
+    # UCSC (chr1) or Ensembl (1) style, whichever matches the header
+    for style in ['ucsc', 'ensembl']:
+        with open(os.path.join(base, 'lib/human_autosomes_%s_style.txt' % style)) as infile:
+            autosomes=[ line.strip() for line in infile if not line.strip() == '' ]
+        if any([ chr in references for chr in autosomes ]):
+            return [ chr for chr in autosomes if chr in references ]
+    return []
+
+
+def windows(lengths, autosomes, n, window_len):
+    # evenly spaced windows on each autosome
+    for chr in autosomes:
+        step=lengths[chr] // n
+        for i in range(n):
+            start=i * step + max(0, (step - window_len) // 2)
+            yield chr, start, min(lengths[chr], start + window_len)
+
+
+def sample_windows(infile, lengths, autosomes, n, window_len):
+    # reads starting in each window; returns mapped reads, aligned bases counted by `samtools coverage` and window length
+    mapped,bases,total_len=0,0,0
+    for chr,start,end in windows(lengths, autosomes, n, window_len):
+        total_len += end - start
+        for read in infile.fetch(chr, start, end):
+            if read.reference_start < start:
+                continue
+            if read.is_unmapped is False:
+                mapped += 1
+            if read.flag & excluded_flags == 0:
+                # reference bases covered by aligned blocks; insertions and soft clips do not add depth, deletions and skips are not covered
+                bases += sum([ e - s for s,e in read.get_blocks() ])
+    return mapped, bases, total_len
+
+
+def estimate(args, params, base):
+    # mean depth of autosomes; the same definition as helper_scripts/calc_mapping_depth.py
+    log.logger.debug('started.')
+    try:
+        import pysam
+        if args.b is not None or args.ONT_bamin is True:
+            path=args.b if args.b is not None else args.ONT_bam
+            infile=pysam.AlignmentFile(path, 'rb', threads=args.p)
+        else:
+            path=args.c
+            infile=pysam.AlignmentFile(path, 'rc', reference_filename=args.fa, format_options=['required_fields=0x%x' % params.depth_auto_cram_required_fields], threads=args.p)
+        with infile:
+            if infile.has_index() is False:
+                log.logger.error('Index of %s was not found. -depth auto needs BAM/CRAM index.' % path)
+                exit(1)
+            lengths=dict(zip(infile.references, infile.lengths))
+            autosomes=load_autosomes(base, lengths)
+            if len(autosomes) == 0:
+                log.logger.error('No human autosome (chr1 or 1 style) was found in %s. Please specify -depth with a number.' % path)
+                exit(1)
+            genome_len=sum([ lengths[chr] for chr in autosomes ])
+            if infile.is_cram is False:
+                # mapped read counts from the BAM index times bases per mapped read, sampled from a few windows
+                counts={ s.contig:s.mapped for s in infile.get_index_statistics() }
+                mapped_reads=sum([ counts.get(chr, 0) for chr in autosomes ])
+                mapped,bases,_=sample_windows(infile, lengths, autosomes, params.depth_auto_bam_windows, params.depth_auto_window_len)
+                if mapped == 0:
+                    depth=0
+                else:
+                    depth= mapped_reads * (bases / mapped) / genome_len
+                method='BAM index'
+            else:
+                # CRAM index has no read counts; reads of evenly spaced windows are decoded
+                _,bases,window_total=sample_windows(infile, lengths, autosomes, params.depth_auto_cram_windows, params.depth_auto_window_len)
+                depth= bases / window_total
+                method='%d CRAM windows' % (params.depth_auto_cram_windows * len(autosomes))
+        log.logger.info('Autosome depth was estimated from %s: %.2f (%d autosomes).' % (method, depth, len(autosomes)))
+        return depth
+    except SystemExit:
+        raise
+    except:
+        log.logger.error('\n'+ traceback.format_exc())
+        exit(1)
+
+
+def resolve(args, params, base):
+    # replaces -depth auto with the estimate
+    if not args.depth == 'auto':
+        return
+    args.depth=int(round(estimate(args, params, base)))
+    if args.depth == 0:
+        log.logger.warning('Estimated autosome depth was 0. ratio_ave_virus_depth_to_autosome_depth will not be calculated.')
+        args.depth=None
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,struct
+from array import array
+
+
+# binary per-base coverage; replaces 1-bp bedgraph of bamCoverage
+# layout: magic, number of contigs, index, then run-length arrays of each contig
+#   index entry: name length (H), name, contig length (Q), covered bases (Q), sum of depth (Q), offset of runs (Q), number of runs (I)
+#   runs: end positions (uint32 x n), then depths (uint32 x n); a run starts at the end of the previous run
+magic=b'HHV6COV1'
+entry_fmt='<QQQQI'
+ont_excluded_flags=0x4 | 0x100 | 0x200 | 0x400
+
+
+class contig:
+    def __init__(self, name, length, covered, depth_sum, offset, n_runs):
+        self.name=name
+        self.length=length
+        self.covered=covered       # bases with depth >= 1
+        self.depth_sum=depth_sum
+        self.offset=offset
+        self.n_runs=n_runs
+
+
+def runs_from_events(events, length):
+    # events: position -> change of depth; returns run ends and depths covering [0, length)
+    ends,depths=array('I'),array('I')
+    pos,cur=0,0
+    for p in sorted(events):
+        d=events[p]
+        if d == 0:
+            continue
+        if p > pos:
+            if len(depths) >= 1 and depths[-1] == cur:
+                ends[-1]=p
+            else:
+                ends.append(p)
+                depths.append(cur)
+            pos=p
+        cur += d
+    if pos < length:
+        if len(depths) >= 1 and depths[-1] == cur:
+            ends[-1]=length
+        else:
+            ends.append(length)
+            depths.append(cur)
+    return ends, depths
+
+
+def bam_coverage(bam_path):
+    # depth of aligned blocks of mapped reads, as bamCoverage with default options; deletions and skips are not covered
+    # yields name, length, run ends, depths for each contig of the indexed BAM
+    import pysam
+    with pysam.AlignmentFile(bam_path) as infile:
+        mapped={ s.contig:s.mapped for s in infile.get_index_statistics() }
+        for name,length in zip(infile.references, infile.lengths):
+            if mapped.get(name, 0) == 0:
+                yield name, length, array('I', [length]), array('I', [0])
+                continue
+            events={}
+            for read in infile.fetch(name):
+                if read.is_unmapped is True:
+                    continue
+                for s,e in read.get_blocks():
+                    events[s]=events.get(s, 0) + 1
+                    events[e]=events.get(e, 0) - 1
+            ends,depths=runs_from_events(events, length)
+            yield name, length, ends, depths
+
+
+def ont_coverage(bam_path, names):
+    # depth of long reads on the given contigs only, by a difference-array sweep of CIGAR operations
+    # M, =, X and D cover a base, N does not; secondary, QC-failed and duplicate alignments are not counted
+    # yields name, length, run ends, depths in the order of the BAM header; names absent from the BAM are skipped
+    import pysam
+    with pysam.AlignmentFile(bam_path) as infile:
+        mapped={ s.contig:s.mapped for s in infile.get_index_statistics() }
+        names=set(names)
+        for name,length in zip(infile.references, infile.lengths):
+            if not name in names:
+                continue
+            if mapped.get(name, 0) == 0:
+                yield name, length, array('I', [length]), array('I', [0])
+                continue
+            diff=array('i', [0]) * (length + 1)
+            for read in infile.fetch(name):
+                if read.flag & ont_excluded_flags:
+                    continue
+                pos=read.reference_start
+                block=pos
+                for op,oplen in read.cigartuples:
+                    if op in (0, 2, 7, 8):
+                        pos += oplen
+                    elif op == 3:
+                        diff[block] += 1
+                        diff[min(pos, length)] -= 1
+                        pos += oplen
+                        block=pos
+                if pos > block:
+                    diff[block] += 1
+                    diff[min(pos, length)] -= 1
+            ends,depths=array('I'),array('I')
+            cur=0
+            for p in range(length):
+                if diff[p] == 0 and p >= 1:
+                    continue
+                cur += diff[p]
+                if len(depths) >= 1 and depths[-1] == cur:
+                    continue
+                if len(depths) >= 1:
+                    ends.append(p)
+                depths.append(cur)
+            ends.append(length)
+            yield name, length, ends, depths
+
+
+def write(path, contigs):
+    # contigs: iterable of (name, length, run ends, depths); written in the order of the iterable
+    entries=[]
+    data=[]
+    offset=0
+    for name,length,ends,depths in contigs:
+        covered,depth_sum,start=0,0,0
+        for e,d in zip(ends, depths):
+            if d >= 1:
+                covered += e - start
+                depth_sum += (e - start) * d
+            start=e
+        entries.append([name.encode(), length, covered, depth_sum, offset, len(ends)])
+        data.append(ends.tobytes())
+        data.append(depths.tobytes())
+        offset += 8 * len(ends)
+    header_len=len(magic) + 4 + sum([ 2 + len(e[0]) + struct.calcsize(entry_fmt) for e in entries ])
+    with open(path +'.tmp', 'wb') as outfile:
+        outfile.write(magic)
+        outfile.write(struct.pack('<I', len(entries)))
+        for name,length,covered,depth_sum,offset,n_runs in entries:
+            outfile.write(struct.pack('<H', len(name)))
+            outfile.write(name)
+            outfile.write(struct.pack(entry_fmt, length, covered, depth_sum, header_len + offset, n_runs))
+        for b in data:
+            outfile.write(b)
+    os.replace(path +'.tmp', path)
+
+
+def read_index(path):
+    # returns contigs in file order
+    with open(path, 'rb') as infile:
+        if not infile.read(len(magic)) == magic:
+            raise ValueError('%s is not a coverage file.' % path)
+        n,=struct.unpack('<I', infile.read(4))
+        contigs=[]
+        size=struct.calcsize(entry_fmt)
+        for _ in range(n):
+            name_len,=struct.unpack('<H', infile.read(2))
+            name=infile.read(name_len).decode()
+            contigs.append(contig(name, *struct.unpack(entry_fmt, infile.read(size))))
+    return contigs
+
+
+def read_runs(path, c):
+    # returns [start, end, depth] of each run of a contig
+    ends,depths=array('I'),array('I')
+    with open(path, 'rb') as infile:
+        infile.seek(c.offset)
+        ends.frombytes(infile.read(4 * c.n_runs))
+        depths.frombytes(infile.read(4 * c.n_runs))
+    runs=[]
+    start=0
+    for e,d in zip(ends, depths):
+        runs.append([start, e, d])
+        start=e
+    return runs
+
+
+def depth_array(path, name):
+    # per-base depth of one contig, or None when the contig is not in the file
+    for c in read_index(path):
+        if c.name == name:
+            depth=array('I')
+            for s,e,d in read_runs(path, c):
+                depth.extend(array('I', [d]) * (e - s))
+            return depth
+    return None
+
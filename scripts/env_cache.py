@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,json,subprocess
+import log,traceback
+import utils
+
+
+# tool paths, versions and reference digests found by previous runs
+# a tool entry is reused while $PATH and the mtime of the executable are unchanged; a digest while size and mtime are unchanged
+cache_version=1
+version_args={'samtools': ['--version'], 'bcftools': ['--version'], 'hisat2': ['--version'], 'gatk': None, 'bwa': None, 'metaspades.py': ['--version'], 'java': None}
+entries=None
+
+
+def cache_path():
+    d=os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(d, 'integrated_HHV6_recon', 'env_cache.json')
+
+
+def load():
+    global entries
+    if entries is None:
+        entries={}
+        try:
+            with open(cache_path()) as infile:
+                d=json.load(infile)
+            if d.get('version') == cache_version:
+                entries=d['entries']
+        except (OSError, ValueError, KeyError):
+            pass
+    return entries
+
+
+def save():
+    # the cache is optional; a read-only home is ignored
+    path=cache_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path +'.%d.tmp' % os.getpid(), 'w') as outfile:
+            json.dump({'version': cache_version, 'entries': entries}, outfile, indent=1)
+        os.replace(path +'.%d.tmp' % os.getpid(), path)
+    except OSError:
+        log.logger.debug('Could not write %s.\n%s' % (path, traceback.format_exc()))
+
+
+def tool_version(path, name):
+    # first line of `tool --version`; only for tools which answer quickly (gatk starts a JVM)
+    if version_args.get(os.path.basename(name)) is None:
+        return None
+    try:
+        out=subprocess.run([path] + version_args[os.path.basename(name)], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=10).stdout
+        lines=out.decode(errors='replace').strip().split('\n')
+        return lines[0].strip() if len(lines[0].strip()) >= 1 else None
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+
+def tool(name, finder):
+    # returns path of an executable; finder is called only when the cached entry is stale
+    d=load()
+    key='tool:%s' % name
+    e=d.get(key)
+    if e is not None and e['PATH'] == os.environ.get('PATH'):
+        try:
+            if os.stat(e['path']).st_mtime_ns == e['mtime_ns']:
+                log.logger.debug('%s found: %s (%s, cached)' % (name, e['path'], e['version']))
+                return e['path']
+        except OSError:
+            pass
+    path=finder(name)
+    if path is None:
+        return None   # not cached, so a tool installed later is found
+    d[key]={'PATH': os.environ.get('PATH'), 'path': path, 'mtime_ns': os.stat(path).st_mtime_ns, 'version': tool_version(path, name)}
+    log.logger.debug('%s version: %s' % (name, d[key]['version']))
+    save()
+    return path
+
+
+def file_digest(path):
+    # utils.file_digest of a large, rarely changing file such as a hisat2 index
+    d=load()
+    path=os.path.abspath(path)
+    key='digest:%s' % path
+    st=os.stat(path)
+    e=d.get(key)
+    if e is not None and e['size'] == st.st_size and e['mtime_ns'] == st.st_mtime_ns:
+        return e['digest']
+    d[key]={'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'digest': utils.file_digest(path)}
+    save()
+    return d[key]['digest']
@@ -8,109 +8,66 @@ See file LICENSE for details.
 
 
 import os
+import utils,covfile
 import log,traceback
-import matplotlib
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
-from pylab import text
 
-matplotlib.rcParams['lines.linewidth']=0.5
-matplotlib.rcParams['axes.linewidth']=0.5
-matplotlib.rcParams['xtick.major.width']=0.5
-matplotlib.rcParams['ytick.major.width']=0.5
-matplotlib.rcParams['font.size']=5
 
+def load_matplotlib():
+    # imported only when there is something to plot; matplotlib dominates start-up time otherwise
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import matplotlib.gridspec as gridspec
+    matplotlib.rcParams['lines.linewidth']=0.5
+    matplotlib.rcParams['axes.linewidth']=0.5
+    matplotlib.rcParams['xtick.major.width']=0.5
+    matplotlib.rcParams['ytick.major.width']=0.5
+    matplotlib.rcParams['font.size']=5
+    return plt, gridspec
 
-def identify_high_cov_virus_from_bedgraph(args, params, filenames):
+
+def identify_high_cov_virus_from_coverage(args, params, filenames):
     log.logger.debug('started.')
     try:
         # load virus names from virus reference seq file
-        virus_names={}
-        with open(args.vref) as infile:
-            for line in infile:
-                if '>' in line:
-                    ls=line.strip().split(' ', 1)
-                    virus_names[ls[0].replace('>', '')]=ls[1]
+        virus_names=utils.load_virus_names(args.vref)
         # identify high cov viruses
-        prev_id='any'
         high_cov=[]
         for_plot_d={}
         for_plot_cov=[]
-        tmp_retain=[]
+        contigs={}
         with open(filenames.summary, 'w') as outfile:
-            with open(filenames.bedgraph) as infile:
-                for line in infile:
-                    ls=line.split()
-                    if ls[0] == prev_id:
-                        if int(float(ls[3])) >= 1:
-                            cov=int(float(ls[3]))
-                            for _ in range(int(ls[1]), int(ls[2])):
-                                covs.append(cov)
+            # stats come from the index of the coverage file; runs are read only for viruses to plot
+            for c in covfile.read_index(filenames.coverage):
+                contigs[c.name]=c
+                total_len=c.length
+                cov_len=c.covered
+                genome_covered= cov_len / total_len
+                ave_depth= c.depth_sum / total_len
+                if cov_len >= 1:
+                    ave_depth_norm= c.depth_sum / cov_len
+                    if args.depth is not None:
+                        ratio_ave_virus_depth_to_autosome_depth= str(ave_depth_norm / args.depth)
                     else:
-                        if not prev_id == 'any':
-                            cov_len=len(covs)
-                            genome_covered= cov_len / total_len
-                            ave_depth= sum(covs) / total_len
-                            if cov_len >= 1:
-                                ave_depth_norm= sum(covs) / cov_len
-                                if args.depth is not None:
-                                    ratio_ave_virus_depth_to_autosome_depth= str(ave_depth_norm / args.depth)
-                                else:
-                                    ratio_ave_virus_depth_to_autosome_depth='NA'
-                                high_cov_judge='False'
-                                if genome_covered >= params.genome_cov_thresholds:
-                                    if ave_depth_norm >= params.ave_depth_of_mapped_region_threshold:
-                                        high_cov.append([prev_id, genome_covered, ave_depth_norm])
-                                        for_plot_d[prev_id]=tmp_retain
-                                        for_plot_cov.append([ave_depth, prev_id])
-                                        high_cov_judge='True'
-                            else:
-                                ave_depth_norm=0
-                                if args.depth is not None:
-                                    ratio_ave_virus_depth_to_autosome_depth='0'
-                                else:
-                                    ratio_ave_virus_depth_to_autosome_depth='NA'
-                                high_cov_judge='False'
-                            outfile.write('%s\tvirus_exist=%s\tgenome_length=%d;mapped_length=%d;perc_genome_mapped=%f;average_depth=%f;average_depth_of_mapped_region=%f;ratio_ave_virus_depth_to_autosome_depth=%s\tfasta_header=%s\n' % (prev_id, high_cov_judge, total_len, cov_len, 100 * genome_covered, ave_depth, ave_depth_norm, ratio_ave_virus_depth_to_autosome_depth, virus_names[prev_id]))
-                            tmp_retain=[]
-                        total_len=0
-                        covs=[]
-                        if int(float(ls[3])) >= 1:
-                            cov=int(float(ls[3]))
-                            for _ in range(int(ls[1]), int(ls[2])):
-                                covs.append(cov)
-                    total_len += int(ls[2]) - int(ls[1])
-                    prev_id=ls[0]
-                    tmp_retain.append([ int(i) for i in ls[1:4] ])
-            cov_len=len(covs)
-            genome_covered= cov_len / total_len
-            ave_depth= sum(covs) / total_len
-            if cov_len >= 1:
-                ave_depth_norm= sum(covs) / cov_len
-                if args.depth is not None:
-                    ratio_ave_virus_depth_to_autosome_depth= str(ave_depth_norm / args.depth)
-                else:
-                    ratio_ave_virus_depth_to_autosome_depth='NA'
-                high_cov_judge='False'
-                if genome_covered >= params.genome_cov_thresholds:
-                    if ave_depth_norm >= params.ave_depth_of_mapped_region_threshold:
-                        high_cov.append([prev_id, genome_covered, ave_depth_norm])
-                        for_plot_d[prev_id]=tmp_retain
-                        for_plot_cov.append([ave_depth, prev_id])
-                        high_cov_judge='True'
-            else:
-                ave_depth_norm=0
-                if args.depth is not None:
-                    ratio_ave_virus_depth_to_autosome_depth='0'
+                        ratio_ave_virus_depth_to_autosome_depth='NA'
+                    high_cov_judge='False'
+                    if genome_covered >= params.genome_cov_thresholds:
+                        if ave_depth_norm >= params.ave_depth_of_mapped_region_threshold:
+                            high_cov.append([c.name, genome_covered, ave_depth_norm])
+                            for_plot_d[c.name]=c
+                            for_plot_cov.append([ave_depth, c.name])
+                            high_cov_judge='True'
                 else:
-                    ratio_ave_virus_depth_to_autosome_depth='NA'
-                high_cov_judge='False'
-            outfile.write('%s\tvirus_exist=%s\tgenome_length=%d;mapped_length=%d;perc_genome_mapped=%f;average_depth=%f;average_depth_of_mapped_region=%f;ratio_ave_virus_depth_to_autosome_depth=%s\tfasta_header=%s\n' % (prev_id, high_cov_judge, total_len, cov_len, 100 * genome_covered, ave_depth, ave_depth_norm, ratio_ave_virus_depth_to_autosome_depth, virus_names[prev_id]))
+                    ave_depth_norm=0
+                    if args.depth is not None:
+                        ratio_ave_virus_depth_to_autosome_depth='0'
+                    else:
+                        ratio_ave_virus_depth_to_autosome_depth='NA'
+                    high_cov_judge='False'
+                outfile.write('%s\tvirus_exist=%s\tgenome_length=%d;mapped_length=%d;perc_genome_mapped=%f;average_depth=%f;average_depth_of_mapped_region=%f;ratio_ave_virus_depth_to_autosome_depth=%s\tfasta_header=%s\n' % (c.name, high_cov_judge, total_len, cov_len, 100 * genome_covered, ave_depth, ave_depth_norm, ratio_ave_virus_depth_to_autosome_depth, virus_names[c.name]))
         if len(high_cov) >= 1:
             if args.ONT_bamin is False:
                 log.logger.info('high_cov_virus=%s' % ';'.join([ l[0] for l in high_cov ]))
-        global hhv6a_highcov
-        global hhv6b_highcov
         high_cov_set=set([ l[0] for l in high_cov ])
         hhv6a_highcov=True if 'NC_001664.4' in high_cov_set else False
         hhv6b_highcov=True if 'NC_000898.1' in high_cov_set else False
@@ -133,11 +90,12 @@ def identify_high_cov_virus_from_bedgraph(args, params, filenames):
             else:
                 for_plot_d_limited=for_plot_d
             # plot all high cov viruses
+            plt,gridspec=load_matplotlib()
             plt.figure(figsize=(5, len(for_plot_d_limited)+1))
             gs=gridspec.GridSpec(len(for_plot_d_limited), 1, height_ratios=[ 1 for i in range(len(for_plot_d_limited)) ])
             nums=[ n for n in range(len(for_plot_d_limited)) ]
             labels=[ id +':'+ virus_names[id] for id in for_plot_d_limited ]
-            data=[ for_plot_d_limited[id] for id in for_plot_d_limited ]
+            data=[ covfile.read_runs(filenames.coverage, for_plot_d_limited[id]) for id in for_plot_d_limited ]
             for dat,n,la in zip(data, nums, labels):
                 ax=plt.subplot(gs[n])
                 x,y,zero=[],[],[]
@@ -152,39 +110,27 @@ def identify_high_cov_virus_from_bedgraph(args, params, filenames):
                 ax.text(0, ymax, la, ha='left', va='top')
             plt.suptitle('Virus(es) with high coverage mapping\n%s' % sample_name)
             plt.savefig(filenames.high_cov_pdf)
+        return hhv6a_highcov, hhv6b_highcov, contigs
         
     except:
         log.logger.error('\n'+ traceback.format_exc())
         exit(1)
 
 
-def judge_AB(args, params, filenames, hhv6a_highcov_orig, hhv6b_highcov_orig):
+def judge_AB(args, params, contigs, hhv6a_highcov_orig, hhv6b_highcov_orig):
+    # contigs: name -> covfile.contig, as returned by identify_high_cov_virus_from_coverage
     log.logger.debug('started.')
     try:
-        a_ave_depth=None
-        b_ave_depth=None
-        global hhv6a_highcov,hhv6b_highcov
         hhv6a_highcov=False
         hhv6b_highcov=False
-        with open(filenames.summary) as infile:
-            for line in infile:
-                ls=line.split()
-                if ls[0] == 'NC_001664.4':
-                    for info in ls[2].split(';'):
-                        if 'average_depth=' in info:
-                            a_ave_depth=float(info.replace('average_depth=', ''))
-                            break
-                if ls[0] == 'NC_000898.1':
-                    for info in ls[2].split(';'):
-                        if 'average_depth=' in info:
-                            b_ave_depth=float(info.replace('average_depth=', ''))
-                            break
-        if a_ave_depth is None:
-            log.logger.error('Summary file does not contain NC_001664.4.')
+        if not 'NC_001664.4' in contigs:
+            log.logger.error('Coverage file does not contain NC_001664.4.')
             exit(1)
-        if b_ave_depth is None:
-            log.logger.error('Summary file does not contain NC_000898.1.')
+        if not 'NC_000898.1' in contigs:
+            log.logger.error('Coverage file does not contain NC_000898.1.')
             exit(1)
+        a_ave_depth=contigs['NC_001664.4'].depth_sum / contigs['NC_001664.4'].length
+        b_ave_depth=contigs['NC_000898.1'].depth_sum / contigs['NC_000898.1'].length
         if a_ave_depth / b_ave_depth > params.ont_hhv6_ratio_threshold:
             hhv6a_highcov=True
             hhv6b_highcov=False
@@ -204,6 +150,7 @@ def judge_AB(args, params, filenames, hhv6a_highcov_orig, hhv6b_highcov_orig):
                 log.logger.info('high_cov_virus=NC_000898.1')
             else:
                 log.logger.info('high_cov_virus=None')
+        return hhv6a_highcov, hhv6b_highcov
     except:
         log.logger.error('\n'+ traceback.format_exc())
         exit(1)
@@ -7,14 +7,15 @@ See file LICENSE for details.
 '''
 
 
-import os,sys,datetime,multiprocessing
+import os,sys,datetime,multiprocessing,importlib.util
 import os
 from os.path import abspath,dirname,realpath,join
 import log,traceback
+import env_cache
 
 
 # http://stackoverflow.com/questions/377017/test-if-executable-exists-in-python
-def which(program):
+def find_exe(program):
     def is_exe(fpath):
         return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
     fpath, fname = os.path.split(program)
@@ -31,6 +32,97 @@ def which(program):
     return None
 
 
+def which(program):
+    return env_cache.tool(program, find_exe)
+
+
+def check_modules(names):
+    # modules are found without importing them; they are imported when a stage needs them
+    for name in names:
+        if importlib.util.find_spec(name) is None:
+            log.logger.error('Python module %s was not found. Please check %s is installed.' % (name, name))
+            exit(1)
+
+
+def check_tools(args):
+    # tools needed by the main pipeline; shared by check() and check_batch()
+    for i in ['samtools', 'bcftools', 'gatk']:
+        if which(i) is None:
+            log.logger.error('%s not found in $PATH. Please check %s is installed and added to PATH.' % (i, i))
+            exit(1)
+    mapper='bwa' if args.bwa is True else 'hisat2'
+    if which(mapper) is None:
+        log.logger.error('%s not found in $PATH. Please check %s is installed and added to PATH.' % (mapper, mapper))
+        exit(1)
+    if args.denovo is True:
+        if which('metaspades.py') is None:
+            log.logger.error('metaspades.py not found in $PATH. Please check metaspades.py is installed and added to PATH.')
+            exit(1)
+
+
+def set_default_refs(args, base):
+    # for singularity
+    if args.singularity is True:
+        if args.vref is None:
+            args.vref='/usr/local/bin/integrated_HHV6_recon/lib/hhv6.fa'
+        if args.vrefindex is None:
+            args.vrefindex='/usr/local/bin/integrated_HHV6_recon/lib/hisat2_index/hhv6'
+        if args.picard is None:
+            args.picard='/usr/local/bin/picard.jar'
+    else:
+        if args.vref is None:
+            args.vref=os.path.join(base, 'lib/hhv6.fa')
+        if args.vrefindex is None:
+            args.vrefindex=os.path.join(base, 'lib/hisat2_index/hhv6')
+
+
+def check_refs(args):
+    if args.picard is None:
+        log.logger.error('Please specify path to picard.jar with `-picard` flag.')
+        exit(1)
+    elif os.path.exists(args.picard) is False:
+        log.logger.error('%s not found. Please check %s is installed.' % (args.picard, args.picard))
+        exit(1)
+    if args.bwa is True:
+        if os.path.exists(args.vrefindex +'.bwt') is False:
+            log.logger.error('bwa index (%s) was not found.' % args.vrefindex)
+            exit(1)
+    elif os.path.exists(args.vrefindex +'.1.ht2') is False:
+        log.logger.error('hisat2 index (%s) was not found.' % args.vrefindex)
+        exit(1)
+
+
+def check_scratch(args):
+    if args.tmpdir is not None:
+        if os.path.isdir(args.tmpdir) is False or os.access(args.tmpdir, os.W_OK) is False:
+            log.logger.error('-tmpdir (%s) is not a writable directory.' % args.tmpdir)
+            exit(1)
+    if args.tmpdir_shm is True:
+        if args.tmpdir is None:
+            log.logger.error('Please specify -tmpdir with -tmpdir_shm option.')
+            exit(1)
+        if os.path.isdir('/dev/shm') is False:
+            log.logger.warning('/dev/shm was not found. -tmpdir will be used for all intermediate files.')
+            args.tmpdir_shm=False
+
+
+def check_cache(args):
+    if args.cache_dir is not None:
+        if args.cache_size_gb <= 0:
+            log.logger.error('Please specify a positive number with -cache_size_gb option.')
+            exit(1)
+        os.makedirs(args.cache_dir, exist_ok=True)
+        log.logger.info('Result cache: %s (up to %.1f GB).' % (args.cache_dir, args.cache_size_gb))
+
+
+def check_results_db(args):
+    if args.results_db is not None:
+        args.results_db=os.path.abspath(args.results_db)
+        if os.access(os.path.dirname(args.results_db), os.W_OK) is False:
+            log.logger.error('Directory of -results_db (%s) is not writable.' % args.results_db)
+            exit(1)
+
+
 def check(args, argv, base):
     log.logger.debug('started')
     try:
@@ -49,61 +141,10 @@ def check(args, argv, base):
             log.logger.error('Too many thread number. Please specify the number less than your cpu cores. You specified = %d, cpu cores = %d.' % (args.p, cpu_num))
             exit(1)
         
-        # check PATH
-        for i in ['samtools', 'bcftools', 'bamCoverage', 'gatk']:
-            if which(i) is None:
-                log.logger.error('%s not found in $PATH. Please check %s is installed and added to PATH.' % (i, i))
-                exit(1)
-        if args.bwa is True:
-            if which('bwa') is None:
-                log.logger.error('bwa not found in $PATH. Please check bwa is installed and added to PATH.')
-                exit(1)
-        else:
-            if which('hisat2') is None:
-                log.logger.error('hisat2 not found in $PATH. Please check hisat2 is installed and added to PATH.')
-                exit(1)
-        if args.denovo is True:
-            if which('metaspades.py') is None:
-                log.logger.error('metaspades.py not found in $PATH. Please check metaspades.py is installed and added to PATH.')
-                exit(1)
-
-
-        # check prerequisite modules
-        import gzip
-        import matplotlib
-        import pysam
-        
-        # for singularity
-        if args.singularity is True:
-            if args.vref is None:
-                args.vref='/usr/local/bin/integrated_HHV6_recon/lib/hhv6.fa'
-            if args.vrefindex is None:
-                args.vrefindex='/usr/local/bin/integrated_HHV6_recon/lib/hisat2_index/hhv6'
-            if args.picard is None:
-                args.picard='/usr/local/bin/picard.jar'
-        else:
-            if args.vref is None:
-                args.vref=os.path.join(base, 'lib/hhv6.fa')
-            if args.vrefindex is None:
-                args.vrefindex=os.path.join(base, 'lib/hisat2_index/hhv6')
-
-        
-        # check file paths
-        if args.picard is None:
-            log.logger.error('Please specify path to picard.jar with `-picard` flag.')
-            exit(1)
-        else:
-            if os.path.exists(args.picard) is False:
-                log.logger.error('%s not found. Please check %s is installed.' % (args.picard, args.picard))
-                exit(1)
-        if args.bwa is True:
-            if os.path.exists(args.vrefindex +'.bwt') is False:
-                log.logger.error('bwa index (%s) was not found.' % args.vrefindex)
-                exit(1)
-        else:
-            if os.path.exists(args.vrefindex +'.1.ht2') is False:
-                log.logger.error('hisat2 index (%s) was not found.' % args.vrefindex)
-                exit(1)
+        check_tools(args)
+        check_modules(['matplotlib', 'pysam'])
+        set_default_refs(args, base)
+        check_refs(args)
         if args.c is not None:
             if args.fa is None:
                 log.logger.error('Reference genome was not specified.')
@@ -156,6 +197,20 @@ def check(args, argv, base):
             if os.path.exists(args.ONT_bam + '.bai') is False:
                 log.logger.warning('BAM index was not found. Making...')
                 pysam.index(args.ONT_bam, '-@ %d' % args.p)
+        if args.depth is not None:
+            if args.depth == 'auto':
+                if args.alignmentin is False and args.ONT_bamin is False:
+                    log.logger.error('-depth auto needs BAM or CRAM input. Please specify -depth with a number.')
+                    exit(1)
+            else:
+                try:
+                    args.depth=int(args.depth)
+                except ValueError:
+                    log.logger.error('Please specify an integer or "auto" with -depth option. You specified = %s.' % args.depth)
+                    exit(1)
+        check_scratch(args)
+        check_cache(args)
+        check_results_db(args)
 
     except SystemExit:
         log.logger.debug('\n'+ traceback.format_exc())
@@ -184,14 +239,26 @@ def check_quick_check(args, argv, base):
             exit(1)
         
         # check PATH
-        for i in ['samtools', 'hisat2']:
+        if args.stream is True and args.kmer is True:
+            log.logger.error('Please specify either -stream or -kmer.')
+            exit(1)
+        if args.workers < 1:
+            log.logger.error('Please specify 1 or more with -workers option.')
+            exit(1)
+        if args.workers >= 2 and args.stream is True:
+            log.logger.error('-workers is not available with -stream option.')
+            exit(1)
+        if args.early_stop is True and args.kmer is False:
+            log.logger.error('-early_stop is only available with -kmer option.')
+            exit(1)
+        tools=['samtools'] if args.kmer is True else ['samtools', 'hisat2']
+        for i in tools:
             if which(i) is None:
                 log.logger.error('%s not found in $PATH. Please check %s is installed and added to PATH.' % (i, i))
                 exit(1)
 
         # check prerequisite modules
-        import gzip
-        import pysam
+        check_modules(['pysam', 'numpy'] if args.kmer is True else ['pysam'])
         
         # for singularity
         if args.singularity is True:
@@ -202,7 +269,11 @@ def check_quick_check(args, argv, base):
             args.vrefindex=os.path.join(base, 'lib/hisat2_index/hhv6')
             
         # check file paths
-        if os.path.exists(args.vrefindex +'.1.ht2') is False:
+        if args.kmer is True:
+            if os.path.exists(args.vref) is False:
+                log.logger.error('HHV-6 reference (%s) was not found.' % args.vref)
+                exit(1)
+        elif os.path.exists(args.vrefindex +'.1.ht2') is False:
             log.logger.error('hisat2 index (%s) was not found.' % args.vrefindex)
             exit(1)
         if args.c is not None or args.cl is not None:
@@ -240,10 +311,166 @@ def check_quick_check(args, argv, base):
             if os.path.exists(args.cl) is False:
                 log.logger.error('Input file (%s) was not found.' % args.cl)
                 exit(1)
+        check_results_db(args)
+        
+    except SystemExit:
+        log.logger.debug('\n'+ traceback.format_exc())
+        exit(1)
+    except:
+        log.logger.error('\n'+ traceback.format_exc())
+        exit(1)
+
+
+def check_batch(args, argv, base):
+    log.logger.debug('started')
+    try:
+        log.logger.debug('command line:\n'+ ' '.join(argv))
+        # check python version
+        version=sys.version_info
+        if (version[0] >= 3) and (version[1] >= 7):
+            log.logger.debug('Python version=%d.%d.%d' % (version[0], version[1], version[2]))
+        else:
+            log.logger.error('Please use Python 3.7 or later. Your Python is version %d.%d.' % (version[0], version[1]))
+            exit(1)
+        
+        # check cpu num and memory
+        cpu_num=multiprocessing.cpu_count()
+        if args.p > cpu_num:
+            log.logger.error('Too many thread number. Please specify the number less than your cpu cores. You specified = %d, cpu cores = %d.' % (args.p, cpu_num))
+            exit(1)
+        if args.p_per_sample < 1 or args.max_io < 1:
+            log.logger.error('Please specify 1 or more with -p_per_sample and -max_io options.')
+            exit(1)
+        if args.mem is None:
+            args.mem= 0.8 * os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / (1024 ** 3)
+        log.logger.info('Resource budget: %d threads, %.1f GB memory.' % (args.p, args.mem))
+        
+        check_tools(args)
+        check_modules(['matplotlib', 'pysam'])
+        set_default_refs(args, base)
+        check_refs(args)
+        if args.fa is not None and os.path.exists(args.fa) is False:
+            log.logger.error('Reference genome (%s) was not found.' % args.fa)
+            exit(1)
+        if args.spool is not None:
+            if os.path.isdir(args.spool) is False:
+                log.logger.error('Spool directory (%s) was not found.' % args.spool)
+                exit(1)
+        elif args.sample_sheet is None:
+            log.logger.error('Please specify sample sheet with -sample_sheet option.')
+            exit(1)
+        elif os.path.exists(args.sample_sheet) is False:
+            log.logger.error('Sample sheet (%s) was not found.' % args.sample_sheet)
+            exit(1)
+        check_scratch(args)
+        check_cache(args)
+        check_results_db(args)
+
+    except SystemExit:
+        log.logger.debug('\n'+ traceback.format_exc())
+        exit(1)
+    except:
+        log.logger.error('\n'+ traceback.format_exc())
+        exit(1)
+
+
+def check_reanalysis(args, argv, base):
+    log.logger.debug('started')
+    try:
+        log.logger.debug('command line:\n'+ ' '.join(argv))
+        # check python version
+        version=sys.version_info
+        if (version[0] >= 3) and (version[1] >= 7):
+            log.logger.debug('Python version=%d.%d.%d' % (version[0], version[1], version[2]))
+        else:
+            log.logger.error('Please use Python 3.7 or later. Your Python is version %d.%d.' % (version[0], version[1]))
+            exit(1)
+        
+        # check cpu num
+        cpu_num=multiprocessing.cpu_count()
+        if args.p > cpu_num:
+            log.logger.error('Too many thread number. Please specify the number less than your cpu cores. You specified = %d, cpu cores = %d.' % (args.p, cpu_num))
+            exit(1)
+        
+        # check PATH; picard and gatk are needed when a virus is newly judged as high coverage
+        for i in ['bcftools', 'gatk']:
+            if which(i) is None:
+                log.logger.error('%s not found in $PATH. Please check %s is installed and added to PATH.' % (i, i))
+                exit(1)
+        
+        # check prerequisite modules
+        check_modules(['matplotlib', 'pysam'])
+        
+        # check file paths
+        if args.prev_outdir is None:
+            log.logger.error('Please specify output directory of a previous run with -prev_outdir option.')
+            exit(1)
+        elif os.path.exists(os.path.join(args.prev_outdir, 'run_args.json')) is False:
+            log.logger.error('%s was not found. Please rerun the pipeline with the current version and -resume option.' % os.path.join(args.prev_outdir, 'run_args.json'))
+            exit(1)
+        elif os.path.abspath(args.prev_outdir) == os.path.abspath(args.outdir):
+            log.logger.error('Please specify a different directory with -outdir option.')
+            exit(1)
+        if args.genome_cov_thresholds is not None and not 0 <= args.genome_cov_thresholds <= 1:
+            log.logger.error('Please specify a number between 0 and 1 with -genome_cov_thresholds option.')
+            exit(1)
+
+    except SystemExit:
+        log.logger.debug('\n'+ traceback.format_exc())
+        exit(1)
+    except:
+        log.logger.error('\n'+ traceback.format_exc())
+        exit(1)
+
+
+def check_joint_call(args, argv, base):
+    log.logger.debug('started')
+    try:
+        log.logger.debug('command line:\n'+ ' '.join(argv))
+        # check python version
+        version=sys.version_info
+        if (version[0] >= 3) and (version[1] >= 7):
+            log.logger.debug('Python version=%d.%d.%d' % (version[0], version[1], version[2]))
+        else:
+            log.logger.error('Please use Python 3.7 or later. Your Python is version %d.%d.' % (version[0], version[1]))
+            exit(1)
+        
+        # check cpu num
+        cpu_num=multiprocessing.cpu_count()
+        if args.p > cpu_num:
+            log.logger.error('Too many thread number. Please specify the number less than your cpu cores. You specified = %d, cpu cores = %d.' % (args.p, cpu_num))
+            exit(1)
+        
+        # check PATH
+        for i in ['bcftools', 'gatk', 'java']:
+            if which(i) is None:
+                log.logger.error('%s not found in $PATH. Please check %s is installed and added to PATH.' % (i, i))
+                exit(1)
         
+        # check prerequisite modules
+        check_modules(['pysam'])
+        
+        # check file paths
+        if args.l is None:
+            log.logger.error('Please specify a list of output directories with -l option.')
+            exit(1)
+        elif os.path.exists(args.l) is False:
+            log.logger.error('%s was not found.' % args.l)
+            exit(1)
+        if args.picard is None:
+            log.logger.error('Please specify picard.jar with -picard option.')
+            exit(1)
+        elif os.path.exists(args.picard) is False:
+            log.logger.error('%s was not found.' % args.picard)
+            exit(1)
+        if args.vref is not None and os.path.exists(args.vref) is False:
+            log.logger.error('%s was not found.' % args.vref)
+            exit(1)
+
     except SystemExit:
         log.logger.debug('\n'+ traceback.format_exc())
         exit(1)
     except:
         log.logger.error('\n'+ traceback.format_exc())
         exit(1)
+
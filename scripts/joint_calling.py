@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,shutil,multiprocessing
+import log,traceback
+import runner,threads,perf
+import pipeline,utils,results_db
+
+
+def load_sample(args, base, name, outdir):
+    # previous run of one sample; returns None when its results cannot be used
+    path=os.path.join(outdir, 'run_args.json')
+    if os.path.exists(path) is False:
+        log.logger.warning('sample=%s: %s was not found. Skipped.' % (name, path))
+        return None
+    prev_args=pipeline.load_run_args(path)
+    if getattr(prev_args, 'ONT_bamin', False) is True:
+        log.logger.warning('sample=%s: %s was analyzed with -ONT_bamin. Long reads are not joint-called with short reads. Skipped.' % (name, outdir))
+        return None
+    prev_args.outdir=outdir
+    prev_args.tmpdir=None   # only result files are read; no scratch directory is made for the sample
+    s=utils.empclass()
+    s.name=name
+    s.vref=prev_args.vref
+    s.filenames=pipeline.set_filenames(prev_args, base)
+    for path in [s.filenames.summary, s.filenames.coverage, s.filenames.mapped_to_virus_bam]:
+        if os.path.exists(path) is False:
+            log.logger.warning('sample=%s: %s was not found. Skipped.' % (name, path))
+            return None
+    s.exist=set([ r['refid'] for r in results_db.parse_summary(s.filenames.summary) if r.get('virus_exist') == 'True' ])
+    return s
+
+
+def extract_reads(job):
+    # reads of one virus with a per-sample read group, so samples are kept apart in the joint call; no JVM per sample
+    bam_path,refid,name,out_path=job
+    import pysam
+    try:
+        with pysam.AlignmentFile(bam_path) as infile:
+            header=infile.header.to_dict()
+            header['RG']=[{'ID': name, 'SM': name, 'LB': 'lib1', 'PL': 'ILLUMINA', 'PU': 'unit1'}]
+            reads=infile.fetch(refid) if infile.has_index() is True else infile.fetch(until_eof=True)
+            with pysam.AlignmentFile(out_path, 'wb', header=header) as outfile:
+                for read in reads:
+                    if not read.reference_name == refid:
+                        continue
+                    read.set_tag('RG', name)
+                    outfile.write(read)
+        pysam.index(out_path)
+        return None
+    except:
+        return traceback.format_exc()
+
+
+def consensus(job):
+    # per-sample VCF from the cohort VCF, then the same norm and consensus as the per-sample reconstruction
+    args,params,s,refid,ref_fa,vcf_gz,workdir,out_fa=job
+    import reconstruct_hhv6
+    try:
+        f=utils.empclass()
+        f.coverage=s.filenames.coverage
+        f.tmp_masked_fa=os.path.join(workdir, '%s.masked.fa' % s.name)
+        orig_fa=os.path.join(workdir, '%s.fa' % s.name)
+        _,seq=utils.retrieve_only_one_virus_fasta(ref_fa, refid)
+        with open(orig_fa, 'w') as outfile:
+            outfile.write('>%s %s\n%s\n' % (refid, s.name, seq))
+        reconstruct_hhv6.mask_low_depth(args, params, f, orig_fa, refid)
+        sample_vcf=os.path.join(workdir, '%s.vcf.gz' % s.name)
+        norm_vcf=os.path.join(workdir, '%s.norm.vcf.gz' % s.name)
+        for cmd in [['bcftools', 'view', '-s', s.name, '-a', '-c', '1', '-Oz', '-o', sample_vcf, vcf_gz],
+                    ['bcftools', 'norm', '-c', 'x', '-f', f.tmp_masked_fa, sample_vcf, '-Oz', '-o', norm_vcf],
+                    ['bcftools', 'index', norm_vcf],
+                    ['bcftools', 'consensus', '-H', 'A', '-f', f.tmp_masked_fa, '-o', out_fa, norm_vcf]]:
+            if not runner.run(cmd) == 0:
+                return 'Error occurred during bcftools running (sample=%s).' % s.name
+        n=0
+        import pysam
+        with pysam.VariantFile(norm_vcf) as infile:
+            for _ in infile:
+                n += 1
+        return n
+    except SystemExit:
+        return 'Masking of low depth regions failed (sample=%s).' % s.name
+    except:
+        return traceback.format_exc()
+
+
+def joint_call(args, params, refid, virus, carriers, pool):
+    log.logger.debug('started.')
+    try:
+        workdir=os.path.join(args.outdir, 'tmp_%s' % virus)
+        os.makedirs(workdir, exist_ok=True)
+        vcf_gz=os.path.join(args.outdir, 'cohort_%s.vcf.gz' % virus)
+        fasta_dir=os.path.join(args.outdir, 'consensus')
+        os.makedirs(fasta_dir, exist_ok=True)
+
+        # reference is prepared once for all carriers
+        ref_fa=os.path.join(workdir, '%s.fa' % virus)
+        ref_dict=os.path.join(workdir, '%s.dict' % virus)
+        _,seq=utils.retrieve_only_one_virus_fasta(args.vref, refid)
+        with open(ref_fa, 'w') as outfile:
+            outfile.write('>%s\n%s\n' % (refid, seq))
+        import pysam
+        pysam.faidx(ref_fa)
+        dict_job=runner.start(['java', '-Xmx%dm' % int(params.picard_java_heap_gb * 1024), threads.jvm_gc(1), '-jar', args.picard, 'CreateSequenceDictionary', 'R=%s' % ref_fa, 'O=%s' % ref_dict])
+
+        # reads of each carrier
+        # a sample whose reads cannot be extracted is dropped from the cohort
+        jobs=[ [s.filenames.mapped_to_virus_bam, refid, s.name, os.path.join(workdir, '%s.bam' % s.name)] for s in carriers ]
+        rets=pool.map(extract_reads, jobs)
+        results=[]
+        for s,ret in zip(carriers, rets):
+            if ret is not None:
+                log.logger.warning('sample=%s: reads of %s could not be extracted. Skipped.\n%s' % (s.name, virus, ret))
+                results.append([s.name, virus, 'NA', 'NA'])
+        jobs=[ job for job,ret in zip(jobs, rets) if ret is None ]
+        carriers=[ s for s,ret in zip(carriers, rets) if ret is None ]
+        if len(carriers) == 0:
+            log.logger.warning('No %s carrier was left for joint calling.' % virus)
+            dict_job.wait()
+            return results
+        if not dict_job.wait() == 0:
+            log.logger.error('Error occurred during picard running.')
+            exit(1)
+        bam_list=os.path.join(workdir, 'inputs.list')
+        with open(bam_list, 'w') as outfile:
+            for job in jobs:
+                outfile.write(job[3] +'\n')
+
+        # one HaplotypeCaller for all carriers
+        log.logger.info('Joint calling of %s started (%d samples).' % (virus, len(carriers)))
+        cmd=['gatk', '--java-options', '-Xmx%dg' % params.joint_gatk_java_heap_gb, 'HaplotypeCaller', '--native-pair-hmm-threads', threads.useful('HaplotypeCaller', args.p), '-R', ref_fa, '-I', bam_list, '-O', vcf_gz]
+        if not runner.run(cmd, limits=runner.budget(args, params.joint_gatk_java_heap_gb + params.jvm_overhead_gb)) == 0:
+            log.logger.error('Error occurred during gatk running.')
+            exit(1)
+
+        # consensus of each carrier
+        jobs=[ [args, params, s, refid, ref_fa, vcf_gz, workdir, os.path.join(fasta_dir, '%s_%s_reconstructed.fa' % (s.name, virus))] for s in carriers ]
+        for s,job,ret in zip(carriers, jobs, pool.map(consensus, jobs)):
+            if isinstance(ret, int) is False:
+                log.logger.warning('sample=%s: consensus of %s could not be made.\n%s' % (s.name, virus, ret))
+                results.append([s.name, virus, 'NA', 'NA'])
+                continue
+            results.append([s.name, virus, str(ret), job[7]])
+        if args.keep is False:
+            shutil.rmtree(workdir)
+        return results
+    except SystemExit:
+        raise
+    except:
+        log.logger.error('\n'+ traceback.format_exc())
+        exit(1)
+
+
+def run(args, params, base):
+    log.logger.debug('started.')
+    try:
+        samples=[]
+        for name,outdir in results_db.load_outdirs(args.l):
+            s=load_sample(args, base, name, outdir)
+            if s is not None:
+                samples.append(s)
+        if len(set([ s.name for s in samples ])) < len(samples):
+            log.logger.error('Sample names in %s are not unique.' % args.l)
+            exit(1)
+        if args.vref is None:
+            vrefs=set([ s.vref for s in samples ])
+            if len(vrefs) >= 2:
+                log.logger.error('Samples were analyzed with different -vref. Please specify -vref.')
+                exit(1)
+            args.vref=vrefs.pop() if len(vrefs) == 1 else None
+        log.logger.info('%d sample(s) were loaded.' % len(samples))
+        results=[]
+        with multiprocessing.get_context('fork').Pool(args.p) as pool:
+            for refid,virus in [[pipeline.hhv6a_refid, 'hhv6a'], [pipeline.hhv6b_refid, 'hhv6b']]:
+                carriers=[ s for s in samples if refid in s.exist ]
+                if len(carriers) == 0:
+                    log.logger.info('No %s carrier was found.' % virus)
+                    continue
+                perf.start_stage('joint_%s' % virus)
+                results.extend(joint_call(args, params, refid, virus, carriers, pool))
+                perf.end_stage()
+        with open(os.path.join(args.outdir, 'cohort_summary.txt'), 'w') as outfile:
+            outfile.write('#sample\tvirus\tnum_variants\treconstructed_fasta\n')
+            for r in results:
+                outfile.write('\t'.join(r) +'\n')
+        perf.save(os.path.join(args.outdir, 'performance.json'))
+        perf.report(os.path.join(args.outdir, 'performance.json'))
+    except SystemExit:
+        raise
+    except:
+        log.logger.error('\n'+ traceback.format_exc())
+        exit(1)
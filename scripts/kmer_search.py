@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,json
+import numpy as np
+import utils
+import log,traceback
+
+
+# alignment-free counting of reads for quick check -kmer
+# index: forward strand of all contigs as one array of base codes, and 2-bit packed k-mers (k <= 32) sorted with their positions;
+# reverse-strand hits are found by looking up seeds of the reverse complement of each read
+index_version=3
+base_code=np.full(256, 5, dtype=np.uint8)   # A, C, G, T = 0-3, N = 4, others = 5
+for i,c in enumerate('ACGT'):
+    base_code[ord(c)]=i
+    base_code[ord(c.lower())]=i
+base_code[ord('N')]=4
+base_code[ord('n')]=4
+complement_code=np.array([3, 2, 1, 0, 4, 5], dtype=np.uint8)
+
+# candidate alignments scored at once; bounds the memory of the read x base matrices
+score_chunk=20_000
+# leading bits of packed k-mers in the occupancy table; most seeds of non-viral reads are rejected by it without a binary search
+bucket_bits=24
+
+
+def encode(s):
+    return base_code[np.frombuffer(s.encode(), dtype=np.uint8)]
+
+
+def pack(codes, k):
+    # k-mers starting at each position of a 1-D array of base codes; returns packed k-mers and whether they are free of N
+    n=len(codes) - k + 1
+    packed=np.zeros(n, dtype=np.uint64)
+    valid=np.ones(n, dtype=bool)
+    for j in range(k):
+        c=codes[j:j + n]
+        packed=(packed << np.uint64(2)) | (c & 3).astype(np.uint64)
+        valid &= c < 4
+    return packed, valid
+
+
+def build_index(fasta, k):
+    if k > 32:
+        log.logger.error('k-mer length must be 32 or less for the 2-bit packed index. You specified = %d.' % k)
+        exit(1)
+    seqs=[ encode(seq) for seq in utils.parse_fasta(fasta).values() ]
+    starts=np.zeros(len(seqs) + 1, dtype=np.int64)
+    starts[1:]=np.cumsum([ len(s) for s in seqs ])
+    ref=np.concatenate(seqs) if len(seqs) >= 1 else np.zeros(0, dtype=np.uint8)
+    kmers,locs=[],[]
+    for ci,s in enumerate(seqs):
+        if len(s) < k:
+            continue
+        packed,valid=pack(s, k)
+        kmers.append(packed[valid])
+        locs.append(np.nonzero(valid)[0] + starts[ci])
+    kmers=np.concatenate(kmers) if len(kmers) >= 1 else np.zeros(0, dtype=np.uint64)
+    locs=np.concatenate(locs) if len(locs) >= 1 else np.zeros(0, dtype=np.int64)
+    order=np.argsort(kmers, kind='stable')
+    return ref, starts, kmers[order], locs[order].astype(np.uint32 if len(ref) < 2 ** 32 else np.int64)
+
+
+def with_buckets(index, k):
+    # whether any k-mer starts with each value of the leading bits; built on load, so the cached file holds only the k-mers
+    ref,starts,kmers,locs=index
+    bits=min(bucket_bits, 2 * k)
+    occupied=np.zeros(2 ** bits, dtype=bool)
+    occupied[(kmers >> np.uint64(2 * k - bits)).astype(np.int64)]=True
+    return ref, starts, kmers, locs, occupied
+
+
+def load_index(args, params, filenames):
+    k=params.quick_check_kmer_len
+    stat=os.stat(args.vref)
+    key=json.dumps([index_version, k, os.path.abspath(args.vref), stat.st_size, stat.st_mtime])
+    # .npz read without pickle, so a file planted in -outdir cannot run code; anything unexpected is ignored and the index is rebuilt
+    for path in [filenames.kmer_index, filenames.kmer_index_outdir]:
+        if os.path.exists(path) is True:
+            try:
+                with open(path, 'rb') as infile, np.load(infile, allow_pickle=False) as cached:
+                    if str(cached['key']) == key:
+                        index=cached['ref'], cached['starts'], cached['kmers'], cached['locs']
+                        log.logger.info('Cached k-mer index (%s) was loaded.' % path)
+                        return with_buckets(index, k)
+            except (OSError, ValueError, KeyError):
+                log.logger.debug('Could not load k-mer index from %s.' % path)
+    log.logger.info('Building k-mer index of %s, k=%d.' % (args.vref, k))
+    index=build_index(args.vref, k)
+    for path in [filenames.kmer_index, filenames.kmer_index_outdir]:
+        try:
+            with open(path +'.tmp', 'wb') as outfile:
+                np.savez(outfile, key=np.array(key), ref=index[0], starts=index[1], kmers=index[2], locs=index[3])
+            os.replace(path +'.tmp', path)
+            log.logger.debug('k-mer index was cached to %s.' % path)
+            break
+        except OSError:
+            log.logger.debug('Could not write k-mer index to %s.' % path)
+    return with_buckets(index, k)
+
+
+def seed_offsets(readlen, k, step):
+    # overlapping seeds; a read is missed only when every seed has a mismatch
+    offsets=list(range(0, readlen - k + 1, step))
+    if not offsets[-1] == readlen - k:
+        offsets.append(readlen - k)
+    return np.array(offsets, dtype=np.int64)
+
+
+def pack_seeds(reads, offsets, k):
+    # packed k-mers at the given offsets of each read (n x readlen base codes), built from 4-base bytes; and whether they are free of N
+    n,readlen=reads.shape
+    base=reads & 3
+    quad=(base[:, :readlen - 3] << 6) | (base[:, 1:readlen - 2] << 4) | (base[:, 2:readlen - 1] << 2) | base[:, 3:]
+    packed=np.zeros((n, len(offsets)), dtype=np.uint64)
+    for j in range(0, k - k % 4, 4):
+        packed=(packed << np.uint64(8)) | quad[:, offsets + j]
+    for j in range(k - k % 4, k):
+        packed=(packed << np.uint64(2)) | base[:, offsets + j]
+    valid=np.ones((n, len(offsets)), dtype=bool)
+    with_n=np.flatnonzero((reads >= 4).any(axis=1))
+    if len(with_n) >= 1:
+        n_count=np.zeros((len(with_n), readlen + 1), dtype=np.int32)
+        np.cumsum(reads[with_n] >= 4, axis=1, out=n_count[:, 1:])
+        valid[with_n]=n_count[:, offsets + k] == n_count[:, offsets]
+    return packed, valid
+
+
+def reverse_complement_packed(packed, k):
+    # complement is XOR with 3; 2-bit groups are reversed within bytes, then bytes are reversed
+    x=packed ^ np.uint64(2 ** (2 * k) - 1)
+    x=((x >> np.uint64(2)) & np.uint64(0x3333333333333333)) | ((x & np.uint64(0x3333333333333333)) << np.uint64(2))
+    x=((x >> np.uint64(4)) & np.uint64(0x0f0f0f0f0f0f0f0f)) | ((x & np.uint64(0x0f0f0f0f0f0f0f0f)) << np.uint64(4))
+    return x.byteswap() >> np.uint64(64 - 2 * k)
+
+
+def candidates(index, packed, valid, offsets, readlen, k):
+    # exact seed hits; packed and valid: seeds at offsets of each read (n x offsets)
+    # returns unique (read, start on ref) whose whole read lies in one contig
+    ref,starts,kmers,locs,occupied=index
+    packed,valid=packed.ravel(),valid.ravel()
+    bits=len(occupied).bit_length() - 1
+    b=(packed >> np.uint64(2 * k - bits)).astype(np.int64)
+    seed=np.flatnonzero(valid & occupied[b])
+    packed=packed[seed]
+    lo=np.searchsorted(kmers, packed, 'left')
+    counts=np.searchsorted(kmers, packed, 'right') - lo
+    hit=counts > 0
+    seed,lo,counts=seed[hit],lo[hit],counts[hit]
+    if len(counts) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    # one row per occurrence of a seed k-mer in the reference
+    first=np.cumsum(counts) - counts
+    loc=locs[np.arange(counts.sum()) - np.repeat(first, counts) + np.repeat(lo, counts)].astype(np.int64)
+    seed=np.repeat(seed, counts)
+    read_i=seed // len(offsets)
+    start=loc - offsets[seed % len(offsets)]
+    contig=np.searchsorted(starts, loc, 'right') - 1
+    inside=(start >= starts[contig]) & (start + readlen <= starts[contig + 1])
+    pair=np.unique(read_i[inside] * (len(ref) + 1) + start[inside])
+    return pair // (len(ref) + 1), pair % (len(ref) + 1)
+
+
+def count_alignments(params, batch, index):
+    # emulates full-length (CIGAR=readlenM) hisat2 alignments: candidate loci from exact k-mer seeds,
+    # then ungapped end-to-end scoring with hisat2 default penalties (--mp, --np 1, --score-min L,0,-0.2, -k 5)
+    # returns number of alignments, as counted from hisat2 SAM, and number of reads with at least one alignment
+    ref=index[0]
+    k=params.quick_check_kmer_len
+    mx,mn=[ int(i) for i in params.hisat2_mismatch_penalties.split(',') ]
+    by_len={}
+    for seq,qual in batch:
+        if len(seq) >= k:
+            by_len.setdefault(len(seq), []).append((seq, qual))
+    mapped_n=0
+    mapped_reads=0
+    for readlen,group in by_len.items():
+        n=len(group)
+        reads=encode(''.join([ s for s,_ in group ])).reshape(n, readlen)
+        quals=np.frombuffer(''.join([ q for _,q in group ]).encode(), dtype=np.uint8).reshape(n, readlen)
+        max_penalty= 0.2 * readlen
+        offsets=seed_offsets(readlen, k, params.quick_check_kmer_seed_step)
+        n_aln=np.zeros(n, dtype=np.int64)
+        packed,valid=pack_seeds(reads, offsets, k)
+        cols=np.arange(readlen)
+        for strand in [0, 1]:
+            if strand == 1:
+                # seeds of the reverse complement of a read are those of the read, at mirrored offsets
+                packed=reverse_complement_packed(packed, k)
+                offsets=readlen - k - offsets
+            read_i,start=candidates(index, packed, valid, offsets, readlen, k)
+            for c in range(0, len(read_i), score_chunk):
+                r=read_i[c:c + score_chunk]
+                s=reads[r]
+                q=quals[r]
+                if strand == 1:
+                    s=complement_code[s[:, ::-1]]
+                    q=q[:, ::-1]
+                w=ref[start[c:c + score_chunk, None] + cols]
+                # mismatches cost by base quality, those with N cost 1
+                penalty=mn + ((mx - mn) * np.minimum(q.astype(np.int32) - 33, 40)) // 40
+                penalty=np.where((s == 4) | (w == 4), 1, penalty)
+                penalty=np.where(s == w, 0, penalty).sum(axis=1)
+                n_aln += np.bincount(r[penalty <= max_penalty], minlength=n)
+        mapped_n += int(np.minimum(n_aln, 5).sum())
+        mapped_reads += int((n_aln >= 1).sum())
+    return mapped_n, mapped_reads
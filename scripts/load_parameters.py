@@ -18,7 +18,6 @@ class load:
             self.ave_depth_of_mapped_region_threshold=3    # Defining high coverage viruses relies greatly on this parameter
             self.hisat2_mismatch_penalties='2,1'
             self.min_seq_len=20
-            self.bedgraph_bin=1
             self.reconst_minimum_depth=1
             if args.ONT_bamin is True:
                 self.reconst_minimum_depth=5
@@ -29,10 +28,32 @@ class load:
                     self.reconst_minimum_depth= int(args.ONT_recon_min_depth)
                     log.logger.info('%s was specified with -ONT_recon_min_depth flag. It will use %s.' % (args.ONT_recon_min_depth, args.ONT_recon_min_depth))
                 self.ont_hhv6_ratio_threshold=2
+                self.ont_consensus_window_len=10000   # windows of the long-read pileup consensus, built in parallel
+            # overrides by reanalyze.py
+            for key in ['genome_cov_thresholds', 'ave_depth_of_mapped_region_threshold', 'reconst_minimum_depth']:
+                if getattr(args, key, None) is not None:
+                    setattr(self, key, getattr(args, key))
+                    log.logger.info('%s=%s was specified.' % (key, str(getattr(args, key))))
             self.gzip_compresslevel=1
+            self.cram_required_fields= 0x1 | 0x2 | 0x4 | 0x8 | 0x200 | 0x400   # htslib SAM_QNAME|SAM_FLAG|SAM_RNAME|SAM_POS|SAM_SEQ|SAM_QUAL
             self.metaspades_kmer='21,33,55'
             self.metaspades_memory=4
+            self.markdup_java_heap_gb=5.25   # -Xmx5376m of MarkDuplicates
+            self.gatk_java_heap_gb=4         # -Xmx4g of HaplotypeCaller
+            self.picard_java_heap_gb=1       # CreateSequenceDictionary and AddOrReplaceReadGroups, run concurrently
+            self.joint_gatk_java_heap_gb=8   # one HaplotypeCaller for all carriers of a cohort
+            self.jvm_overhead_gb=1
+            self.depth_auto_window_len=10000
+            self.depth_auto_bam_windows=5      # per autosome, for bases per mapped read
+            self.depth_auto_cram_windows=20    # per autosome
+            self.depth_auto_cram_required_fields= 0x2 | 0x4 | 0x8 | 0x20   # htslib SAM_FLAG|SAM_RNAME|SAM_POS|SAM_CIGAR
             self.quick_check_read_num=1000000
+            self.quick_check_kmer_len=16
+            self.quick_check_kmer_seed_step=4     # offsets of seeds in a read; smaller is more sensitive to reads with scattered mismatches
+            self.quick_check_kmer_batch=100_000
+            self.quick_check_early_stop_batch=20_000
+            self.quick_check_early_stop_min_reads=20_000
+            self.quick_check_early_stop_confidence=0.95
             
             params_for_debug=[]
             for k,v in self.__dict__.items():
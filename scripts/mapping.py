@@ -7,48 +7,40 @@ See file LICENSE for details.
 '''
 
 
-import os,sys,subprocess,pysam
-import utils
+import os,sys,pysam
+import utils,covfile
 import log,traceback
+import runner,threads
 
 
 def map_to_viruses(args, params, filenames):
     log.logger.debug('started.')
     try:
-        if args.p <= 2:
-            thread_n=args.p
-        elif args.p >= 3:
-            thread_n=args.p - 1
+        # the aligner and samtools view run side by side
+        aligner='bwa' if args.bwa is True else 'hisat2'
+        thread_n,view_n=threads.split(args.p, [aligner, 'samtools view'])
         if args.bwa is True:
-            cmd='bwa mem -Y -t %d %s %s %s | samtools view -Sbh -o %s -' % (thread_n, args.vrefindex, filenames.unmapped_merged_1, filenames.unmapped_merged_2, filenames.mapped_unsorted_bam)
+            cmd=['bwa', 'mem', '-Y', '-t', thread_n, args.vrefindex, filenames.unmapped_merged_1, filenames.unmapped_merged_2]
         elif args.fastqin is True and args.single is True:
-            cmd='hisat2 --mp %s -t -x %s -p %d -U %s --no-spliced-alignment | samtools view -Sbh -o %s -' % (params.hisat2_mismatch_penalties, args.vrefindex, thread_n, filenames.unmapped_merged_1, filenames.mapped_unsorted_bam)
+            cmd=['hisat2', '--mp', params.hisat2_mismatch_penalties, '-t', '-x', args.vrefindex, '-p', thread_n, '-U', filenames.unmapped_merged_1, '--no-spliced-alignment']
         else:
-            cmd='hisat2 --mp %s -t -x %s -p %d -1 %s -2 %s --no-spliced-alignment | samtools view -Sbh -o %s -' % (params.hisat2_mismatch_penalties, args.vrefindex, thread_n, filenames.unmapped_merged_1, filenames.unmapped_merged_2, filenames.mapped_unsorted_bam)
-        log.logger.debug('mapping command = `'+ cmd +'`')
-        out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-        log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-        if not out.returncode == 0:
+            cmd=['hisat2', '--mp', params.hisat2_mismatch_penalties, '-t', '-x', args.vrefindex, '-p', thread_n, '-1', filenames.unmapped_merged_1, '-2', filenames.unmapped_merged_2, '--no-spliced-alignment']
+        if not runner.run([cmd, ['samtools', 'view', '-@', '%d' % (view_n - 1), '-Sbh', '-o', filenames.mapped_unsorted_bam, '-']], limits=runner.budget(args)) == 0:
             log.logger.error('Error occurred during mapping.')
             exit(1)
         # sort
-        pysam.sort('-@', str(thread_n), '-o', filenames.mapped_sorted, filenames.mapped_unsorted_bam)
+        pysam.sort('-@', threads.extra('samtools sort', args.p), '-o', filenames.mapped_sorted, filenames.mapped_unsorted_bam)
         if not args.keep is True:
             os.remove(filenames.mapped_unsorted_bam)
         # mark duplicate
-        cmd='java -Xms896m -Xmx5376m -jar %s MarkDuplicates CREATE_INDEX=true I=%s O=%s M=%s' % (args.picard, filenames.mapped_sorted, filenames.mapped_to_virus_bam, filenames.markdup_metrix)
-        log.logger.debug('picard command = `'+ cmd +'`')
-        out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-        log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-        if not out.returncode == 0:
-            log.logger.error('\n'+ traceback.format_exc())
+        cmd=['java', '-Xms896m', '-Xmx5376m', threads.jvm_gc(threads.useful('picard', args.p)), '-jar', args.picard, 'MarkDuplicates', 'CREATE_INDEX=true', 'I=%s' % filenames.mapped_sorted, 'O=%s' % filenames.mapped_to_virus_bam, 'M=%s' % filenames.markdup_metrix]
+        if not runner.run(cmd) == 0:
             log.logger.error('Error occurred during gatk running.')
             exit(1)
         # remove unnecessary files
         if args.keep is False:
             os.remove(filenames.mapped_sorted)
         # check mapped = 0
-        global read_mapped
         read_mapped=True
         with open(filenames.markdup_metrix) as infile:
             for line in infile:
@@ -57,27 +49,21 @@ def map_to_viruses(args, params, filenames):
                     if int(ls[2]) == 0:
                         read_mapped=False
                     break
+        return read_mapped
 
     except:
         log.logger.error('\n'+ traceback.format_exc())
         exit(1)
 
 
-def bam_to_bedgraph(args, params, filenames):
+def bam_to_coverage(args, params, filenames, ont_contigs=None):
     log.logger.debug('started.')
     try:
-        if args.p <= 2:
-            thread_n=args.p
-        elif args.p >= 3:
-            thread_n=args.p - 1
-        cmd='bamCoverage --outFileFormat bedgraph -p %d --binSize %d -b %s -o %s' % (thread_n, params.bedgraph_bin, filenames.mapped_to_virus_bam, filenames.bedgraph)
-        log.logger.debug('bamCoverage command = "'+ cmd +'"')
-        out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-        log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-        if not out.returncode == 0:
-            log.logger.error('\n'+ traceback.format_exc())
-            log.logger.error('Error occurred during bamCoverage.')
-            exit(1)
+        if args.ONT_bamin is True:
+            # long reads; only the contigs needed downstream
+            covfile.write(filenames.coverage, covfile.ont_coverage(filenames.mapped_to_virus_bam, ont_contigs))
+        else:
+            covfile.write(filenames.coverage, covfile.bam_coverage(filenames.mapped_to_virus_bam))
     except:
         log.logger.error('\n'+ traceback.format_exc())
         exit(1)
@@ -86,45 +72,32 @@ def bam_to_bedgraph(args, params, filenames):
 def remove_chrs_no_read(args, params, filenames, hhv6a_refid, hhv6b_refid):
     log.logger.debug('started.')
     try:
-        import pysam, shutil
-        chr_keep=set()
-        with pysam.AlignmentFile(filenames.mapped_to_virus_bam) as infile:
-            header=infile.header.as_dict()
-            for read in infile:
-                chr_keep.add(read.reference_name)
-                chr_keep.add(read.next_reference_name)
-        chr_keep.add(hhv6a_refid)
-        chr_keep.add(hhv6b_refid)
-        new_header={}
-        name_to_id={}
-        n=0
-        for key in header:
-            if key == 'SQ':
-                new_header['SQ']=[]
-                for sq in header['SQ']:
-                    if sq['SN'] in chr_keep:
-                        new_header['SQ'].append(sq)
-                        name_to_id[sq['SN']]=n
-                        n += 1
-            else:
-                new_header[key]=header[key]
-        
-        with pysam.AlignmentFile(filenames.mapped_to_virus_bam) as infile:
-            with pysam.AlignmentFile(filenames.tmp_bam, 'wb', header=new_header) as outfile:
-                for read in infile:
-                    if read.reference_name in name_to_id:
-                        read.reference_id=name_to_id[read.reference_name]
-                        read.next_reference_id=name_to_id[read.next_reference_name]
+        import pysam
+        with pysam.AlignmentFile(filenames.mapped_to_virus_bam, threads=args.p) as infile:
+            if infile.has_index() is False:
+                log.logger.error('Index of %s was not found.' % filenames.mapped_to_virus_bam)
+                exit(1)
+            # contigs with placed reads, from the index; mates are placed on contigs which have reads as well
+            chr_keep=set([ s.contig for s in infile.get_index_statistics() if s.total >= 1 ])
+            chr_keep.add(hhv6a_refid)
+            chr_keep.add(hhv6b_refid)
+            header=infile.header.to_dict()
+            n_ref=len(header['SQ'])
+            header['SQ']=[ sq for sq in header['SQ'] if sq['SN'] in chr_keep ]
+            new_id={-1: -1}
+            for sq in header['SQ']:
+                new_id[infile.get_tid(sq['SN'])]=len(new_id) - 1
+            # single pass; only reference IDs change
+            # written next to the BAM, as tmp_bam may be on another filesystem with -tmpdir
+            tmp_bam=filenames.mapped_to_virus_bam +'.tmp'
+            with pysam.AlignmentFile(tmp_bam, 'wb', header=header, threads=args.p) as outfile:
+                for read in infile.fetch(until_eof=True):
+                    read.reference_id=new_id[read.reference_id]
+                    read.next_reference_id=new_id.get(read.next_reference_id, -1)
                     outfile.write(read)
-        cmd='samtools view -h %s | samtools view -bh -o %s -' % (filenames.tmp_bam, filenames.mapped_to_virus_bam)
-        log.logger.debug('samtools command = "'+ cmd +'"')
-        out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-        log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-        if not out.returncode == 0:
-            log.logger.error('\n'+ traceback.format_exc())
-            log.logger.error('Error occurred during samtools.')
-            exit(1)
-        pysam.index(filenames.mapped_to_virus_bam)
+        log.logger.info('%d of %d contigs were kept.' % (len(header['SQ']), n_ref))
+        os.replace(tmp_bam, filenames.mapped_to_virus_bam)
+        pysam.index('-@', threads.extra('samtools index', args.p), filenames.mapped_to_virus_bam, filenames.mapped_to_virus_bai)
 
     except:
         log.logger.error('\n'+ traceback.format_exc())
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,multiprocessing
+from collections import Counter
+import log,traceback
+
+
+# pileup consensus of long reads; the contig is split into windows which are built in a process pool and concatenated
+# secondary, QC-failed and duplicate alignments are not used; supplementary alignments are parts of long reads and are used
+excluded_flags=0x4 | 0x100 | 0x200 | 0x400
+base_idx={'A': 0, 'C': 1, 'G': 2, 'T': 3}
+DEL=4
+
+
+def pileup_window(job):
+    # counts of A, C, G, T and deletion per reference position, and inserted sequences after each position
+    bam_path,refid,start,end,min_depth=job
+    import pysam
+    n=end - start
+    counts=[ [0] * n for _ in range(5) ]
+    insertions={}
+    with pysam.AlignmentFile(bam_path) as infile:
+        for read in infile.fetch(refid, start, end):
+            if read.flag & excluded_flags:
+                continue
+            seq=read.query_sequence
+            if seq is None:
+                continue
+            rpos=read.reference_start
+            qpos=0
+            for op,length in read.cigartuples:
+                if rpos > end:
+                    break
+                if op in (0, 7, 8):   # M, =, X
+                    s=max(rpos, start)
+                    e=min(rpos + length, end)
+                    for p in range(s, e):
+                        k=base_idx.get(seq[qpos + p - rpos])
+                        if k is not None:
+                            counts[k][p - start] += 1
+                    rpos += length
+                    qpos += length
+                elif op == 1:         # I; anchored to the previous reference base
+                    if start < rpos <= end:
+                        insertions.setdefault(rpos - 1 - start, Counter())[seq[qpos:qpos + length]] += 1
+                    qpos += length
+                elif op == 2:         # D
+                    for p in range(max(rpos, start), min(rpos + length, end)):
+                        counts[DEL][p - start] += 1
+                    rpos += length
+                elif op == 3:         # N
+                    rpos += length
+                elif op == 4:         # S
+                    qpos += length
+    # majority of bases and deletions at each position; positions below the minimum depth are masked
+    out=[]
+    masked=0
+    for i in range(n):
+        col=[ counts[k][i] for k in range(5) ]
+        depth=sum(col)
+        if depth < min_depth:
+            out.append('N')
+            masked += 1
+        else:
+            k=col.index(max(col))
+            if not k == DEL:
+                out.append('ACGT'[k])
+            ins=insertions.get(i)
+            if ins is not None and sum(ins.values()) * 2 > depth:
+                out.append(ins.most_common(1)[0][0])
+    return ''.join(out), masked
+
+
+def reconstruct(args, params, filenames, refseqid, out_fa):
+    log.logger.debug('started.')
+    try:
+        import pysam
+        with pysam.AlignmentFile(filenames.mapped_to_virus_bam) as infile:
+            if infile.has_index() is False:
+                log.logger.error('%s is not indexed.' % filenames.mapped_to_virus_bam)
+                exit(1)
+            length=infile.get_reference_length(refseqid)
+        window=params.ont_consensus_window_len
+        jobs=[ [filenames.mapped_to_virus_bam, refseqid, start, min(start + window, length), params.reconst_minimum_depth] for start in range(0, length, window) ]
+        log.logger.info('%s: %d windows of %d bp, minimum depth %d.' % (refseqid, len(jobs), window, params.reconst_minimum_depth))
+        seqs=[]
+        masked=0
+        with multiprocessing.get_context('fork').Pool(min(args.p, len(jobs))) as pool:
+            for seq,n in pool.imap(pileup_window, jobs):
+                seqs.append(seq)
+                masked += n
+        seq=''.join(seqs)
+        log.logger.info('%s: %d bp reconstructed, %d bp masked due to low depth.' % (refseqid, len(seq), masked))
+        with open(out_fa +'.tmp', 'w') as outfile:
+            outfile.write('>%s %s masked\n' % (refseqid, args.ONT_bam))
+            for i in range(0, len(seq), 60):
+                outfile.write(seq[i:i + 60] +'\n')
+        os.replace(out_fa +'.tmp', out_fa)
+    except SystemExit:
+        raise
+    except:
+        log.logger.error('\n'+ traceback.format_exc())
+        exit(1)
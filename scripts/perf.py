@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,time,json,resource
+import log,traceback
+
+
+# performance records of stages and external commands run by this process
+records=[]
+commands=[]
+current=None
+
+
+def proc_io():
+    # storage-level bytes read/written by this process
+    d={}
+    try:
+        with open('/proc/self/io') as infile:
+            for line in infile:
+                k,v=line.split(':')
+                d[k]=int(v)
+    except OSError:
+        pass
+    return d.get('read_bytes', 0), d.get('write_bytes', 0)
+
+
+def snapshot():
+    s=resource.getrusage(resource.RUSAGE_SELF)
+    c=resource.getrusage(resource.RUSAGE_CHILDREN)
+    read_bytes,write_bytes=proc_io()
+    return {'wall': time.time(),
+            'cpu_user': s.ru_utime + c.ru_utime,
+            'cpu_sys': s.ru_stime + c.ru_stime,
+            'read_bytes': read_bytes + c.ru_inblock * 512,
+            'write_bytes': write_bytes + c.ru_oublock * 512}
+
+
+def reset_peak_rss():
+    # resets VmHWM of this process (Linux 4.0 or later), so the peak of each stage can be read
+    try:
+        with open('/proc/self/clear_refs', 'w') as outfile:
+            outfile.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def vm_hwm_mb():
+    with open('/proc/self/status') as infile:
+        for line in infile:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    raise OSError('VmHWM not found')
+
+
+def start_stage(name):
+    global current
+    current={'name': name, 'start': snapshot(), 'commands': [], 'rss_reset': reset_peak_rss()}
+
+
+def end_stage(reads=None):
+    global current
+    end=snapshot()
+    start=current['start']
+    # peak of this stage when VmHWM could be reset, otherwise peak of the process so far
+    peak_rss_scope='process'
+    peak_rss_mb= resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if current['rss_reset'] is True:
+        try:
+            peak_rss_mb=vm_hwm_mb()
+            peak_rss_scope='stage'
+        except (OSError, ValueError):
+            pass
+    for cmd in current['commands']:
+        peak_rss_mb=max(peak_rss_mb, cmd['peak_rss_mb'])
+    record={'stage': current['name'],
+            'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'wall_sec': end['wall'] - start['wall'],
+            'cpu_user_sec': end['cpu_user'] - start['cpu_user'],
+            'cpu_sys_sec': end['cpu_sys'] - start['cpu_sys'],
+            'peak_rss_mb': peak_rss_mb,
+            'peak_rss_scope': peak_rss_scope,
+            'read_bytes': end['read_bytes'] - start['read_bytes'],
+            'write_bytes': end['write_bytes'] - start['write_bytes'],
+            'reads': reads,
+            'commands': current['commands']}
+    records.append(record)
+    current=None
+    return record
+
+
+def tool_name(cmd):
+    # cmd: argv list
+    words=cmd
+    if os.path.basename(words[0]) == 'java':
+        for i,w in enumerate(words):
+            if w.endswith('.jar'):
+                return 'picard %s' % words[i + 1] if i + 1 < len(words) else 'java'
+        return 'java'
+    elif words[0] == 'gatk':
+        for w in words[1:]:
+            if w[0].isupper():
+                return 'gatk %s' % w
+        return 'gatk'
+    elif words[0] in ['bcftools', 'samtools'] and len(words) >= 2:
+        return '%s %s' % (words[0], words[1])
+    return os.path.basename(words[0])
+
+
+def exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def add_command(cmd, wall, ru, returncode):
+    # ru: rusage of this command only, from wait4()
+    record={'tool': tool_name(cmd),
+            'command': ' '.join(cmd),
+            'wall_sec': wall,
+            'cpu_user_sec': ru.ru_utime,
+            'cpu_sys_sec': ru.ru_stime,
+            'peak_rss_mb': ru.ru_maxrss / 1024,
+            'read_bytes': ru.ru_inblock * 512,
+            'write_bytes': ru.ru_oublock * 512,
+            'returncode': returncode}
+    if current is not None:
+        current['commands'].append(record)
+    else:
+        commands.append(record)
+
+
+def save(path):
+    # appends records of this process to path; stages of one sample never run concurrently
+    global records,commands
+    try:
+        d={'stages': [], 'commands': []}
+        if os.path.exists(path) is True:
+            with open(path) as infile:
+                d=json.load(infile)
+        d['stages'].extend(records)
+        d['commands'].extend(commands)
+        with open(path +'.tmp', 'w') as outfile:
+            json.dump(d, outfile, indent=1)
+        os.replace(path +'.tmp', path)
+        records,commands=[],[]
+    except:
+        log.logger.warning('Could not write performance record.\n'+ traceback.format_exc())
+
+
+def report(path):
+    if os.path.exists(path) is False:
+        return
+    with open(path) as infile:
+        d=json.load(infile)
+    latest={}
+    for r in d['stages']:
+        latest[r['stage']]=r
+    rows=[]
+    if len(latest) >= 1:
+        rows.append('%-14s %10s %10s %12s %10s %10s %12s' % ('stage', 'wall(s)', 'cpu(s)', 'peak_rss(MB)', 'read(MB)', 'write(MB)', 'reads'))
+        for r in latest.values():
+            rss='%.1f%s' % (r['peak_rss_mb'], '*' if r.get('peak_rss_scope', 'process') == 'process' else '')
+            rows.append('%-14s %10.1f %10.1f %12s %10.1f %10.1f %12s' % (r['stage'], r['wall_sec'], r['cpu_user_sec'] + r['cpu_sys_sec'], rss, r['read_bytes'] / 1048576, r['write_bytes'] / 1048576, 'NA' if r['reads'] is None else str(r['reads'])))
+        if any([ r.get('peak_rss_scope', 'process') == 'process' for r in latest.values() ]):
+            rows.append('* peak of the process up to the end of the stage, not of the stage alone')
+    tools={}
+    for r in [ c for s in latest.values() for c in s['commands'] ] + d['commands']:
+        t=tools.setdefault(r['tool'], [0, 0, 0, 0])
+        t[0] += 1
+        t[1] += r['wall_sec']
+        t[2] += r['cpu_user_sec'] + r['cpu_sys_sec']
+        t[3]=max(t[3], r['peak_rss_mb'])
+    if len(tools) >= 1:
+        rows.append('')
+        rows.append('%-30s %6s %10s %10s %12s' % ('command', 'n', 'wall(s)', 'cpu(s)', 'peak_rss(MB)'))
+        for tool,t in tools.items():
+            rows.append('%-30s %6d %10.1f %10.1f %12.1f' % (tool, t[0], t[1], t[2], t[3]))
+    log.logger.info('Performance summary (%s):\n%s' % (path, '\n'.join(rows)))
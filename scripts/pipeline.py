@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,json,hashlib
+import utils,result_cache,scratch,threads,profiling
+import log,traceback
+import perf
+
+
+# HHV-6 refseq IDs
+hhv6a_refid='NC_001664.4'
+hhv6b_refid='NC_000898.1'
+
+
+def set_filenames(args, base):
+    filenames=utils.empclass()
+
+    filenames.discordant_bam      =os.path.join(args.outdir, 'discordant.bam')
+    filenames.discordant_sort_bam =os.path.join(args.outdir, 'discordant_sorted.bam')
+    filenames.unmapped_1          =os.path.join(args.outdir, 'unmapped_1.fq')
+    filenames.unmapped_2          =os.path.join(args.outdir, 'unmapped_2.fq')
+    filenames.unmapped_bam_3      =os.path.join(args.outdir, 'unmapped_3.bam')
+    filenames.unmapped_bam_4      =os.path.join(args.outdir, 'unmapped_4.bam')
+    filenames.unmapped_bam_34     =os.path.join(args.outdir, 'unmapped_34.bam')
+    filenames.unmapped_sorted_34  =os.path.join(args.outdir, 'unmapped_34_sorted.bam')
+    filenames.unmapped_3          =os.path.join(args.outdir, 'unmapped_3.fq')
+    filenames.unmapped_4          =os.path.join(args.outdir, 'unmapped_4.fq')
+    filenames.unmapped_merged_pre1=os.path.join(args.outdir, 'unmapped_merged_pre1.fq')
+    filenames.unmapped_merged_pre2=os.path.join(args.outdir, 'unmapped_merged_pre2.fq')
+    filenames.unmapped_merged_1   =os.path.join(args.outdir, 'unmapped_merged_1.fq')
+    filenames.unmapped_merged_2   =os.path.join(args.outdir, 'unmapped_merged_2.fq')
+    filenames.mapped_unsorted_bam =os.path.join(args.outdir, 'mapped_to_virus_orig.bam')
+    filenames.mapped_sorted       =os.path.join(args.outdir, 'mapped_to_virus_sorted.bam')
+    filenames.mapped_to_virus_bam =os.path.join(args.outdir, 'mapped_to_virus_dedup.bam')
+    filenames.mapped_to_virus_bai =os.path.join(args.outdir, 'mapped_to_virus_dedup.bai')
+    filenames.markdup_metrix      =os.path.join(args.outdir, 'mark_duplicate_metrix.txt')
+    filenames.coverage            =os.path.join(args.outdir, 'mapped_to_virus.cov')
+    filenames.summary             =os.path.join(args.outdir, 'virus_detection_summary.txt')
+    filenames.high_cov_pdf        =os.path.join(args.outdir, 'high_coverage_viruses.pdf')
+    filenames.tmp_bam             =os.path.join(args.outdir, 'tmp.bam')
+    filenames.tmp_sorted_bam      =os.path.join(args.outdir, 'tmp_sorted.bam')
+    filenames.tmp_bam_fq1         =os.path.join(args.outdir, 'tmp_bam_1.fq')
+    filenames.tmp_bam_fq2         =os.path.join(args.outdir, 'tmp_bam_2.fq')
+    filenames.tmp_rg_bam          =os.path.join(args.outdir, 'tmp_rg.bam')
+    filenames.tmp_fa              =os.path.join(args.outdir, 'tmp.fa')
+    filenames.tmp_masked_fa       =os.path.join(args.outdir, 'tmp_masked.fa')
+    filenames.tmp_fa_dict         =os.path.join(args.outdir, 'tmp.dict')
+    filenames.hhv6a_vcf_gz        =os.path.join(args.outdir, 'hhv6a.vcf.gz')
+    filenames.hhv6a_norm_vcf_gz   =os.path.join(args.outdir, 'hhv6a_norm.vcf.gz')
+    filenames.hhv6a_gatk_naive    =os.path.join(args.outdir, 'hhv6a_reconstructed.fa')
+    filenames.hhv6b_vcf_gz        =os.path.join(args.outdir, 'hhv6b.vcf.gz')
+    filenames.hhv6b_norm_vcf_gz   =os.path.join(args.outdir, 'hhv6b_norm.vcf.gz')
+    filenames.hhv6b_gatk_naive    =os.path.join(args.outdir, 'hhv6b_reconstructed.fa')
+    filenames.hhv6a_metaspades_o  =os.path.join(args.outdir, 'hhv6a_metaspades_assembly')
+    filenames.hhv6b_metaspades_o  =os.path.join(args.outdir, 'hhv6b_metaspades_assembly')
+    filenames.hhv6_dr_ref         =os.path.join(base,       'lib/HHV6_only_DR.fa')
+    filenames.hhv6_dr_index       =os.path.join(base,       'lib/hisat2_index/HHV6_only_DR')
+    filenames.mapped_to_dr_bam    =os.path.join(args.outdir, 'mapped_to_DR_dedup.bam')
+    filenames.mapped_to_dr_bai    =os.path.join(args.outdir, 'mapped_to_DR_dedup.bai')
+    filenames.markdup_metrix_dr   =os.path.join(args.outdir, 'mark_duplicate_metrix_DR.txt')
+    filenames.coverage_dr         =os.path.join(args.outdir, 'mapped_to_DR.cov')
+    filenames.summary_dr          =os.path.join(args.outdir, 'mapping_DR_summary.txt')
+    filenames.high_cov_pdf_dr     =os.path.join(args.outdir, 'coverage_DR.pdf')
+    filenames.hhv6a_dr_vcf_gz     =os.path.join(args.outdir, 'hhv6a_DR.vcf.gz')
+    filenames.hhv6a_dr_norm_vcf_gz=os.path.join(args.outdir, 'hhv6a_DR_norm.vcf.gz')
+    filenames.hhv6a_dr_gatk_naive =os.path.join(args.outdir, 'hhv6a_DR_reconstructed.fa')
+    filenames.hhv6b_dr_vcf_gz     =os.path.join(args.outdir, 'hhv6b_DR.vcf.gz')
+    filenames.hhv6b_dr_norm_vcf_gz=os.path.join(args.outdir, 'hhv6b_DR_norm.vcf.gz')
+    filenames.hhv6b_dr_gatk_naive =os.path.join(args.outdir, 'hhv6b_DR_reconstructed.fa')
+    filenames.stage_manifest      =os.path.join(args.outdir, 'stage_manifest.json')
+    filenames.performance         =os.path.join(args.outdir, 'performance.json')
+    filenames.run_args            =os.path.join(args.outdir, 'run_args.json')
+    scratch.setup(args, filenames)
+
+    if args.fastqin is True:
+        filenames.unmapped_merged_1=args.fq1
+        if args.single is False:
+            filenames.unmapped_merged_2=args.fq2
+    if args.ONT_bamin is True:
+        filenames.mapped_to_virus_bam=args.ONT_bam
+        filenames.mapped_to_virus_bai=args.ONT_bam +'.bai'
+    return filenames
+
+
+# stage functions; each returns a dict of values used by the following stages
+def retrieve(args, params, filenames):
+    import retrieve_unmapped
+    log.logger.info('Unmapped read retrieval started.')
+    n=retrieve_unmapped.retrieve_unmapped_reads(args, params, filenames)
+    return {'retrieved_reads': n}
+
+
+def map_virus(args, params, filenames):
+    import mapping
+    if args.fastqin is True:
+        log.logger.info('Unmapped read retrieval skipped. Read1=%s, read2=%s.' % (args.fq1, args.fq2))
+    log.logger.info('Mapping of unmapped reads started.')
+    read_mapped=mapping.map_to_viruses(args, params, filenames)
+    map_cleanup(args, params, filenames)
+    if read_mapped is True and args.remove_chr_with_no_read is True:
+        log.logger.info('Removing chrs without reads.')
+        mapping.remove_chrs_no_read(args, params, filenames, hhv6a_refid, hhv6b_refid)
+    return {'read_mapped': read_mapped}
+
+
+def map_cleanup(args, params, filenames):
+    # unmapped reads are absent when retrieval was restored from the cache without copying them
+    if args.alignmentin is True:
+        for path in [filenames.unmapped_merged_1, filenames.unmapped_merged_2]:
+            if os.path.exists(path) is True:
+                utils.gzip_or_del(args, params, path)
+
+
+def remove_chrs(args, params, filenames):
+    import mapping
+    log.logger.info('Removing chrs without reads.')
+    mapping.remove_chrs_no_read(args, params, filenames, hhv6a_refid, hhv6b_refid)
+
+
+def coverage(args, params, filenames):
+    import mapping
+    log.logger.info('Per-base coverage calculation started.')
+    ont_contigs=None
+    if args.ONT_bamin is True:
+        ont_contigs=[hhv6a_refid, hhv6b_refid]
+        if getattr(args, 'ONT_cov_refids', None) is not None:
+            ont_contigs.extend([ r for r in args.ONT_cov_refids.split(',') if not r == '' ])
+    mapping.bam_to_coverage(args, params, filenames, ont_contigs)
+
+
+def summary(args, params, filenames):
+    import identify_high_cov
+    log.logger.info('Identification of high-coverage viruses started.')
+    hhv6a_highcov,hhv6b_highcov,contigs=identify_high_cov.identify_high_cov_virus_from_coverage(args, params, filenames)
+    if args.ONT_bamin is True:
+        hhv6a_highcov,hhv6b_highcov=identify_high_cov.judge_AB(args, params, contigs, hhv6a_highcov, hhv6b_highcov)
+    return {'hhv6a_highcov': hhv6a_highcov, 'hhv6b_highcov': hhv6b_highcov}
+
+
+def reconst_a(args, params, filenames):
+    log.logger.info('HHV-6A full sequence reconstruction started.')
+    if args.ONT_bamin is True:
+        import ont_consensus
+        ont_consensus.reconstruct(args, params, filenames, hhv6a_refid, filenames.hhv6a_gatk_naive)
+        log.logger.info('ONT_bamin was specified. DR reconstruction skipped.')
+        return
+    import reconstruct_hhv6
+    reconstruct_hhv6.reconst_a(args, params, filenames, hhv6a_refid)
+
+
+def dr_map_a(args, params, filenames):
+    import reconstruct_hhv6_dr
+    log.logger.info('HHV-6A DR sequence reconstruction started.')
+    reconstruct_hhv6_dr.map_to_dr(args, params, filenames, hhv6a_refid)
+    reconstruct_hhv6_dr.output_summary(args, params, filenames)
+
+
+def dr_reconst_a(args, params, filenames):
+    import reconstruct_hhv6_dr
+    reconstruct_hhv6_dr.reconst_a(args, params, filenames, hhv6a_refid)
+
+
+def reconst_b(args, params, filenames):
+    log.logger.info('HHV-6B full sequence reconstruction started.')
+    if args.ONT_bamin is True:
+        import ont_consensus
+        ont_consensus.reconstruct(args, params, filenames, hhv6b_refid, filenames.hhv6b_gatk_naive)
+        log.logger.info('ONT_bamin was specified. DR reconstruction skipped.')
+        return
+    import reconstruct_hhv6
+    reconstruct_hhv6.reconst_b(args, params, filenames, hhv6b_refid)
+
+
+def dr_map_b(args, params, filenames):
+    import reconstruct_hhv6_dr
+    log.logger.info('HHV-6B DR sequence reconstruction started.')
+    reconstruct_hhv6_dr.map_to_dr(args, params, filenames, hhv6b_refid)
+    reconstruct_hhv6_dr.output_summary(args, params, filenames)
+
+
+def dr_reconst_b(args, params, filenames):
+    import reconstruct_hhv6_dr
+    reconstruct_hhv6_dr.reconst_b(args, params, filenames, hhv6b_refid)
+
+
+class stage:
+    def __init__(self, name, func, inputs, outputs, temp_outputs, enabled, arg_keys, on_restore=None):
+        self.name=name
+        self.func=func
+        self.on_restore=on_restore        # run instead of func when outputs were restored from the result cache
+        self.inputs=inputs                # files read by the stage
+        self.outputs=outputs              # files which must still exist for the stage to be complete
+        self.temp_outputs=temp_outputs    # files consumed or overwritten by later stages
+        self.enabled=enabled              # function of (args, values)
+        self.arg_keys=arg_keys            # command line options affecting the stage
+
+
+def stages(args, filenames):
+    f=filenames
+    retrieve_in=[args.b] if args.b is not None else [args.c, args.fa]
+    map_in=[f.unmapped_merged_1] if args.fastqin is True and args.single is True else [f.unmapped_merged_1, f.unmapped_merged_2]
+    mapped=lambda args, values: args.ONT_bamin is True or values.get('read_mapped') is True
+    a=lambda args, values: mapped(args, values) and values.get('hhv6a_highcov') is True
+    b=lambda args, values: mapped(args, values) and values.get('hhv6b_highcov') is True
+    a_dr=lambda args, values: a(args, values) and args.ONT_bamin is False
+    b_dr=lambda args, values: b(args, values) and args.ONT_bamin is False
+    # the long-read consensus writes no VCF
+    reconst_a_out=[f.hhv6a_gatk_naive] if args.ONT_bamin is True else [f.hhv6a_vcf_gz, f.hhv6a_gatk_naive]
+    reconst_b_out=[f.hhv6b_gatk_naive] if args.ONT_bamin is True else [f.hhv6b_vcf_gz, f.hhv6b_gatk_naive]
+    dr_temp=[f.mapped_to_dr_bam, f.mapped_to_dr_bai, f.markdup_metrix_dr, f.coverage_dr, f.summary_dr]
+    return [
+        stage('retrieve', retrieve, retrieve_in, [], [f.unmapped_merged_1, f.unmapped_merged_2],
+              lambda args, values: args.alignmentin is True, ['b', 'c', 'fa', 'use_mate_mapped', 'all_discordant']),
+        stage('map', map_virus, map_in, [f.mapped_to_virus_bam, f.markdup_metrix], [f.mapped_to_virus_bai],
+              lambda args, values: args.ONT_bamin is False, ['fq1', 'fq2', 'single', 'vrefindex', 'bwa', 'remove_chr_with_no_read'], map_cleanup),
+        stage('remove_chrs', remove_chrs, [f.mapped_to_virus_bam], [f.mapped_to_virus_bam], [],
+              lambda args, values: args.ONT_bamin is True and args.remove_chr_with_no_read is True, ['ONT_bam']),
+        stage('coverage', coverage, [f.mapped_to_virus_bam, f.mapped_to_virus_bai], [f.coverage], [],
+              mapped, ['ONT_bam', 'ONT_cov_refids']),
+        stage('summary', summary, [f.coverage, args.vref], [f.summary], [],
+              mapped, ['vref', 'depth']),
+        stage('reconst_a', reconst_a, [f.mapped_to_virus_bam, f.mapped_to_virus_bai, f.coverage, args.vref], reconst_a_out, [],
+              a, ['vref', 'picard', 'denovo']),
+        stage('dr_map_a', dr_map_a, [f.mapped_to_virus_bam, f.mapped_to_virus_bai], [], dr_temp,
+              a_dr, ['picard', 'depth']),
+        stage('dr_reconst_a', dr_reconst_a, [f.mapped_to_dr_bam, f.mapped_to_dr_bai, f.coverage_dr], [f.hhv6a_dr_vcf_gz, f.hhv6a_dr_gatk_naive], [],
+              a_dr, ['picard']),
+        stage('reconst_b', reconst_b, [f.mapped_to_virus_bam, f.mapped_to_virus_bai, f.coverage, args.vref], reconst_b_out, [],
+              b, ['vref', 'picard', 'denovo']),
+        stage('dr_map_b', dr_map_b, [f.mapped_to_virus_bam, f.mapped_to_virus_bai], [], dr_temp,
+              b_dr, ['picard', 'depth']),
+        stage('dr_reconst_b', dr_reconst_b, [f.mapped_to_dr_bam, f.mapped_to_dr_bai, f.coverage_dr], [f.hhv6b_dr_vcf_gz, f.hhv6b_dr_gatk_naive], [],
+              b_dr, ['picard']),
+    ]
+
+
+def stage_fingerprint(args, params, st):
+    d={'params': params.__dict__, 'args': { k:getattr(args, k, None) for k in st.arg_keys }}
+    return hashlib.sha1(json.dumps(d, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def digests(paths):
+    d={}
+    for path in paths:
+        if path is not None and os.path.isfile(path) is True:
+            d[path]=utils.file_digest(path)
+    return d
+
+
+def load_manifest(filenames):
+    if os.path.exists(filenames.stage_manifest) is False:
+        return {}
+    with open(filenames.stage_manifest) as infile:
+        return json.load(infile)
+
+
+def save_manifest(filenames, manifest):
+    with open(filenames.stage_manifest +'.tmp', 'w') as outfile:
+        json.dump(manifest, outfile, indent=1)
+        outfile.flush()
+        os.fdatasync(outfile.fileno())
+    os.replace(filenames.stage_manifest +'.tmp', filenames.stage_manifest)
+
+
+def stale_reason(args, params, st, record, produced):
+    # returns None when the recorded run of the stage is still valid
+    if record is None:
+        return 'not completed'
+    if not record['fingerprint'] == stage_fingerprint(args, params, st):
+        return 'parameters changed'
+    for path in st.outputs:
+        if os.path.isfile(path) is False:
+            return 'output missing (%s)' % path
+        if not record['outputs'].get(path) == utils.file_digest(path):
+            return 'output changed (%s)' % path
+    for path in st.inputs:
+        # inputs made by upstream stages are covered by the linear order of stages
+        if path in produced or path is None or os.path.isfile(path) is False:
+            continue
+        if not record['inputs'].get(path) == utils.file_digest(path):
+            return 'input changed (%s)' % path
+    return None
+
+
+def bam_indexes(filenames):
+    # BAM indexes are deleted at the end of a run and rebuilt on resume instead of rerunning the stage made them
+    return {filenames.mapped_to_virus_bai: filenames.mapped_to_virus_bam, filenames.mapped_to_dr_bai: filenames.mapped_to_dr_bam}
+
+
+def restore_bam_indexes(args, filenames, st):
+    for bai,bam in bam_indexes(filenames).items():
+        if bai in st.inputs and os.path.isfile(bai) is False and os.path.isfile(bam) is True:
+            import pysam
+            log.logger.info('Rebuilding %s.' % bai)
+            pysam.index('-@', threads.extra('samtools index', args.p), bam, bai)
+
+
+def plan(args, params, filenames, stage_list, manifest):
+    # index of the first stage to run; all following stages run as well
+    producer={}
+    for i,st in enumerate(stage_list):
+        for path in st.outputs + st.temp_outputs:
+            producer.setdefault(path, i)
+    values={}
+    start=len(stage_list)
+    for i,st in enumerate(stage_list):
+        if st.enabled(args, values) is False:
+            continue
+        record=manifest.get(st.name)
+        reason=stale_reason(args, params, st, record, producer)
+        if reason is not None:
+            log.logger.info('Stage "%s" will be run: %s.' % (st.name, reason))
+            start=i
+            break
+        values.update(record['values'])
+    # go back to the stage which made inputs that were deleted or overwritten since then
+    indexes=bam_indexes(filenames)
+    moved=True
+    while moved is True and start < len(stage_list):
+        moved=False
+        record=manifest.get(stage_list[start].name)
+        for path in stage_list[start].inputs:
+            if not path in producer or producer[path] >= start:
+                continue
+            if path in indexes and os.path.isfile(indexes[path]) is True:
+                continue
+            if os.path.isfile(path) is False or (record is not None and not record['inputs'].get(path) == utils.file_digest(path)):
+                log.logger.info('Stage "%s" will be run to regenerate %s.' % (stage_list[producer[path]].name, path))
+                start=producer[path]
+                moved=True
+                break
+    return start
+
+
+def save_run_args(args, filenames):
+    # read by reanalyze.py; file paths are made absolute
+    d=dict(vars(args))
+    for key in result_cache.path_args + ['outdir']:
+        if isinstance(d.get(key), str) is True:
+            d[key]=os.path.abspath(d[key])
+    with open(filenames.run_args +'.tmp', 'w') as outfile:
+        json.dump(d, outfile, indent=1, default=str)
+    os.replace(filenames.run_args +'.tmp', filenames.run_args)
+
+
+def load_run_args(path):
+    args=utils.empclass()
+    with open(path) as infile:
+        for k,v in json.load(infile).items():
+            setattr(args, k, v)
+    return args
+
+
+def prepare(args, params, filenames, stage_list):
+    save_run_args(args, filenames)
+    manifest=load_manifest(filenames) if args.resume is True else {}
+    start=plan(args, params, filenames, stage_list, manifest) if args.resume is True else 0
+    return manifest, start
+
+
+def stage_read_count(args, filenames, st, values):
+    # number of reads produced by the stage, for performance records
+    try:
+        if st.name == 'retrieve':
+            return values.get('retrieved_reads')
+        elif st.name in ['map', 'remove_chrs', 'dr_map_a', 'dr_map_b']:
+            import pysam
+            bam=filenames.mapped_to_dr_bam if st.name.startswith('dr_map') else filenames.mapped_to_virus_bam
+            with pysam.AlignmentFile(bam) as infile:
+                return infile.mapped
+    except:
+        log.logger.debug('\n'+ traceback.format_exc())
+    return None
+
+
+def run_stage(args, params, filenames, st, manifest, stage_list):
+    log.logger.debug('stage "%s" started.' % st.name)
+    scratch.rebalance(args, filenames)
+    restore_bam_indexes(args, filenames, st)
+    input_digests=digests(st.inputs)
+    cache_key=result_cache.stage_key(args, params, filenames, st, manifest)
+    deferred=result_cache.deferrable(args, params, filenames, stage_list, st, cache_key, manifest)
+    perf.start_stage(st.name)
+    ret=result_cache.restore(args, filenames, st.name, cache_key, copy=not deferred)
+    if ret is None:
+        deferred=False
+    if ret is not None:
+        if st.on_restore is not None and deferred is False:
+            st.on_restore(args, params, filenames)
+    else:
+        result_cache.restore_deferred(args, filenames, st, manifest)
+        with profiling.stage(args, st.name):
+            ret=st.func(args, params, filenames)
+        if ret is None:
+            ret={}
+        result_cache.store(args, filenames, st, cache_key, ret)
+    perf.end_stage(stage_read_count(args, filenames, st, ret))
+    perf.save(filenames.performance)
+    manifest[st.name]={'fingerprint': stage_fingerprint(args, params, st), 'inputs': input_digests, 'outputs': digests(st.outputs), 'values': ret, 'cache_key': cache_key, 'deferred': deferred}
+    save_manifest(filenames, manifest)
+    return ret
+
+
+def finish(args, filenames, values):
+    perf.report(filenames.performance)
+    profiling.report(args)
+    scratch.cleanup(args, filenames)
+    if args.ONT_bamin is False and values.get('read_mapped') is False:
+        log.logger.info('No read was mapped.')
+    elif args.keep is False and args.ONT_bamin is False:
+        for path in [filenames.mapped_to_virus_bai, filenames.mapped_to_dr_bai]:
+            if os.path.exists(path) is True:
+                os.remove(path)
+
+
+def run(args, params, filenames):
+    log.logger.debug('started.')
+    try:
+        stage_list=stages(args, filenames)
+        manifest,start=prepare(args, params, filenames, stage_list)
+        values={}
+        for i,st in enumerate(stage_list):
+            if st.enabled(args, values) is False:
+                continue
+            if i < start:
+                log.logger.info('Stage "%s" was already completed. Skipped.' % st.name)
+                values.update(manifest[st.name]['values'])
+                continue
+            values.update(run_stage(args, params, filenames, st, manifest, stage_list))
+        finish(args, filenames, values)
+    except SystemExit:
+        raise
+    except:
+        log.logger.error('\n'+ traceback.format_exc())
+        exit(1)
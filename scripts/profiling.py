@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,io,contextlib,cProfile,pstats,tracemalloc
+import log,traceback
+
+
+# number of functions and allocation sites written to reports
+top_n=20
+
+# profiles written by this process; files left in outdir/profile by earlier runs are not merged
+profiled=[]
+
+
+def profile_dir(args):
+    return os.path.join(args.outdir, 'profile')
+
+
+@contextlib.contextmanager
+def stage(args, name):
+    # profiles the Python code of a stage run in this process; external commands appear as time waiting for them
+    if getattr(args, 'profile', False) is False:
+        yield
+        return
+    os.makedirs(profile_dir(args), exist_ok=True)
+    trace_mem=args.profile_mem is True and tracemalloc.is_tracing() is False
+    if trace_mem is True:
+        tracemalloc.start()
+    prof=cProfile.Profile()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        path=os.path.join(profile_dir(args), name +'.pstats')
+        prof.dump_stats(path)
+        if not path in profiled:
+            profiled.append(path)
+        if trace_mem is True:
+            write_allocations(args, name)
+
+
+def write_allocations(args, name):
+    snapshot=tracemalloc.take_snapshot()
+    _,peak=tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    snapshot=snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap>')])
+    with open(os.path.join(profile_dir(args), name +'.alloc.txt'), 'w') as outfile:
+        outfile.write('# peak traced memory: %.1f MB\n' % (peak / 1048576))
+        outfile.write('# top %d allocation sites still alive at the end of the stage\n' % top_n)
+        for s in snapshot.statistics('lineno')[:top_n]:
+            outfile.write('%.1f KB\t%d blocks\t%s\n' % (s.size / 1024, s.count, s.traceback.format()[0].strip()))
+
+
+def report(args):
+    # merges per-stage profiles of this run and logs the hottest functions
+    if getattr(args, 'profile', False) is False:
+        return
+    try:
+        paths=[ path for path in profiled if os.path.exists(path) is True ]
+        if len(paths) == 0:
+            return
+        rows=[]
+        for path in paths:
+            s=pstats.Stats(path)
+            rows.append('%-14s %10.2f' % (os.path.basename(path)[:-len('.pstats')], s.total_tt))
+        buf=io.StringIO()
+        merged=pstats.Stats(*paths, stream=buf)
+        merged.sort_stats('tottime').print_stats(top_n)
+        with open(os.path.join(profile_dir(args), 'summary.txt'), 'w') as outfile:
+            outfile.write('%-14s %10s\n' % ('stage', 'python(s)'))
+            outfile.write('\n'.join(rows) +'\n')
+            outfile.write(buf.getvalue())
+        hottest=[]
+        for func,(_,nc,tt,ct,_) in sorted(merged.stats.items(), key=lambda kv: kv[1][2], reverse=True)[:top_n]:
+            hottest.append('%10.2f %10.2f %12d  %s' % (tt, ct, nc, pstats.func_std_string(func)))
+        log.logger.info('Profile of stages (%s):\n%-14s %10s\n%s\n\nHottest functions:\n%10s %10s %12s  %s\n%s' % (profile_dir(args), 'stage', 'python(s)', '\n'.join(rows), 'tottime', 'cumtime', 'ncalls', 'function', '\n'.join(hottest)))
+    except:
+        log.logger.warning('Could not summarize profiles.\n'+ traceback.format_exc())
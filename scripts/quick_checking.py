@@ -6,70 +6,60 @@ All Rights Reserved
 See file LICENSE for details.
 '''
 
-import os,sys,subprocess,pysam
+import os,sys,copy,math,statistics,subprocess,threading,multiprocessing,pysam
 import utils
 import log,traceback
+import perf,runner
 
 
 def load_files(args, params, filenames):
     log.logger.debug('started.')
     try:
-        def bam_check(path):
+        def index_check(path, index_ext, file_type):
             if os.path.exists(path) is False:
-                log.logger.error('Input file (%s) was not found.' % path)
-                exit(1)
-            if os.path.exists(path +'.bai') is False:
-                if os.path.exists(path[:-4] +'bai') is False:
-                    log.logger.error('Index file for input file (%s) was not found.' % path)
-                    exit(1)
+                return 'Input file (%s) was not found.' % path
+            if os.path.exists(path +'.'+ index_ext) is False:
+                if os.path.exists(path[:-4] + index_ext) is False:
+                    return 'Index file for input file (%s) was not found.' % path
                 else:
-                    index_time=os.stat(path[:-4] +'bai').st_mtime
+                    index_time=os.stat(path[:-4] + index_ext).st_mtime
             else:
-                index_time=os.stat(path +'.bai').st_mtime
+                index_time=os.stat(path +'.'+ index_ext).st_mtime
             diff= os.stat(path).st_mtime - index_time
             if diff > 0:
-                log.logger.error('BAM index is older than BAM. Please generate the index again.')
-                exit(1)
-
-        def cram_check(path):
-            if os.path.exists(path) is False:
-                log.logger.error('Input file (%s) was not found.' % path)
-                exit(1)
-            if os.path.exists(path +'.crai') is False:
-                if os.path.exists(path[:-4] +'crai') is False:
-                    log.logger.error('Index file for input file (%s) was not found.' % path)
-                    exit(1)
-                else:
-                    index_time=os.stat(path[:-4] +'crai').st_mtime
+                return '%s index is older than %s (%s). Please generate the index again.' % (file_type, file_type, path)
+            return None
+        
+        def add_file(path, index_ext, file_type):
+            message=index_check(path, index_ext, file_type)
+            if message is None:
+                filenames.fpaths.append(path)
+            elif args.resume is True:
+                # isolate per-file errors in resume mode
+                log.logger.warning(message +' Will skip this file.')
+                filenames.fpaths.append(path)
+                filenames.failed[path]=message
             else:
-                index_time=os.stat(path +'.crai').st_mtime
-            diff= os.stat(path).st_mtime - index_time
-            if diff > 0:
-                log.logger.error('CRAM index is older than CRAM. Please generate the index again.')
+                log.logger.error(message)
                 exit(1)
             
         filenames.fpaths=[]
+        filenames.failed={}
         if args.b is not None:
-            bam_check(args.b)
-            filenames.fpaths.append(args.b)
+            add_file(args.b, 'bai', 'BAM')
             args.file_type='rb'
         elif args.c is not None:
-            cram_check(args.c)
-            filenames.fpaths.append(args.c)
+            add_file(args.c, 'crai', 'CRAM')
             args.file_type='rc'
         elif args.bl is not None:
             with open(args.bl) as infile:
                 for line in infile:
-                    path=line.strip()
-                    bam_check(path)
-                    filenames.fpaths.append(path)
+                    add_file(line.strip(), 'bai', 'BAM')
             args.file_type='rb'
         elif args.cl is not None:
             with open(args.cl) as infile:
                 for line in infile:
-                    path=line.strip()
-                    cram_check(path)
-                    filenames.fpaths.append(path)
+                    add_file(line.strip(), 'crai', 'CRAM')
             args.file_type='rc'
         log.logger.info('%d file(s) will be analyzed.' % len(filenames.fpaths))
         
@@ -81,89 +71,341 @@ def load_files(args, params, filenames):
         exit(1)
     
 
+# thresholds of the ratio of reads mapped to HHV-6
+no_hhv_threshold= 3 / 1000000
+need_check_threshold= 20 / 1000000
+dr_threshold= 150 / 1000000
+
+
+def judge_hhv6(mapped_n, n):
+    return judge_ratio(mapped_n / n)
+
+
+def judge_ratio(mapped_ratio):
+    if mapped_ratio < no_hhv_threshold:
+        judge='False'
+    elif mapped_ratio < need_check_threshold:
+        judge='Need_further_check'
+    elif mapped_ratio < dr_threshold:
+        judge='likely_solo-DR'
+    else:
+        judge='likely_Full-length'
+    return judge
+
+
+def open_alignment_file(args, params, f):
+    if args.file_type == 'rb':
+        infile=pysam.AlignmentFile(f, 'rb', check_sq=False, threads=args.p)
+    elif args.file_type == 'rc':
+        infile=pysam.AlignmentFile(f, 'rc', reference_filename=args.fa, format_options=utils.cram_format_options(params), threads=args.p)
+    return infile
+
+
+def iter_unmapped_reads(args, params, f):
+    # yields (read_name, seq, qual) of unmapped reads without telomeric repeat
+    read_num_limit=params.quick_check_read_num
+    infile=open_alignment_file(args, params, f)
+    n=0
+    try:
+        for read in infile.fetch('*', until_eof=True):
+            if read.is_unmapped:
+                if not 'TAACCC' in read.query_sequence and not 'GGGTTA' in read.query_sequence:
+                    if read.is_read1 is True:
+                        read_name='%s/1' % read.query_name
+                    else:
+                        read_name='%s/2' % read.query_name
+                    yield read_name, read.query_sequence, read.qual
+                    n += 1
+            if n == read_num_limit:
+                break
+    finally:
+        infile.close()
+
+
+def count_mapped_hisat2(args, params, filenames, f):
+    n=0
+    with open(filenames.unmapped, 'w') as outfile:
+        tmp=[]
+        for read_name,seq,qual in iter_unmapped_reads(args, params, f):
+            tmp.append('@%s\n%s\n+\n%s\n' % (read_name, seq, qual))
+            n += 1
+            if len(tmp) == 100_000:
+                outfile.write(''.join(tmp))
+                tmp=[]
+        if len(tmp) >= 1:
+            outfile.write(''.join(tmp))
+        outfile.flush()
+        os.fdatasync(outfile.fileno())
+    if n == 0:
+        utils.gzip_or_del(args, params, filenames.unmapped)
+        return n, None
+    # mapping
+    cmd=['hisat2', '--mp', params.hisat2_mismatch_penalties, '-t', '-x', args.vrefindex, '-p', args.p, '-U', filenames.unmapped, '--no-spliced-alignment']
+    if not runner.run(cmd, stdout=filenames.mapped_sam) == 0:
+        log.logger.error('Error occurred during mapping.')
+        exit(1)
+    utils.gzip_or_del(args, params, filenames.unmapped)
+    # count mapped
+    mapped_n=0
+    with open(filenames.mapped_sam) as infile:
+        for line in infile:
+            if not line[0] == '@':
+                ls=line.split()
+                if not ls[5] == '*':
+                    readlen=len(ls[9])
+                    if ls[5] == '%dM' % readlen:
+                        mapped_n += 1
+    return n, mapped_n
+
+
+def count_mapped_hisat2_stream(args, params, filenames, fpaths):
+    # reads of all files go to one hisat2 process via stdin; read names are tagged with file index
+    cmd=['hisat2', '--mp', params.hisat2_mismatch_penalties, '-t', '-x', args.vrefindex, '-p', args.p, '-U', '-', '--no-spliced-alignment', '--no-unal', '--no-hd']
+    proc=runner.start(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    mapped_ns=[ 0 for _ in fpaths ]
+    def count_mapped():
+        for line in proc.stdout:
+            ls=line.rstrip(b'\n').split(b'\t', 10)
+            if not ls[5] == b'*':
+                readlen=len(ls[9])
+                if ls[5] == b'%dM' % readlen:
+                    mapped_ns[int(ls[0].split(b':', 1)[0])] += 1
+    counter=threading.Thread(target=count_mapped)
+    counter.start()
+    ns=[]
+    errors=[]
+    completed=False
+    try:
+        for i,f in enumerate(fpaths):
+            n=0
+            tmp=[]
+            try:
+                for read_name,seq,qual in iter_unmapped_reads(args, params, f):
+                    tmp.append('@%d:%s\n%s\n+\n%s\n' % (i, read_name, seq, qual))
+                    n += 1
+                    if len(tmp) == 100_000:
+                        proc.stdin.write(''.join(tmp).encode())
+                        tmp=[]
+                if len(tmp) >= 1:
+                    proc.stdin.write(''.join(tmp).encode())
+                errors.append(None)
+            except (OSError, ValueError):
+                if args.resume is False:
+                    raise
+                log.logger.warning('Error occurred while reading %s. Will skip this file.\n%s' % (f, traceback.format_exc()))
+                errors.append(traceback.format_exc())
+            ns.append(n)
+            log.logger.debug('%d reads were streamed from %s.' % (n, f))
+        completed=True
+    finally:
+        # hisat2 is not left waiting on stdin when reading an input file fails
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        if completed is False:
+            proc.stop()
+        returncode=proc.wait()
+        counter.join()
+    if not returncode == 0:
+        log.logger.error('Error occurred during mapping.')
+        exit(1)
+    results=[]
+    for f,n,mapped_n,error in zip(fpaths, ns, mapped_ns, errors):
+        if n == 0:
+            mapped_n=None
+        results.append([f, n, mapped_n, error])
+    return results
+
+
+def wilson_interval(k, n, z):
+    p= k / n
+    denom= 1 + z * z / n
+    center= (p + z * z / (2 * n)) / denom
+    half= z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return max(0, center - half), center + half
+
+
+def count_mapped_kmer(args, params, filenames, f, kmer_index):
+    import kmer_search   # numpy is needed only with -kmer
+    if args.early_stop is True:
+        batch_size=params.quick_check_early_stop_batch
+        # Bonferroni over the planned looks, one per batch from min_reads up to quick_check_read_num
+        looks=max(1, math.ceil((params.quick_check_read_num - params.quick_check_early_stop_min_reads) / batch_size) + 1)
+        alpha=(1 - params.quick_check_early_stop_confidence) / looks
+        z=statistics.NormalDist().inv_cdf(1 - alpha / 2)
+    else:
+        batch_size=params.quick_check_kmer_batch
+    n=0
+    mapped_n=0
+    mapped_reads=0
+    batch=[]
+    reads=iter_unmapped_reads(args, params, f)
+    for _,seq,qual in reads:
+        batch.append((seq, qual))
+        n += 1
+        if len(batch) == batch_size:
+            n_aln,n_reads=kmer_search.count_alignments(params, batch, kmer_index)
+            mapped_n += n_aln
+            mapped_reads += n_reads
+            batch=[]
+            # sequential test on the fraction of reads with a hit, which is binomial; alignments per hit read (up to 5)
+            # scale the interval to the alignment rate used by judge_ratio
+            if args.early_stop is True and n >= params.quick_check_early_stop_min_reads and n < params.quick_check_read_num:
+                lower,upper=wilson_interval(mapped_reads, n, z)
+                per_read=mapped_n / mapped_reads if mapped_reads >= 1 else 1
+                lower,upper=lower * per_read,upper * per_read
+                if judge_ratio(lower) == judge_ratio(upper):
+                    reads.close()
+                    log.logger.info('Early stop for %s: %s after %d reads (%d mapped, %.1f-%.1f per million).' % (f, judge_ratio(lower), n, mapped_n, lower * 1000000, upper * 1000000))
+                    return n, mapped_n
+    if len(batch) >= 1:
+        mapped_n += kmer_search.count_alignments(params, batch, kmer_index)[0]
+    if n == 0:
+        return n, None
+    if args.early_stop is True and n < params.quick_check_read_num:
+        log.logger.warning('Only %d unmapped reads were found in %s. Will continue anyway.' % (n, f))
+    return n, mapped_n
+
+
+def count_mapped_one(args, params, filenames, f, kmer_index):
+    try:
+        if args.workers >= 2:
+            # per-process intermediate files
+            filenames=copy.copy(filenames)
+            filenames.unmapped='%s.%d' % (filenames.unmapped, os.getpid())
+            filenames.mapped_sam='%s.%d' % (filenames.mapped_sam, os.getpid())
+        if args.kmer is True:
+            n,mapped_n=count_mapped_kmer(args, params, filenames, f, kmer_index)
+        else:
+            n,mapped_n=count_mapped_hisat2(args, params, filenames, f)
+            if args.workers >= 2 and os.path.exists(filenames.mapped_sam) is True:
+                utils.gzip_or_del(args, params, filenames.mapped_sam)
+        return f, n, mapped_n, None
+    except (Exception, SystemExit):
+        if args.resume is False:
+            raise
+        log.logger.warning('Error occurred while analyzing %s. Will skip this file.\n%s' % (f, traceback.format_exc()))
+        return f, None, None, traceback.format_exc()
+
+
+def count_mapped_worker(f):
+    args,params,filenames,kmer_index=worker_context
+    return count_mapped_one(args, params, filenames, f, kmer_index)
+
+
+def load_checkpoint(args, filenames):
+    completed={}
+    if args.resume is True and os.path.exists(filenames.checkpoint) is True:
+        with open(filenames.checkpoint) as infile:
+            for line in infile:
+                if line[0] == '#' or not line.endswith('\n'):
+                    continue
+                ls=line.rstrip('\n').split('\t')
+                mapped_n=None if ls[4] == 'NA' else int(ls[4])
+                completed[ls[0]]=[int(ls[1]), int(ls[2]), int(ls[3]), mapped_n]
+    else:
+        with open(filenames.checkpoint, 'w') as outfile:
+            outfile.write('#file\tsize\tmtime_ns\tnum_unmapped_read_analyzed\tnum_read_mapped_to_HHV6\n')
+    return completed
+
+
+def append_checkpoint(filenames, f, n, mapped_n):
+    # one write() per record on an O_APPEND fd, so records are never interleaved
+    stat=os.stat(f)
+    line='%s\t%d\t%d\t%d\t%s\n' % (f, stat.st_size, stat.st_mtime_ns, n, 'NA' if mapped_n is None else str(mapped_n))
+    fd=os.open(filenames.checkpoint, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    try:
+        os.write(fd, line.encode())
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 def checking(args, params, filenames):
     log.logger.debug('started.')
     try:
         read_num_limit=params.quick_check_read_num
-        no_hhv_threshold= 3 / 1000000
-        need_check_threshold= 20 / 1000000
-        dr_threshold= 150 / 1000000
         n_false=0
         n_need_check=0
         n_dr=0
         n_full=0
         
-        finalfile=open(filenames.final_result, 'w')
-        finalfile.write('#file\tnum_unmapped_read_analyzed\tnum_read_mapped_to_HHV6\tHHV6_exists?\n')
+        # files finished in a previous run are skipped when -resume
+        completed=load_checkpoint(args, filenames)
+        todo=[]
         for f in filenames.fpaths:
-            if args.file_type == 'rb':
-                infile=pysam.AlignmentFile(f, 'rb', check_sq=False)
-            elif args.file_type == 'rc':
-                infile=pysam.AlignmentFile(f, 'rc', reference_filename=args.fa)
-            n=0
-            with open(filenames.unmapped, 'w') as outfile:
-                tmp=[]
-                for read in infile.fetch('*', until_eof=True):
-                    if read.is_unmapped:
-                        if not 'TAACCC' in read.query_sequence and not 'GGGTTA' in read.query_sequence:
-                            if read.is_read1 is True:
-                                header='@%s/1' % read.query_name
-                            else:
-                                header='@%s/2' % read.query_name
-                            tmp.append('%s\n%s\n+\n%s\n' % (header, read.query_sequence, read.qual))
-                            n += 1
-                    if len(tmp) == 100_000:
-                        outfile.write(''.join(tmp))
-                        tmp=[]
-                    if n == read_num_limit:
-                        break
-                if len(tmp) >= 1:
-                    outfile.write(''.join(tmp))
-                outfile.flush()
-                os.fdatasync(outfile.fileno())
-            infile.close()
-            if n == 0:
-                log.logger.info('No unmapped reads found in %s. Will continue anyway.' % (n, f))
-                finalfile.write('%s\t%d\tNA\tNA\n' % (f, n))
-                utils.gzip_or_del(args, params, filenames.unmapped)
+            if f in filenames.failed:
                 continue
-            elif n < read_num_limit:
-                log.logger.warning('Only %d unmapped reads were found in %s. Will continue anyway.' % (n, f))
-            # mapping
-            cmd='hisat2 --mp %s -t -x %s -p %d -U %s --no-spliced-alignment > %s' % (params.hisat2_mismatch_penalties, args.vrefindex, args.p, filenames.unmapped, filenames.mapped_sam)
-            out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-            log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-            if not out.returncode == 0:
-                log.logger.error('Error occurred during mapping.')
-                exit(1)
-            utils.gzip_or_del(args, params, filenames.unmapped)
-            # count mapped
-            mapped_n=0
-            with open(filenames.mapped_sam) as infile:
-                for line in infile:
-                    if not line[0] == '@':
-                        ls=line.split()
-                        if not ls[5] == '*':
-                            readlen=len(ls[9])
-                            if ls[5] == '%dM' % readlen:
-                                mapped_n += 1
-            mapped_ratio= mapped_n / n
-            if mapped_ratio < no_hhv_threshold:
-                judge='False'
-                n_false += 1
-            elif mapped_ratio < need_check_threshold:
-                judge='Need_further_check'
-                n_need_check += 1
-            elif mapped_ratio < dr_threshold:
-                judge='likely_solo-DR'
-                n_dr += 1
-            else:
-                judge='likely_Full-length'
-                n_full += 1
-            finalfile.write('%s\t%d\t%d\t%s\n' % (f, n, mapped_n, judge))
-        utils.gzip_or_del(args, params, filenames.mapped_sam)
-        finalfile.flush()
-        os.fdatasync(finalfile.fileno())
+            if f in completed:
+                stat=os.stat(f)
+                if completed[f][0] == stat.st_size and completed[f][1] == stat.st_mtime_ns:
+                    continue
+                del completed[f]
+            todo.append(f)
+        n_done= len(filenames.fpaths) - len(filenames.failed) - len(todo)
+        if n_done >= 1:
+            log.logger.info('%d file(s) were already analyzed. %d file(s) remain.' % (n_done, len(todo)))
+        
+        global worker_context
+        kmer_index=None
+        if args.kmer is True and len(todo) >= 1:
+            import kmer_search
+            kmer_index=kmer_search.load_index(args, params, filenames)
+        if len(todo) == 0:
+            results=[]
+        elif args.stream is True:
+            results=count_mapped_hisat2_stream(args, params, filenames, todo)
+        elif args.workers >= 2:
+            # -p is divided among workers, for hisat2 and BAM/CRAM decompression of each
+            wargs=copy.copy(args)
+            wargs.p=max(1, args.p // args.workers)
+            worker_context=[wargs, params, filenames, kmer_index]
+            pool=multiprocessing.get_context('fork').Pool(args.workers)
+            results=pool.imap_unordered(count_mapped_worker, todo)
+        else:
+            results=( count_mapped_one(args, params, filenames, f, kmer_index) for f in todo )
+        for f,n,mapped_n,error in results:
+            if error is not None:
+                filenames.failed[f]=error
+                continue
+            append_checkpoint(filenames, f, n, mapped_n)
+            completed[f]=[None, None, n, mapped_n]
+        if args.stream is False and args.workers >= 2 and len(todo) >= 1:
+            pool.close()
+            pool.join()
+        if os.path.exists(filenames.mapped_sam) is True:
+            utils.gzip_or_del(args, params, filenames.mapped_sam)
+        
+        # final result in the order of input files
+        with open(filenames.final_result +'.tmp', 'w') as finalfile:
+            finalfile.write('#file\tnum_unmapped_read_analyzed\tnum_read_mapped_to_HHV6\tHHV6_exists?\n')
+            for f in filenames.fpaths:
+                if f in filenames.failed:
+                    finalfile.write('%s\tNA\tNA\tError\n' % f)
+                    continue
+                _,_,n,mapped_n=completed[f]
+                if n == 0:
+                    log.logger.info('No unmapped reads found in %s. Will continue anyway.' % f)
+                    finalfile.write('%s\t%d\tNA\tNA\n' % (f, n))
+                    continue
+                elif n < read_num_limit and args.early_stop is False:
+                    log.logger.warning('Only %d unmapped reads were found in %s. Will continue anyway.' % (n, f))
+                judge=judge_hhv6(mapped_n, n)
+                if judge == 'False':
+                    n_false += 1
+                elif judge == 'Need_further_check':
+                    n_need_check += 1
+                elif judge == 'likely_solo-DR':
+                    n_dr += 1
+                else:
+                    n_full += 1
+                finalfile.write('%s\t%d\t%d\t%s\n' % (f, n, mapped_n, judge))
+            finalfile.flush()
+            os.fdatasync(finalfile.fileno())
+        os.replace(filenames.final_result +'.tmp', filenames.final_result)
+        if len(filenames.failed) >= 1:
+            log.logger.warning('%d file(s) could not be analyzed. Please rerun with -resume after fixing them:\n%s' % (len(filenames.failed), '\n'.join(filenames.failed)))
         log.logger.info('\n\n\033[34mQuick check result:\n\n  No HHV-6 = %d\n  Need check = %d\n  Likely solo-DR = %d\n  Likely Full-length = %d\033[0m\n\n  \033[31mCaveats: This result is estimation and only for a screening purpose. This is not a conclusive result.\033[0m\n' % (n_false, n_need_check, n_dr, n_full))
         
     except:
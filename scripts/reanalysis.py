@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os
+import pipeline,threads,profiling
+import log,traceback
+import perf
+
+
+def run(args, params, prev_args, base):
+    log.logger.debug('started.')
+    try:
+        import pysam
+        import reconstruct_hhv6
+        prev_args.outdir=args.prev_outdir
+        prev=pipeline.set_filenames(prev_args, base)
+        filenames=pipeline.set_filenames(args, base)
+        # dedup BAM, metrics and coverage of the previous run are used as they are
+        for key in ['mapped_to_virus_bam', 'mapped_to_virus_bai', 'markdup_metrix', 'coverage']:
+            setattr(filenames, key, getattr(prev, key))
+        manifest=pipeline.load_manifest(prev)
+        if args.ONT_bamin is False and manifest.get('map', {}).get('values', {}).get('read_mapped') is False:
+            log.logger.info('No read was mapped in %s.' % args.prev_outdir)
+            return
+        if os.path.exists(filenames.coverage) is False:
+            log.logger.error('Coverage (%s) was not found. Please rerun the pipeline with -resume.' % filenames.coverage)
+            exit(1)
+        perf.start_stage('summary')
+        with profiling.stage(args, 'summary'):
+            values=pipeline.summary(args, params, filenames)
+        perf.end_stage()
+        for refid,highcov,name in [[pipeline.hhv6a_refid, 'hhv6a_highcov', 'hhv6a'], [pipeline.hhv6b_refid, 'hhv6b_highcov', 'hhv6b']]:
+            if values[highcov] is False:
+                continue
+            perf.start_stage('reconst_%s' % name[-1])
+            with profiling.stage(args, 'reconst_%s' % name[-1]):
+                prev_vcf=getattr(prev, name +'_vcf_gz')
+                if os.path.exists(prev_vcf) is True:
+                    log.logger.info('HHV-6%s consensus with variants of the previous run started.' % name[-1].upper())
+                    reconstruct_hhv6.reconsensus(args, params, filenames, refid, prev_vcf, getattr(filenames, name +'_norm_vcf_gz'), getattr(filenames, name +'_gatk_naive'))
+                else:
+                    # newly judged as high coverage; variants are called from the previous dedup BAM
+                    made_bai=False
+                    if os.path.exists(filenames.mapped_to_virus_bai) is False:
+                        pysam.index('-@', threads.extra('samtools index', args.p), filenames.mapped_to_virus_bam, filenames.mapped_to_virus_bai)
+                        made_bai=True
+                    if name == 'hhv6a':
+                        pipeline.reconst_a(args, params, filenames)
+                    else:
+                        pipeline.reconst_b(args, params, filenames)
+                    if made_bai is True and args.keep is False:
+                        os.remove(filenames.mapped_to_virus_bai)
+            perf.end_stage()
+        if args.ONT_bamin is False and (values['hhv6a_highcov'] is True or values['hhv6b_highcov'] is True):
+            log.logger.info('DR sequences are not reconstructed again. Please see %s for DR results.' % args.prev_outdir)
+        perf.save(filenames.performance)
+        perf.report(filenames.performance)
+        profiling.report(args)
+    except SystemExit:
+        raise
+    except:
+        log.logger.error('\n'+ traceback.format_exc())
+        exit(1)
@@ -7,23 +7,19 @@ See file LICENSE for details.
 '''
 
 
-import os,subprocess
+import os
 import log,traceback
+import runner,threads
 import pysam
-import utils
+import utils,covfile
 
 
 def mask_low_depth(args, params, filenames, orig_seq_file, refseqid):
     log.logger.debug('started.')
     try:
-        depth=[]
-        with open(filenames.bedgraph) as infile:
-            for line in infile:
-                ls=line.split()
-                if ls[0] == refseqid:
-                    val=int(ls[3])
-                    for _ in range(int(ls[1]), int(ls[2])):
-                        depth.append(val)
+        depth=covfile.depth_array(filenames.coverage, refseqid)
+        if depth is None:
+            depth=[]
         orig_seq=[]
         with open(orig_seq_file) as infile:
             for line in infile:
@@ -55,10 +51,6 @@ def mask_low_depth(args, params, filenames, orig_seq_file, refseqid):
 def reconst_a(args, params, filenames, refseqid):
     log.logger.debug('started.')
     try:
-        if args.p <= 2:
-            thread_n=args.p
-        elif args.p >= 3:
-            thread_n=args.p - 1
         if args.alignmentin is True:
             sample_name=os.path.basename(args.b) if not args.b is None else os.path.basename(args.c)
         elif args.fastqin is True:
@@ -76,48 +68,29 @@ def reconst_a(args, params, filenames, refseqid):
         
         if os.path.exists(filenames.tmp_fa_dict) is True:
             os.remove(filenames.tmp_fa_dict)
-        cmd='java -jar %s CreateSequenceDictionary R=%s O=%s' % (args.picard, filenames.tmp_fa, filenames.tmp_fa_dict)
-        log.logger.debug('picard command = `'+ cmd +'`')
-        out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-        log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-        if not out.returncode == 0:
-            log.logger.error('Error occurred during gatk running.')
-            exit(1)
-        cmd='java -jar %s AddOrReplaceReadGroups I=%s O=%s RGLB=lib1 RGPL=ILLUMINA RGPU=unit1 RGSM=20' % (args.picard, filenames.tmp_bam, filenames.tmp_rg_bam)
-        log.logger.debug('picard command = `'+ cmd +'`')
-        out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-        log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-        if not out.returncode == 0:
+        # the two picard steps are independent; each has a small explicit heap, charged by scheduler.stage_resources
+        gc_n=threads.split(args.p, ['picard', 'picard'])
+        jobs=[runner.start(['java', '-Xmx%dm' % int(params.picard_java_heap_gb * 1024), threads.jvm_gc(gc_n[0]), '-jar', args.picard, 'CreateSequenceDictionary', 'R=%s' % filenames.tmp_fa, 'O=%s' % filenames.tmp_fa_dict]),
+              runner.start(['java', '-Xmx%dm' % int(params.picard_java_heap_gb * 1024), threads.jvm_gc(gc_n[1]), '-jar', args.picard, 'AddOrReplaceReadGroups', 'I=%s' % filenames.tmp_bam, 'O=%s' % filenames.tmp_rg_bam, 'RGLB=lib1', 'RGPL=ILLUMINA', 'RGPU=unit1', 'RGSM=20'])]
+        returncodes=[ j.wait() for j in jobs ]
+        if not returncodes == [0, 0]:
             log.logger.error('Error occurred during gatk running.')
             exit(1)
-#        pysam.index('-@', str(thread_n), filenames.tmp_rg_bam)
-        pysam.index(filenames.tmp_rg_bam)
-        cmd='gatk --java-options "-Xmx4g" HaplotypeCaller -R %s -I %s -O %s' % (filenames.tmp_fa, filenames.tmp_rg_bam, filenames.hhv6a_vcf_gz)
-        log.logger.debug('gatk command = `'+ cmd +'`')
-        out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-        log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-        if not out.returncode == 0:
+        pysam.index('-@', threads.extra('samtools index', args.p), filenames.tmp_rg_bam)
+        cmd=['gatk', '--java-options', '-Xmx%dm' % int(params.gatk_java_heap_gb * 1024), 'HaplotypeCaller', '--native-pair-hmm-threads', threads.useful('HaplotypeCaller', args.p), '-R', filenames.tmp_fa, '-I', filenames.tmp_rg_bam, '-O', filenames.hhv6a_vcf_gz]
+        if not runner.run(cmd, limits=runner.budget(args, params.gatk_java_heap_gb + params.jvm_overhead_gb)) == 0:
             log.logger.error('Error occurred during gatk running.')
             exit(1)
-        cmd='bcftools norm -c x -f %s %s -Oz -o %s' % (filenames.tmp_masked_fa, filenames.hhv6a_vcf_gz, filenames.hhv6a_norm_vcf_gz)
-        log.logger.debug('bcftools command = `'+ cmd +'`')
-        out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-        log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-        if not out.returncode == 0:
+        cmd=['bcftools', 'norm', '--threads', threads.extra('bcftools', args.p), '-c', 'x', '-f', filenames.tmp_masked_fa, filenames.hhv6a_vcf_gz, '-Oz', '-o', filenames.hhv6a_norm_vcf_gz]
+        if not runner.run(cmd) == 0:
             log.logger.error('Error occurred during bcftools running.')
             exit(1)
-        cmd='bcftools index %s' % filenames.hhv6a_norm_vcf_gz
-        log.logger.debug('bcftools command = `'+ cmd +'`')
-        out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-        log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-        if not out.returncode == 0:
+        cmd=['bcftools', 'index', '--threads', threads.extra('bcftools', args.p), filenames.hhv6a_norm_vcf_gz]
+        if not runner.run(cmd) == 0:
             log.logger.error('Error occurred during bcftools running.')
             exit(1)
-        cmd='bcftools consensus -f %s -o %s %s' % (filenames.tmp_masked_fa, filenames.hhv6a_gatk_naive, filenames.hhv6a_norm_vcf_gz)
-        log.logger.debug('bcftools command = `'+ cmd +'`')
-        out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-        log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-        if not out.returncode == 0:
+        cmd=['bcftools', 'consensus', '-f', filenames.tmp_masked_fa, '-o', filenames.hhv6a_gatk_naive, filenames.hhv6a_norm_vcf_gz]
+        if not runner.run(cmd) == 0:
             log.logger.error('Error occurred during bcftools running.')
             exit(1)
         # remove unnecessary files
@@ -133,13 +106,10 @@ def reconst_a(args, params, filenames, refseqid):
             os.remove(filenames.hhv6a_norm_vcf_gz)
             os.remove(filenames.hhv6a_norm_vcf_gz +'.csi')
         if args.denovo is True:
-            pysam.sort('-@', '%d' % thread_n, '-n', '-O', 'BAM', '-o', filenames.tmp_sorted_bam, filenames.tmp_bam)
-            pysam.fastq('-@', '%d' % thread_n, '-N', '-f', '1', '-F', '3852', '-0', '/dev/null', '-1', filenames.tmp_bam_fq1, '-2', filenames.tmp_bam_fq2, '-s', '/dev/null', filenames.tmp_sorted_bam)
-            cmd='metaspades.py -1 %s -2 %s -k %s -t %d -m %d -o %s' % (filenames.tmp_bam_fq1, filenames.tmp_bam_fq2, params.metaspades_kmer, thread_n, params.metaspades_memory, filenames.hhv6a_metaspades_o)
-            log.logger.debug('metaspades command = `'+ cmd +'`')
-            out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-            log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-            if not out.returncode == 0:
+            pysam.sort('-@', threads.extra('samtools sort', args.p), '-n', '-O', 'BAM', '-o', filenames.tmp_sorted_bam, filenames.tmp_bam)
+            pysam.fastq('-@', threads.extra('samtools fastq', args.p), '-N', '-f', '1', '-F', '3852', '-0', '/dev/null', '-1', filenames.tmp_bam_fq1, '-2', filenames.tmp_bam_fq2, '-s', '/dev/null', filenames.tmp_sorted_bam)
+            cmd=['metaspades.py', '-1', filenames.tmp_bam_fq1, '-2', filenames.tmp_bam_fq2, '-k', params.metaspades_kmer, '-t', threads.useful('metaspades.py', args.p), '-m', params.metaspades_memory, '-o', filenames.hhv6a_metaspades_o]
+            if not runner.run(cmd) == 0:
                 log.logger.error('Error occurred during metaspades running.')
                 exit(1)
             # remove unnecessary files
@@ -155,10 +125,6 @@ def reconst_a(args, params, filenames, refseqid):
 def reconst_b(args, params, filenames, refseqid):
     log.logger.debug('started.')
     try:
-        if args.p <= 2:
-            thread_n=args.p
-        elif args.p >= 3:
-            thread_n=args.p - 1
         if args.alignmentin is True:
             sample_name=os.path.basename(args.b) if not args.b is None else os.path.basename(args.c)
         elif args.fastqin is True:
@@ -176,48 +142,29 @@ def reconst_b(args, params, filenames, refseqid):
         
         if os.path.exists(filenames.tmp_fa_dict) is True:
             os.remove(filenames.tmp_fa_dict)
-        cmd='java -jar %s CreateSequenceDictionary R=%s O=%s' % (args.picard, filenames.tmp_fa, filenames.tmp_fa_dict)
-        log.logger.debug('picard command = `'+ cmd +'`')
-        out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-        log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-        if not out.returncode == 0:
-            log.logger.error('Error occurred during gatk running.')
-            exit(1)
-        cmd='java -jar %s AddOrReplaceReadGroups I=%s O=%s RGLB=lib1 RGPL=ILLUMINA RGPU=unit1 RGSM=20' % (args.picard, filenames.tmp_bam, filenames.tmp_rg_bam)
-        log.logger.debug('picard command = `'+ cmd +'`')
-        out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-        log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-        if not out.returncode == 0:
+        # the two picard steps are independent; each has a small explicit heap, charged by scheduler.stage_resources
+        gc_n=threads.split(args.p, ['picard', 'picard'])
+        jobs=[runner.start(['java', '-Xmx%dm' % int(params.picard_java_heap_gb * 1024), threads.jvm_gc(gc_n[0]), '-jar', args.picard, 'CreateSequenceDictionary', 'R=%s' % filenames.tmp_fa, 'O=%s' % filenames.tmp_fa_dict]),
+              runner.start(['java', '-Xmx%dm' % int(params.picard_java_heap_gb * 1024), threads.jvm_gc(gc_n[1]), '-jar', args.picard, 'AddOrReplaceReadGroups', 'I=%s' % filenames.tmp_bam, 'O=%s' % filenames.tmp_rg_bam, 'RGLB=lib1', 'RGPL=ILLUMINA', 'RGPU=unit1', 'RGSM=20'])]
+        returncodes=[ j.wait() for j in jobs ]
+        if not returncodes == [0, 0]:
             log.logger.error('Error occurred during gatk running.')
             exit(1)
-#        pysam.index('-@', str(thread_n), filenames.tmp_rg_bam)
-        pysam.index(filenames.tmp_rg_bam)
-        cmd='gatk --java-options "-Xmx4g" HaplotypeCaller -R %s -I %s -O %s' % (filenames.tmp_fa, filenames.tmp_rg_bam, filenames.hhv6b_vcf_gz)
-        log.logger.debug('gatk command = `'+ cmd +'`')
-        out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-        log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-        if not out.returncode == 0:
+        pysam.index('-@', threads.extra('samtools index', args.p), filenames.tmp_rg_bam)
+        cmd=['gatk', '--java-options', '-Xmx%dm' % int(params.gatk_java_heap_gb * 1024), 'HaplotypeCaller', '--native-pair-hmm-threads', threads.useful('HaplotypeCaller', args.p), '-R', filenames.tmp_fa, '-I', filenames.tmp_rg_bam, '-O', filenames.hhv6b_vcf_gz]
+        if not runner.run(cmd, limits=runner.budget(args, params.gatk_java_heap_gb + params.jvm_overhead_gb)) == 0:
             log.logger.error('Error occurred during gatk running.')
             exit(1)
-        cmd='bcftools norm -c x -f %s %s -Oz -o %s' % (filenames.tmp_masked_fa, filenames.hhv6b_vcf_gz, filenames.hhv6b_norm_vcf_gz)
-        log.logger.debug('bcftools command = `'+ cmd +'`')
-        out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-        log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-        if not out.returncode == 0:
+        cmd=['bcftools', 'norm', '--threads', threads.extra('bcftools', args.p), '-c', 'x', '-f', filenames.tmp_masked_fa, filenames.hhv6b_vcf_gz, '-Oz', '-o', filenames.hhv6b_norm_vcf_gz]
+        if not runner.run(cmd) == 0:
             log.logger.error('Error occurred during bcftools running.')
             exit(1)
-        cmd='bcftools index %s' % filenames.hhv6b_norm_vcf_gz
-        log.logger.debug('bcftools command = `'+ cmd +'`')
-        out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-        log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-        if not out.returncode == 0:
+        cmd=['bcftools', 'index', '--threads', threads.extra('bcftools', args.p), filenames.hhv6b_norm_vcf_gz]
+        if not runner.run(cmd) == 0:
             log.logger.error('Error occurred during bcftools running.')
             exit(1)
-        cmd='bcftools consensus -f %s -o %s %s' % (filenames.tmp_masked_fa, filenames.hhv6b_gatk_naive, filenames.hhv6b_norm_vcf_gz)
-        log.logger.debug('bcftools command = `'+ cmd +'`')
-        out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-        log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-        if not out.returncode == 0:
+        cmd=['bcftools', 'consensus', '-f', filenames.tmp_masked_fa, '-o', filenames.hhv6b_gatk_naive, filenames.hhv6b_norm_vcf_gz]
+        if not runner.run(cmd) == 0:
             log.logger.error('Error occurred during bcftools running.')
             exit(1)
         # remove tmp files
@@ -234,13 +181,10 @@ def reconst_b(args, params, filenames, refseqid):
             os.remove(filenames.hhv6b_norm_vcf_gz)
             os.remove(filenames.hhv6b_norm_vcf_gz +'.csi')
         if args.denovo is True:
-            pysam.sort('-@', '%d' % thread_n, '-n', '-O', 'BAM', '-o', filenames.tmp_sorted_bam, filenames.tmp_bam)
-            pysam.fastq('-@', '%d' % thread_n, '-N', '-f', '1', '-F', '3852', '-0', '/dev/null', '-1', filenames.tmp_bam_fq1, '-2', filenames.tmp_bam_fq2, '-s', '/dev/null', filenames.tmp_sorted_bam)
-            cmd='metaspades.py -1 %s -2 %s -k %s -t %d -m %d -o %s' % (filenames.tmp_bam_fq1, filenames.tmp_bam_fq2, params.metaspades_kmer, thread_n, params.metaspades_memory, filenames.hhv6b_metaspades_o)
-            log.logger.debug('metaspades command = `'+ cmd +'`')
-            out=subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
-            log.logger.debug('\n'+ '\n'.join([ l.decode() for l in out.stderr.splitlines() ]))
-            if not out.returncode == 0:
+            pysam.sort('-@', threads.extra('samtools sort', args.p), '-n', '-O', 'BAM', '-o', filenames.tmp_sorted_bam, filenames.tmp_bam)
+            pysam.fastq('-@', threads.extra('samtools fastq', args.p), '-N', '-f', '1', '-F', '3852', '-0', '/dev/null', '-1', filenames.tmp_bam_fq1, '-2', filenames.tmp_bam_fq2, '-s', '/dev/null', filenames.tmp_sorted_bam)
+            cmd=['metaspades.py', '-1', filenames.tmp_bam_fq1, '-2', filenames.tmp_bam_fq2, '-k', params.metaspades_kmer, '-t', threads.useful('metaspades.py', args.p), '-m', params.metaspades_memory, '-o', filenames.hhv6b_metaspades_o]
+            if not runner.run(cmd) == 0:
                 log.logger.error('Error occurred during metaspades running.')
                 exit(1)
             # remove unnecessary files
@@ -254,3 +198,42 @@ def reconst_b(args, params, filenames, refseqid):
         log.logger.error('\n'+ traceback.format_exc())
         exit(1)
 
+
+def reconsensus(args, params, filenames, refseqid, vcf_gz, norm_vcf_gz, gatk_naive):
+    # masking and consensus only; variants were called in a previous run
+    log.logger.debug('started.')
+    try:
+        if args.alignmentin is True:
+            sample_name=os.path.basename(args.b) if not args.b is None else os.path.basename(args.c)
+        elif args.fastqin is True:
+            sample_name=os.path.basename(args.fq1)
+        elif args.ONT_bamin is True:
+            sample_name=args.ONT_bam
+        _,seq=utils.retrieve_only_one_virus_fasta(args.vref, refseqid)
+        with open(filenames.tmp_fa, 'w') as outfile:
+            outfile.write('>%s %s\n%s\n' % (refseqid, sample_name, seq))
+        pysam.faidx(filenames.tmp_fa)
+        mask_low_depth(args, params, filenames, filenames.tmp_fa, refseqid)
+        cmd=['bcftools', 'norm', '--threads', threads.extra('bcftools', args.p), '-c', 'x', '-f', filenames.tmp_masked_fa, vcf_gz, '-Oz', '-o', norm_vcf_gz]
+        if not runner.run(cmd) == 0:
+            log.logger.error('Error occurred during bcftools running.')
+            exit(1)
+        cmd=['bcftools', 'index', '--threads', threads.extra('bcftools', args.p), '-f', norm_vcf_gz]
+        if not runner.run(cmd) == 0:
+            log.logger.error('Error occurred during bcftools running.')
+            exit(1)
+        cmd=['bcftools', 'consensus', '-f', filenames.tmp_masked_fa, '-o', gatk_naive, norm_vcf_gz]
+        if not runner.run(cmd) == 0:
+            log.logger.error('Error occurred during bcftools running.')
+            exit(1)
+        # remove unnecessary files
+        os.remove(filenames.tmp_fa)
+        os.remove(filenames.tmp_fa +'.fai')
+        os.remove(filenames.tmp_masked_fa)
+        os.remove(filenames.tmp_masked_fa +'.fai')
+        if args.keep is False:
+            os.remove(norm_vcf_gz)
+            os.remove(norm_vcf_gz +'.csi')
+    except:
+        log.logger.error('\n'+ traceback.format_exc())
+        exit(1)
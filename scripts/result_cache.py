@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,glob,json,time,shutil,hashlib
+import utils,env_cache
+import log,traceback
+
+
+# command line options which are file paths; files are represented by their content digests instead
+path_args=['b', 'c', 'fa', 'fq1', 'fq2', 'vref', 'vrefindex', 'picard', 'ONT_bam']
+
+
+def artifacts(filenames, stage_name):
+    # files stored in the cache for each cacheable stage
+    if stage_name == 'retrieve':
+        return [filenames.unmapped_merged_1, filenames.unmapped_merged_2]
+    elif stage_name == 'map':
+        return [filenames.mapped_to_virus_bam, filenames.mapped_to_virus_bai, filenames.markdup_metrix]
+    elif stage_name == 'coverage':
+        return [filenames.coverage]
+    return None
+
+
+def reference_files(args, stage_name):
+    if stage_name == 'map':
+        return sorted(glob.glob(args.vrefindex +'.*')) + [args.picard]
+    return []
+
+
+def stage_key(args, params, filenames, st, manifest):
+    # inputs made by an upstream cached stage are represented by its key, so intermediates are never hashed
+    if args.cache_dir is None or artifacts(filenames, st.name) is None:
+        return None
+    inputs=[]
+    for path in st.inputs:
+        if path is None:
+            continue
+        upstream=None
+        for name,record in manifest.items():
+            if record.get('cache_key') is not None and path in artifacts(filenames, name):
+                upstream=record['cache_key']
+        if upstream is not None:
+            inputs.append(['stage', upstream])
+        elif os.path.isfile(path) is True:
+            inputs.append(['file', utils.file_digest(path)])
+    d={'stage': st.name,
+       'params': params.__dict__,
+       'args': { k:getattr(args, k, None) for k in st.arg_keys if not k in path_args },
+       'inputs': inputs,
+       'references': [ env_cache.file_digest(path) for path in reference_files(args, st.name) if os.path.isfile(path) is True ]}
+    return hashlib.sha1(json.dumps(d, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def lookup(args, key):
+    # meta of a cache entry, or None; nothing is copied
+    if key is None:
+        return None
+    try:
+        with open(os.path.join(args.cache_dir, key, 'meta.json')) as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        return None
+
+
+def deferrable(args, params, filenames, stage_list, st, key, manifest):
+    # True when every later stage reading the artifacts of st is a cache hit as well
+    # e.g. unmapped reads are not copied out of the cache when the dedup BAM made from them is cached too
+    if lookup(args, key) is None:
+        return False
+    outs=set(artifacts(filenames, st.name))
+    sim=dict(manifest)
+    sim[st.name]={'cache_key': key}
+    for later in stage_list[[ s.name for s in stage_list ].index(st.name) + 1:]:
+        if len(outs & set(later.inputs)) == 0:
+            continue
+        k=stage_key(args, params, filenames, later, sim)
+        if lookup(args, k) is None:
+            return False
+        sim[later.name]={'cache_key': k}
+    return True
+
+
+def restore(args, filenames, stage_name, key, copy=True):
+    # returns values of the stage when all artifacts were restored, otherwise None
+    # with copy=False, only values are returned; artifacts are copied later by restore_deferred when needed
+    if key is None:
+        return None
+    entry=os.path.join(args.cache_dir, key)
+    meta_path=os.path.join(entry, 'meta.json')
+    if os.path.exists(meta_path) is False:
+        return None
+    try:
+        with open(meta_path) as infile:
+            meta=json.load(infile)
+        if copy is True:
+            for name,path in zip(meta['files'], artifacts(filenames, stage_name)):
+                if name is not None:
+                    shutil.copyfile(os.path.join(entry, name), path)
+        os.utime(meta_path)   # LRU
+        if copy is True:
+            log.logger.info('Stage "%s" was restored from cache (%s).' % (stage_name, key))
+        else:
+            log.logger.info('Stage "%s" was found in cache (%s). Its outputs are not copied as the following stages are cached as well.' % (stage_name, key))
+        return meta['values']
+    except (OSError, ValueError, KeyError):
+        # evicted by another process while copying
+        log.logger.debug('\n'+ traceback.format_exc())
+        return None
+
+
+def restore_deferred(args, filenames, st, manifest):
+    # copies artifacts of deferred upstream stages which st reads, e.g. when a cache entry was evicted after the look-ahead
+    for name,record in manifest.items():
+        if record.get('deferred') is not True or len(set(artifacts(filenames, name)) & set(st.inputs)) == 0:
+            continue
+        if restore(args, filenames, name, record['cache_key']) is None:
+            log.logger.error('Outputs of stage "%s" were removed from cache. Please rerun without -resume.' % name)
+            exit(1)
+        record['deferred']=False
+
+
+def store(args, filenames, st, key, values):
+    if key is None:
+        return
+    entry=os.path.join(args.cache_dir, key)
+    if os.path.exists(entry) is True:
+        return
+    tmp=os.path.join(args.cache_dir, '.tmp_%s_%d' % (key, os.getpid()))
+    try:
+        os.mkdir(tmp)
+        names=[]
+        for path in artifacts(filenames, st.name):
+            if os.path.isfile(path) is False:
+                names.append(None)
+                continue
+            names.append(os.path.basename(path))
+            shutil.copyfile(path, os.path.join(tmp, names[-1]))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as outfile:
+            json.dump({'stage': st.name, 'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'files': names, 'values': values}, outfile)
+        os.rename(tmp, entry)
+        log.logger.debug('Stage "%s" was stored in cache (%s).' % (st.name, key))
+    except OSError:
+        # another process stored the same key, or the disk is full; the cache is optional
+        log.logger.warning('Could not store stage "%s" in cache.\n%s' % (st.name, traceback.format_exc()))
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+    evict(args)
+
+
+def entry_size(entry):
+    return sum([ os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry) ])
+
+
+def evict(args):
+    # removes least recently used entries until the cache fits in -cache_size_gb
+    limit=args.cache_size_gb * 1024 ** 3
+    entries=[]
+    total=0
+    for key in os.listdir(args.cache_dir):
+        entry=os.path.join(args.cache_dir, key)
+        meta_path=os.path.join(entry, 'meta.json')
+        try:
+            size=entry_size(entry)
+            entries.append([os.path.getmtime(meta_path), size, entry])
+            total += size
+        except OSError:
+            continue
+    for _,size,entry in sorted(entries):
+        if total <= limit:
+            break
+        log.logger.debug('Removing %s from cache.' % entry)
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,glob,json,time,sqlite3
+import log,traceback
+
+
+# optional SQLite store of results; one row set per output directory, replaced when the directory is ingested again
+schema='''
+create table if not exists runs (run_id integer primary key, sample text, outdir text unique, ingested text);
+create table if not exists virus_summary (run_id integer, refid text, virus_exist integer, genome_length integer, mapped_length integer,
+    perc_genome_mapped real, average_depth real, average_depth_of_mapped_region real, ratio_to_autosome_depth real, fasta_header text);
+create table if not exists dr_summary (run_id integer, refid text, genome_length integer, mapped_length integer,
+    perc_genome_mapped real, average_depth real, average_depth_of_mapped_region real, ratio_to_autosome_depth real, fasta_header text);
+create table if not exists quick_check (run_id integer, file text, num_unmapped_read_analyzed integer, num_read_mapped_to_HHV6 integer, call text);
+create table if not exists stages (run_id integer, stage text, wall_sec real, cpu_sec real, peak_rss_mb real, read_bytes integer, write_bytes integer);
+create table if not exists outputs (run_id integer, kind text, path text);
+create index if not exists runs_sample on runs (sample);
+create index if not exists virus_summary_refid on virus_summary (refid, average_depth);
+create index if not exists virus_summary_run on virus_summary (run_id);
+create index if not exists dr_summary_refid on dr_summary (refid, average_depth);
+create index if not exists dr_summary_run on dr_summary (run_id);
+create index if not exists quick_check_call on quick_check (call);
+create index if not exists quick_check_run on quick_check (run_id);
+create index if not exists stages_run on stages (run_id);
+create index if not exists outputs_run on outputs (run_id);
+'''
+tables=['virus_summary', 'dr_summary', 'quick_check', 'stages', 'outputs']
+
+# final outputs recorded in the outputs table
+output_patterns=[['reconstructed', '*_reconstructed.fa'], ['vcf', '*.vcf.gz'], ['plot', '*.pdf'], ['assembly', '*_metaspades_assembly']]
+
+
+def sample_name(outdir):
+    # one rule for all entry points: a sample is named after its output directory; batch.py and worker.py name those directories after the sample sheet
+    return os.path.basename(os.path.abspath(outdir))
+
+
+def load_outdirs(path):
+    # output directories, one per line, optionally preceded by a sample name and a tab; batch_status.txt can be used as it is
+    samples=[]
+    with open(path) as infile:
+        for line in infile:
+            if line[0] == '#' or line.strip() == '':
+                continue
+            ls=line.rstrip('\n').split('\t')
+            if len(ls) >= 3:
+                if ls[1] == 'completed':
+                    samples.append([ls[0], ls[2]])
+            elif len(ls) == 2:
+                samples.append(ls)
+            else:
+                samples.append([sample_name(ls[0]), ls[0]])
+    return samples
+
+
+def connect(path):
+    conn=sqlite3.connect(path, timeout=600)
+    conn.executescript(schema)
+    return conn
+
+
+def number(s):
+    return None if s == 'NA' else float(s)
+
+
+def parse_summary(path):
+    # virus_detection_summary.txt and mapping_DR_summary.txt; returns dicts of key=value fields
+    rows=[]
+    with open(path) as infile:
+        for line in infile:
+            ls=line.rstrip('\n').split('\t')
+            d={'refid': ls[0][:-len('_DR')] if ls[0].endswith('_DR') else ls[0]}
+            for field in ls[1:]:
+                for info in field.split(';') if not field.startswith('fasta_header=') else [field]:
+                    k,v=info.split('=', 1)
+                    d[k]=v
+            rows.append(d)
+    return rows
+
+
+def parse_quick_check(path):
+    rows=[]
+    with open(path) as infile:
+        for line in infile:
+            if line[0] == '#':
+                continue
+            ls=line.rstrip('\n').split('\t')
+            rows.append([ls[0], None if ls[1] == 'NA' else int(ls[1]), None if ls[2] == 'NA' else int(ls[2]), ls[3]])
+    return rows
+
+
+def parse_stages(path):
+    with open(path) as infile:
+        d=json.load(infile)
+    latest={}
+    for r in d['stages']:
+        latest[r['stage']]=r
+    return [ [r['stage'], r['wall_sec'], r['cpu_user_sec'] + r['cpu_sys_sec'], r['peak_rss_mb'], r['read_bytes'], r['write_bytes']] for r in latest.values() ]
+
+
+def collect(sample, outdir):
+    # reads all result files of one output directory; files not present are skipped
+    outdir=os.path.abspath(outdir)
+    d={'sample': sample, 'outdir': outdir}
+    path=os.path.join(outdir, 'virus_detection_summary.txt')
+    d['virus_summary']=[]
+    if os.path.exists(path) is True:
+        for r in parse_summary(path):
+            d['virus_summary'].append([r['refid'], 1 if r['virus_exist'] == 'True' else 0, int(r['genome_length']), int(r['mapped_length']),
+                                       float(r['perc_genome_mapped']), float(r['average_depth']), float(r['average_depth_of_mapped_region']),
+                                       number(r['ratio_ave_virus_depth_to_autosome_depth']), r['fasta_header']])
+    path=os.path.join(outdir, 'mapping_DR_summary.txt')
+    d['dr_summary']=[]
+    if os.path.exists(path) is True:
+        for r in parse_summary(path):
+            d['dr_summary'].append([r['refid'], int(r['genome_length']), int(r['mapped_length']),
+                                    float(r['perc_genome_mapped']), float(r['average_depth']), float(r['average_depth_of_mapped_region']),
+                                    number(r['ratio_ave_virus_depth_to_autosome_depth']), r['fasta_header']])
+    path=os.path.join(outdir, 'HHV6_check_results.txt')
+    d['quick_check']=parse_quick_check(path) if os.path.exists(path) is True else []
+    path=os.path.join(outdir, 'performance.json')
+    d['stages']=parse_stages(path) if os.path.exists(path) is True else []
+    d['outputs']=[]
+    for kind,pattern in output_patterns:
+        for path in sorted(glob.glob(os.path.join(outdir, pattern))):
+            d['outputs'].append([kind, path])
+    return d
+
+
+def insert(conn, runs):
+    # one transaction for all runs; rows of a directory ingested before are replaced
+    placeholders={ t:','.join(['?'] * n) for t,n in [['virus_summary', 10], ['dr_summary', 9], ['quick_check', 5], ['stages', 7], ['outputs', 3]] }
+    now=time.strftime('%Y-%m-%d %H:%M:%S')
+    with conn:
+        for d in runs:
+            row=conn.execute('select run_id from runs where outdir = ?', (d['outdir'],)).fetchone()
+            if row is not None:
+                for t in tables:
+                    conn.execute('delete from %s where run_id = ?' % t, row)
+                conn.execute('update runs set sample = ?, ingested = ? where run_id = ?', (d['sample'], now, row[0]))
+                run_id=row[0]
+            else:
+                run_id=conn.execute('insert into runs (sample, outdir, ingested) values (?, ?, ?)', (d['sample'], d['outdir'], now)).lastrowid
+            for t in tables:
+                conn.executemany('insert into %s values (%s)' % (t, placeholders[t]), [ [run_id] + r for r in d[t] ])
+
+
+def ingest(db_path, samples):
+    # samples: list of [sample name, output directory]
+    log.logger.debug('started.')
+    try:
+        runs=[]
+        for sample,outdir in samples:
+            if os.path.isdir(outdir) is False:
+                log.logger.warning('%s was not found. Skipped.' % outdir)
+                continue
+            try:
+                runs.append(collect(sample, outdir))
+            except:
+                log.logger.warning('Results of %s could not be read. Skipped.\n%s' % (outdir, traceback.format_exc()))
+        conn=connect(db_path)
+        try:
+            insert(conn, runs)
+        finally:
+            conn.close()
+        log.logger.info('Results of %d run(s) were stored in %s.' % (len(runs), db_path))
+    except:
+        # the store is optional; any failure is a warning and results are still in the output directories
+        log.logger.warning('Could not store results in %s.\n%s' % (db_path, traceback.format_exc()))
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,time,threading,subprocess,resource
+import log,traceback
+import perf
+
+
+class limits:
+    # per-process limits applied with setrlimit between fork and exec; each process of a pipeline gets them
+    # mem_gb caps private writable memory (RLIMIT_DATA) rather than address space, so JVMs and thread arenas which reserve more than they use are not killed
+    # cpu_sec caps CPU time (RLIMIT_CPU); the process gets SIGXCPU when it is reached, and SIGKILL a second later if it ignores it
+    def __init__(self, mem_gb=None, cpu_sec=None):
+        self.mem_gb=mem_gb
+        self.cpu_sec=cpu_sec
+
+    def apply(self):
+        if self.mem_gb is not None:
+            limit=int(self.mem_gb * 1024 ** 3)
+            resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+        if self.cpu_sec is not None:
+            resource.setrlimit(resource.RLIMIT_CPU, (int(self.cpu_sec), int(self.cpu_sec) + 1))
+
+    def __str__(self):
+        l=[]
+        if self.mem_gb is not None:
+            l.append('memory %.1f GB' % self.mem_gb)
+        if self.cpu_sec is not None:
+            l.append('CPU time %d sec' % self.cpu_sec)
+        return ', '.join(l)
+
+
+def budget(args, mem_gb=None):
+    # limits of a command from the memory budget of its stage, set by the batch scheduler; mem_gb is used outside the scheduler
+    if getattr(args, 'mem_budget_gb', None) is not None:
+        mem_gb=args.mem_budget_gb
+    return None if mem_gb is None else limits(mem_gb=mem_gb)
+
+
+class job:
+    def __init__(self, cmds, procs, files, timeout, limits=None):
+        self.cmds=cmds
+        self.procs=procs
+        self.files=files
+        self.limits=limits
+        self.start_time=time.time()
+        self.timed_out=False
+        self.returncode=None
+        self.threads=[]
+        for cmd,proc in zip(cmds, procs):
+            t=threading.Thread(target=stream_stderr, args=(perf.tool_name(cmd), proc.stderr), daemon=True)
+            t.start()
+            self.threads.append(t)
+        self.timer=None
+        if timeout is not None:
+            self.timer=threading.Timer(timeout, self.kill)
+            self.timer.daemon=True
+            self.timer.start()
+
+    def kill(self):
+        self.timed_out=True
+        self.stop()
+
+    def stop(self):
+        for proc in self.procs:
+            if proc.returncode is None:
+                try:
+                    proc.kill()
+                except OSError:
+                    pass
+
+    @property
+    def stdin(self):
+        return self.procs[0].stdin
+
+    @property
+    def stdout(self):
+        return self.procs[-1].stdout
+
+    def wait(self):
+        # returns the exit status of the rightmost failed process, like `set -o pipefail`
+        if self.returncode is not None:
+            return self.returncode
+        if self.procs[0].stdin is not None:
+            self.procs[0].stdin.close()
+        returncodes=[]
+        for cmd,proc in zip(self.cmds, self.procs):
+            _,status,ru=os.wait4(proc.pid, 0)
+            proc.returncode=perf.exit_code(status)
+            perf.add_command(cmd, time.time() - self.start_time, ru, proc.returncode)
+            returncodes.append(proc.returncode)
+        for t in self.threads:
+            t.join()
+        for f in self.files:
+            f.close()
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.timed_out is True:
+            log.logger.error('Command timed out: `%s`' % command_str(self.cmds))
+        self.returncode=0
+        for rc in returncodes:
+            if not rc == 0:
+                self.returncode=rc
+        if not self.returncode == 0 and self.limits is not None:
+            log.logger.error('Command failed with exit status %d under limits (%s): `%s`' % (self.returncode, self.limits, command_str(self.cmds)))
+        return self.returncode
+
+
+def stream_stderr(tool, stream):
+    for line in stream:
+        log.logger.debug('%s: %s' % (tool, line.decode(errors='replace').rstrip('\n')))
+    stream.close()
+
+
+def command_str(cmds):
+    return ' | '.join([ ' '.join(cmd) for cmd in cmds ])
+
+
+# cmds: argv list, or list of argv lists connected by pipes; stdin/stdout: file path, subprocess.PIPE or None (inherit)
+# timeout: seconds of wall time after which all processes are killed; limits: runner.limits or None
+def start(cmds, stdin=None, stdout=None, timeout=None, limits=None):
+    if isinstance(cmds[0], str):
+        cmds=[cmds]
+    cmds=[ [ str(c) for c in cmd ] for cmd in cmds ]
+    log.logger.debug('command = `%s`' % command_str(cmds))
+    files=[]
+    if isinstance(stdin, str):
+        stdin=open(stdin, 'rb')
+        files.append(stdin)
+    if isinstance(stdout, str):
+        stdout=open(stdout, 'wb')
+        files.append(stdout)
+    procs=[]
+    prev=stdin
+    try:
+        for i,cmd in enumerate(cmds):
+            out=stdout if i == len(cmds) - 1 else subprocess.PIPE
+            proc=subprocess.Popen(cmd, stdin=prev, stdout=out, stderr=subprocess.PIPE, preexec_fn=None if limits is None else limits.apply)
+            if i >= 1:
+                prev.close()   # upstream gets SIGPIPE if downstream exits
+            prev=proc.stdout
+            procs.append(proc)
+    except OSError:
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+        for f in files:
+            f.close()
+        raise
+    return job(cmds, procs, files, timeout, limits)
+
+
+def run(cmds, stdin=None, stdout=None, timeout=None, limits=None):
+    try:
+        return start(cmds, stdin=stdin, stdout=stdout, timeout=timeout, limits=limits).wait()
+    except OSError:
+        log.logger.error('\n'+ traceback.format_exc())
+        return 127
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,copy,multiprocessing
+from multiprocessing.connection import wait
+import pipeline,scratch,threads,autosome_depth,results_db
+import log,traceback
+
+
+class sample:
+    def __init__(self, name, args):
+        self.name=name
+        self.args=args
+        self.filenames=None
+        self.stage_list=None
+        self.manifest=None
+        self.start=0
+        self.next=0
+        self.values={}
+        self.status='pending'
+        self.running=None
+        self.stages_run=[]
+
+
+def load_sample_sheet(args):
+    # tab-delimited; header line with "sample" and either "bam", "cram", "file" (.bam/.cram) or "fq1" (+"fq2"); "depth" (number or "auto") is optional
+    log.logger.debug('started.')
+    try:
+        samples=[]
+        names=set()
+        with open(args.sample_sheet) as infile:
+            header=None
+            for line in infile:
+                if line.strip() == '':
+                    continue
+                ls=line.rstrip('\n').split('\t')
+                if header is None:
+                    header=[ h.lstrip('#').strip() for h in ls ]
+                    if not 'sample' in header:
+                        log.logger.error('Sample sheet (%s) does not have "sample" column.' % args.sample_sheet)
+                        exit(1)
+                    continue
+                if line[0] == '#':
+                    continue
+                d={ h:v.strip() for h,v in zip(header, ls) if not v.strip() in ['', 'NA'] }
+                if d.get('sample') is None or d['sample'] in names:
+                    log.logger.error('Sample name is empty or duplicated: %s' % line.strip())
+                    exit(1)
+                names.add(d['sample'])
+                sargs=copy.copy(args)
+                sargs.outdir=os.path.join(args.outdir, d['sample'])
+                sargs.b,sargs.c,sargs.fq1,sargs.fq2=None,None,None,None
+                sargs.alignmentin,sargs.fastqin,sargs.single=False,False,False
+                if 'file' in d:
+                    if d['file'].endswith('.cram'):
+                        d['cram']=d['file']
+                    else:
+                        d['bam']=d['file']
+                if 'bam' in d:
+                    sargs.b=d['bam']
+                    sargs.alignmentin=True
+                elif 'cram' in d:
+                    sargs.c=d['cram']
+                    sargs.alignmentin=True
+                elif 'fq1' in d:
+                    sargs.fq1=d['fq1']
+                    sargs.fq2=d.get('fq2')
+                    sargs.fastqin=True
+                    sargs.single=True if sargs.fq2 is None else False
+                else:
+                    log.logger.error('No input file was specified for sample %s.' % d['sample'])
+                    exit(1)
+                if 'depth' in d:
+                    sargs.depth='auto' if d['depth'] == 'auto' else int(round(float(d['depth'])))
+                samples.append(sample(d['sample'], sargs))
+        log.logger.info('%d sample(s) will be analyzed.' % len(samples))
+        return samples
+    except SystemExit:
+        raise
+    except:
+        log.logger.error('\n'+ traceback.format_exc())
+        exit(1)
+
+
+def check_sample(s):
+    args=s.args
+    for path in [args.b, args.c, args.fq1, args.fq2]:
+        if path is not None and os.path.exists(path) is False:
+            return 'Input file (%s) was not found.' % path
+    if args.c is not None and args.fa is None:
+        return 'Reference genome was not specified.'
+    if args.depth == 'auto' and args.alignmentin is False:
+        return 'depth "auto" needs BAM or CRAM input.'
+    if os.path.exists(args.outdir) is True:
+        if args.overwrite is False and args.resume is False:
+            return '%s already exists. Please specify -overwrite or -resume.' % args.outdir
+    else:
+        os.mkdir(args.outdir)
+    return None
+
+
+def stage_resources(args, params, st):
+    # threads, memory (GB) and whether the stage is I/O-bound; threads are what the main tool of the stage can use
+    per_stage=min(args.p, args.p_per_sample)
+    if st.name == 'retrieve':
+        return threads.useful('samtools view', per_stage), 1, True
+    elif st.name in ['map', 'dr_map_a', 'dr_map_b']:
+        aligner='bwa' if args.bwa is True and st.name == 'map' else 'hisat2'
+        return threads.total(per_stage, [aligner, 'samtools view']), params.markdup_java_heap_gb + params.jvm_overhead_gb, False
+    elif st.name in ['reconst_a', 'reconst_b']:
+        # two picard JVMs run together before HaplotypeCaller
+        mem=max(params.gatk_java_heap_gb, 2 * params.picard_java_heap_gb + params.jvm_overhead_gb) + params.jvm_overhead_gb
+        if args.denovo is True:
+            return threads.useful('metaspades.py', per_stage), max(mem, params.metaspades_memory), False
+        return threads.useful('HaplotypeCaller', per_stage), mem, False
+    elif st.name in ['dr_reconst_a', 'dr_reconst_b']:
+        return threads.useful('HaplotypeCaller', per_stage), max(params.gatk_java_heap_gb, 2 * params.picard_java_heap_gb + params.jvm_overhead_gb) + params.jvm_overhead_gb, False
+    elif st.name == 'coverage':
+        return 1, 1, False
+    elif st.name == 'remove_chrs':
+        return threads.useful('samtools index', per_stage), 1, False
+    return 1, 1, False
+
+
+def next_stage(s):
+    # skips disabled and already completed stages
+    while s.next < len(s.stage_list):
+        st=s.stage_list[s.next]
+        if st.enabled(s.args, s.values) is False:
+            s.next += 1
+        elif s.next < s.start:
+            log.logger.info('sample=%s: stage "%s" was already completed. Skipped.' % (s.name, st.name))
+            s.values.update(s.manifest[st.name]['values'])
+            s.next += 1
+        else:
+            return st
+    return None
+
+
+def run_stage_process(s, params, st, stage_threads, mem):
+    args=copy.copy(s.args)
+    args.p=stage_threads
+    args.mem_budget_gb=mem   # memory limit of the main tools of the stage, see runner.budget
+    manifest=pipeline.load_manifest(s.filenames)
+    pipeline.run_stage(args, params, s.filenames, st, manifest, s.stage_list)
+
+
+def run(args, params, samples, base):
+    log.logger.debug('started.')
+    try:
+        ctx=multiprocessing.get_context('fork')
+        for s in samples:
+            message=check_sample(s)
+            if message is not None:
+                log.logger.error('sample=%s: %s' % (s.name, message))
+                s.status='failed'
+                continue
+            try:
+                autosome_depth.resolve(s.args, params, base)
+            except SystemExit:
+                log.logger.error('sample=%s: autosome depth could not be estimated.' % s.name)
+                s.status='failed'
+                continue
+            s.filenames=pipeline.set_filenames(s.args, base)
+            s.stage_list=pipeline.stages(s.args, s.filenames)
+            s.manifest,s.start=pipeline.prepare(s.args, params, s.filenames, s.stage_list)
+        free_cores=args.p
+        free_mem=args.mem
+        free_io=args.max_io
+        running={}
+        while True:
+            # samples already in CPU-bound stages go first so that their intermediates are cleared early
+            candidates=[]
+            for n,s in enumerate(samples):
+                if not s.status == 'pending' or s.running is not None:
+                    continue
+                st=next_stage(s)
+                if st is None:
+                    pipeline.finish(s.args, s.filenames, s.values)
+                    s.status='completed'
+                    log.logger.info('sample=%s: all stages finished.' % s.name)
+                    continue
+                stage_threads,mem,io_bound=stage_resources(args, params, st)
+                candidates.append([io_bound, n, s, st, stage_threads, mem])
+            for io_bound,_,s,st,stage_threads,mem in sorted(candidates, key=lambda l: (l[0], l[1])):
+                cores= 1 if io_bound is True else stage_threads   # I/O-bound stages mostly wait for disk
+                fits= cores <= free_cores and mem <= free_mem and (io_bound is False or free_io >= 1)
+                if fits is False and len(running) == 0:
+                    log.logger.warning('sample=%s: stage "%s" needs more resources than available (%d cores, %.1f GB). Will run it alone.' % (s.name, st.name, cores, mem))
+                    fits=True
+                if fits is False:
+                    continue
+                free_cores -= cores
+                free_mem -= mem
+                if io_bound is True:
+                    free_io -= 1
+                log.logger.info('sample=%s: stage "%s" started with %d thread(s), %.1f GB.' % (s.name, st.name, stage_threads, mem))
+                proc=ctx.Process(target=run_stage_process, args=(s, params, st, stage_threads, mem))
+                proc.start()
+                s.running=[proc, st, cores, mem, io_bound]
+                running[proc.sentinel]=s
+            if len(running) == 0:
+                break
+            for sentinel in wait(list(running)):
+                s=running.pop(sentinel)
+                proc,st,cores,mem,io_bound=s.running
+                proc.join()
+                s.running=None
+                free_cores += cores
+                free_mem += mem
+                if io_bound is True:
+                    free_io += 1
+                if not proc.exitcode == 0:
+                    log.logger.error('sample=%s: stage "%s" failed. Other samples will continue.' % (s.name, st.name))
+                    s.status='failed'
+                    scratch.cleanup(s.args, s.filenames)
+                    continue
+                s.manifest=pipeline.load_manifest(s.filenames)
+                s.values.update(s.manifest[st.name]['values'])
+                s.stages_run.append(st.name)
+                s.next += 1
+        with open(os.path.join(args.outdir, 'batch_status.txt'), 'w') as outfile:
+            outfile.write('#sample\tstatus\toutdir\tstages_run\n')
+            for s in samples:
+                outfile.write('%s\t%s\t%s\t%s\n' % (s.name, s.status, s.args.outdir, ';'.join(s.stages_run) if len(s.stages_run) >= 1 else 'NA'))
+        if args.results_db is not None:
+            results_db.ingest(args.results_db, [ [results_db.sample_name(s.args.outdir), s.args.outdir] for s in samples if s.status == 'completed' ])
+        n_failed=len([ s for s in samples if s.status == 'failed' ])
+        log.logger.info('%d sample(s) completed, %d sample(s) failed.' % (len(samples) - n_failed, n_failed))
+    except SystemExit:
+        raise
+    except:
+        log.logger.error('\n'+ traceback.format_exc())
+        exit(1)
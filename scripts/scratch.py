@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,sys,shutil,atexit,signal,tempfile
+import log,traceback
+
+
+# intermediates which never reach -outdir; large ones go to -tmpdir, small ones to /dev/shm with -tmpdir_shm
+large_files=['discordant_bam', 'discordant_sort_bam', 'unmapped_1', 'unmapped_2', 'unmapped_bam_3', 'unmapped_bam_4', 'unmapped_bam_34', 'unmapped_sorted_34',
+             'unmapped_3', 'unmapped_4', 'unmapped_merged_pre1', 'unmapped_merged_pre2', 'unmapped_merged_1', 'unmapped_merged_2', 'mapped_unsorted_bam', 'mapped_sorted']
+small_files=['tmp_bam', 'tmp_sorted_bam', 'tmp_bam_fq1', 'tmp_bam_fq2', 'tmp_rg_bam', 'tmp_fa', 'tmp_masked_fa', 'tmp_fa_dict']
+shm='/dev/shm'
+
+# scratch directories made by this process; removed at exit unless -keep
+dirs=[]
+keep=False
+
+
+def remove_all():
+    for d in dirs:
+        if keep is True:
+            log.logger.info('Intermediate files were kept in %s.' % d)
+        else:
+            shutil.rmtree(d, ignore_errors=True)
+    dirs.clear()
+
+
+def on_sigterm(signum, frame):
+    sys.exit(128 + signum)   # runs atexit handlers
+
+
+def make_dir(parent):
+    if len(dirs) == 0:
+        atexit.register(remove_all)
+        if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, on_sigterm)
+    d=tempfile.mkdtemp(prefix='hhv6_', dir=parent)
+    dirs.append(d)
+    return d
+
+
+def setup(args, filenames):
+    # relocates intermediates in filenames; called by pipeline.set_filenames
+    global keep
+    filenames.scratch_disk=None
+    filenames.scratch_shm=None
+    if getattr(args, 'tmpdir', None) is None:
+        return
+    keep=args.keep
+    filenames.scratch_disk=make_dir(args.tmpdir)
+    if args.tmpdir_shm is True:
+        filenames.scratch_shm=make_dir(shm)
+    for key in large_files:
+        setattr(filenames, key, os.path.join(filenames.scratch_disk, os.path.basename(getattr(filenames, key))))
+    small_dir=filenames.scratch_disk if filenames.scratch_shm is None else filenames.scratch_shm
+    for key in small_files:
+        setattr(filenames, key, os.path.join(small_dir, os.path.basename(getattr(filenames, key))))
+
+
+def dir_size(d):
+    total=0
+    for root,_,files in os.walk(d):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+
+def rebalance(args, filenames):
+    # small intermediates fall back to disk when /dev/shm is used over -shm_limit_gb or nearly full
+    if filenames.scratch_shm is None:
+        return
+    used=dir_size(filenames.scratch_shm)
+    st=os.statvfs(shm)
+    free=st.f_bavail * st.f_frsize
+    if used <= args.shm_limit_gb * 1024 ** 3 and free >= 0.1 * st.f_blocks * st.f_frsize:
+        return
+    paths=[ getattr(filenames, key) for key in small_files ]
+    if any([ p.startswith(filenames.scratch_shm) and os.path.exists(p) for p in paths ]):
+        return   # files of one step, e.g. tmp.fa and tmp.dict, stay together
+    log.logger.info('%s is used %.1f MB (%.1f MB free). Small intermediates will be written to %s.' % (shm, used / 1048576, free / 1048576, filenames.scratch_disk))
+    for key in small_files:
+        setattr(filenames, key, os.path.join(filenames.scratch_disk, os.path.basename(getattr(filenames, key))))
+
+
+def cleanup(args, filenames):
+    for d in [filenames.scratch_disk, filenames.scratch_shm]:
+        if d is None or not d in dirs:
+            continue
+        if args.keep is True:
+            log.logger.info('Intermediate files were kept in %s.' % d)
+            dirs.remove(d)
+            continue
+        try:
+            shutil.rmtree(d)
+        except OSError:
+            log.logger.warning('Could not remove %s.\n%s' % (d, traceback.format_exc()))
+        dirs.remove(d)
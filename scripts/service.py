@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,time,copy,glob,shutil,fcntl
+import pipeline,scheduler,utils
+import log,traceback
+
+
+# spool layout; a job is a sample sheet (.tsv) dropped into incoming/
+spool_dirs=['incoming', 'running', 'done', 'failed']
+
+
+def prepare_spool(args):
+    log.logger.debug('started.')
+    try:
+        for d in spool_dirs:
+            os.makedirs(os.path.join(args.spool, d), exist_ok=True)
+        # one worker per spool directory
+        lock=open(os.path.join(args.spool, 'worker.lock'), 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            log.logger.error('Another worker is using %s.' % args.spool)
+            exit(1)
+        lock.write('%d\n' % os.getpid())
+        lock.flush()
+        # jobs left by a killed worker are resumed
+        for name in sorted(os.listdir(os.path.join(args.spool, 'running'))):
+            log.logger.info('Job %s was interrupted. Will resume it.' % name)
+            os.rename(os.path.join(args.spool, 'running', name), os.path.join(args.spool, 'incoming', name))
+        return lock
+    except SystemExit:
+        raise
+    except:
+        log.logger.error('\n'+ traceback.format_exc())
+        exit(1)
+
+
+def warm_files(args, filenames):
+    paths=[args.vref, filenames.hhv6_dr_ref, args.picard]
+    paths.extend(glob.glob(args.vrefindex +'.*'))
+    paths.extend(glob.glob(filenames.hhv6_dr_index +'.*'))
+    return [ path for path in paths if os.path.isfile(path) is True ]
+
+
+def prefetch(paths):
+    # asks the kernel to keep indexes and jars in page cache, so hisat2 and JVMs of each job do not read them from disk
+    for path in paths:
+        fd=os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+
+def warm_up(args, params, base):
+    log.logger.debug('started.')
+    try:
+        # modules and reference metadata are loaded once here and inherited by forked stage processes
+        import retrieve_unmapped,mapping,identify_high_cov,reconstruct_hhv6,reconstruct_hhv6_dr
+        # only reference paths are used; without -tmpdir no scratch directory is made for the life of the worker
+        wargs=copy.copy(args)
+        wargs.tmpdir=None
+        filenames=pipeline.set_filenames(wargs, base)
+        for ref in [args.vref, filenames.hhv6_dr_ref]:
+            virus_names=utils.load_virus_names(ref)
+            for refid in [pipeline.hhv6a_refid, pipeline.hhv6b_refid]:
+                if refid in virus_names:
+                    utils.retrieve_only_one_virus_fasta(ref, refid)
+        paths=warm_files(args, filenames)
+        prefetch(paths)
+        log.logger.info('Worker is ready. %d reference and index files were prefetched.' % len(paths))
+        return paths
+    except SystemExit:
+        raise
+    except:
+        log.logger.error('\n'+ traceback.format_exc())
+        exit(1)
+
+
+def claim_jobs(args):
+    jobs=[]
+    for name in sorted(os.listdir(os.path.join(args.spool, 'incoming'))):
+        # submitters should write a hidden file first and rename it to *.tsv
+        if name.startswith('.') or not name.endswith('.tsv'):
+            continue
+        os.rename(os.path.join(args.spool, 'incoming', name), os.path.join(args.spool, 'running', name))
+        jobs.append(name)
+    return jobs
+
+
+def run_job(args, params, base, name):
+    job_name=name[:-len('.tsv')]
+    jargs=copy.copy(args)
+    jargs.sample_sheet=os.path.join(args.spool, 'running', name)
+    jargs.outdir=os.path.join(args.outdir, job_name)
+    status='failed'
+    start=time.time()
+    log.logger.info('Job %s started.' % job_name)
+    try:
+        if os.path.exists(jargs.outdir) is False:
+            os.mkdir(jargs.outdir)
+        samples=scheduler.load_sample_sheet(jargs)
+        scheduler.run(jargs, params, samples, base)
+        if len(samples) >= 1 and all([ s.status == 'completed' for s in samples ]):
+            status='done'
+    except SystemExit:
+        log.logger.error('Job %s failed.' % job_name)
+    except:
+        log.logger.error('Job %s failed.\n%s' % (job_name, traceback.format_exc()))
+    # per-job status is the batch status of the job next to the job file
+    batch_status=os.path.join(jargs.outdir, 'batch_status.txt')
+    if os.path.exists(batch_status) is True:
+        shutil.copyfile(batch_status, os.path.join(args.spool, status, job_name +'.status.txt'))
+    os.replace(jargs.sample_sheet, os.path.join(args.spool, status, name))
+    log.logger.info('Job %s finished in %.1f sec. status=%s' % (job_name, time.time() - start, status))
+
+
+def serve(args, params, base):
+    lock=prepare_spool(args)
+    paths=warm_up(args, params, base)
+    stop_file=os.path.join(args.spool, 'stop')
+    log.logger.info('Waiting for jobs in %s. Create %s to stop the worker.' % (os.path.join(args.spool, 'incoming'), stop_file))
+    while os.path.exists(stop_file) is False:
+        jobs=claim_jobs(args)
+        if len(jobs) == 0:
+            time.sleep(args.poll)
+            continue
+        prefetch(paths)
+        for name in jobs:
+            run_job(args, params, base, name)
+    os.remove(stop_file)
+    lock.close()
+    log.logger.info('Worker stopped.')
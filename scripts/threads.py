@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+# fraction of the work of each tool which runs in parallel (Amdahl's law)
+# estimates from the threading model of each tool, not measurements; helper_scripts/benchmark/run_benchmark.py -p can be used to refine them
+parallel_fraction={
+    'hisat2': 0.95,
+    'bwa': 0.95,
+    'samtools view': 0.7,       # BGZF compression only
+    'samtools sort': 0.85,
+    'samtools fastq': 0.5,
+    'samtools merge': 0.6,
+    'samtools index': 0.6,
+    'picard': 0.5,              # parallel GC of the JVM
+    'HaplotypeCaller': 0.6,     # pair-HMM
+    'bcftools': 0.4,            # BGZF compression only
+    'metaspades.py': 0.85,
+}
+
+# a thread is given to a tool only when it speeds the tool up by at least this fraction of a core
+min_gain=0.25
+
+
+def speedup(tool, n):
+    f=parallel_fraction[tool]
+    return 1 / ((1 - f) + f / n)
+
+
+def gain(tool, n):
+    # speedup by the (n+1)-th thread
+    return speedup(tool, n + 1) - speedup(tool, n)
+
+
+def useful(tool, p):
+    # threads worth giving to a tool running alone within p threads
+    n=1
+    while n < p and gain(tool, n) >= min_gain:
+        n += 1
+    return n
+
+
+def split(p, tools):
+    # divides p threads among tools running at the same time; each thread goes to the tool which gains most from it
+    # a tool needs at least one thread, so with p < len(tools) tools get one each and share the p cores; see total()
+    n=[ 1 for _ in tools ]
+    for _ in range(p - len(tools)):
+        gains=[ gain(tool, k) for tool,k in zip(tools, n) ]
+        best=gains.index(max(gains))
+        if gains[best] < min_gain:
+            break
+        n[best] += 1
+    return n
+
+
+def total(p, tools):
+    # cores used by tools running at the same time; never more than p
+    return min(p, sum(split(p, tools)))
+
+
+def extra(tool, p):
+    # for -@ of samtools and --threads of bcftools, which count threads in addition to the main one
+    return '%d' % (useful(tool, p) - 1)
+
+
+def jvm_gc(n):
+    return '-XX:ParallelGCThreads=%d' % n
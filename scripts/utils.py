@@ -7,7 +7,7 @@ See file LICENSE for details.
 '''
 
 
-import os,gzip,shutil
+import os,gzip,shutil,hashlib
 import log,traceback
 
 
@@ -15,6 +15,38 @@ class empclass:
     pass
 
 
+# reference metadata loaded once per process; a resident worker fills this before forking sample jobs
+reference_cache={}
+
+
+def reference_cache_key(path_to_file, *keys):
+    st=os.stat(path_to_file)
+    return (os.path.abspath(path_to_file), st.st_size, st.st_mtime_ns) + keys
+
+
+def cram_format_options(params):
+    # decode only required fields; MD/NM are not regenerated from the reference
+    return ['required_fields=0x%x' % params.cram_required_fields, 'decode_md=0']
+
+
+def cram_view_options(params):
+    opts=[]
+    for opt in cram_format_options(params):
+        opts.extend(['--input-fmt-option', opt])
+    return opts
+
+
+def file_digest(path, chunk_size=1048576):
+    # file size plus sampled content (head, middle and tail); cheap even for a 30x CRAM
+    size=os.path.getsize(path)
+    h=hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as infile:
+        for offset in sorted(set([0, max(0, size // 2 - chunk_size // 2), max(0, size - chunk_size)])):
+            infile.seek(offset)
+            h.update(infile.read(chunk_size))
+    return h.hexdigest()
+
+
 def gzip_or_del(args, params, file):
     log.logger.debug('started,file=%s' % file)
     try:
@@ -82,9 +114,31 @@ def parse_fasta(path_to_file):
         exit(1)
 
 
+def load_virus_names(path_to_file):
+    log.logger.debug('started.')
+    try:
+        key=reference_cache_key(path_to_file, 'names')
+        if key in reference_cache:
+            return reference_cache[key]
+        virus_names={}
+        with open(path_to_file) as infile:
+            for line in infile:
+                if '>' in line:
+                    ls=line.strip().split(' ', 1)
+                    virus_names[ls[0].replace('>', '')]=ls[1]
+        reference_cache[key]=virus_names
+        return virus_names
+    except:
+        log.logger.error('\n'+ traceback.format_exc())
+        exit(1)
+
+
 def retrieve_only_one_virus_fasta(path_to_file, refseqid):
     log.logger.debug('started.')
     try:
+        key=reference_cache_key(path_to_file, 'seq', refseqid)
+        if key in reference_cache:
+            return reference_cache[key]
         seq=''
         keep=False
         with open(path_to_file) as infile:
@@ -97,6 +151,7 @@ def retrieve_only_one_virus_fasta(path_to_file, refseqid):
                         seq += line.strip()
                     else:
                         break
+        reference_cache[key]=(header, seq)
         return header, seq
     except:
         log.logger.error('\n'+ traceback.format_exc())
@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,sys,logging
+
+# modules in scripts/ import each other by name, as main.py does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+# log.logger is created by log.start_log() in the entry points
+import log
+log.logger=logging.getLogger('test')
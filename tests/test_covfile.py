@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import types
+from unittest import mock
+import covfile,identify_high_cov
+
+
+def per_base_events(depth):
+    # depth change at each position of a per-base depth list
+    events={}
+    prev=0
+    for p,d in enumerate(depth + [0]):
+        if not d == prev:
+            events[p]=d - prev
+        prev=d
+    return events
+
+
+def expand(runs):
+    depth=[]
+    for s,e,d in runs:
+        depth.extend([d] * (e - s))
+    return depth
+
+
+def test_runs_from_events_matches_per_base_depth():
+    depth=[0, 0, 1, 1, 2, 2, 2, 1, 0, 0, 3, 3]
+    ends,depths=covfile.runs_from_events(per_base_events(depth), len(depth))
+    assert list(ends) == [2, 4, 7, 8, 10, 12]
+    assert list(depths) == [0, 1, 2, 1, 0, 3]
+
+
+def test_runs_from_events_merges_cancelling_events():
+    # a read on [2, 6) followed by one on [6, 9) is one run; a contig without reads is one run of depth 0
+    events={2: 1, 6: 0, 9: -1}
+    ends,depths=covfile.runs_from_events(events, 12)
+    assert list(ends) == [2, 9, 12]
+    assert list(depths) == [0, 1, 0]
+    ends,depths=covfile.runs_from_events({}, 7)
+    assert list(ends) == [7]
+    assert list(depths) == [0]
+
+
+def test_round_trip(tmp_path):
+    path=str(tmp_path / 'coverage.bin')
+    a=[0, 3, 3, 1, 0, 0, 2]
+    b=[5, 5, 5]
+    contigs=[]
+    for name,depth in [['virus_a', a], ['virus_b', b], ['virus_c', [0] * 4]]:
+        ends,depths=covfile.runs_from_events(per_base_events(depth), len(depth))
+        contigs.append([name, len(depth), ends, depths])
+    covfile.write(path, contigs)
+    index=covfile.read_index(path)
+    assert [ c.name for c in index ] == ['virus_a', 'virus_b', 'virus_c']
+    assert [ c.length for c in index ] == [7, 3, 4]
+    assert [ c.covered for c in index ] == [4, 3, 0]
+    assert [ c.depth_sum for c in index ] == [9, 15, 0]
+    assert expand(covfile.read_runs(path, index[0])) == a
+    assert expand(covfile.read_runs(path, index[1])) == b
+    assert list(covfile.depth_array(path, 'virus_a')) == a
+    assert list(covfile.depth_array(path, 'virus_c')) == [0] * 4
+    assert covfile.depth_array(path, 'virus_d') is None
+
+
+def bedgraph_summary(bedgraph, args, params, virus_names):
+    # summary lines as written from the 1-bp bedgraph of bamCoverage before the binary coverage file
+    lines=[]
+    contigs={}
+    for line in bedgraph.splitlines():
+        ls=line.split()
+        contigs.setdefault(ls[0], []).append([int(ls[1]), int(ls[2]), int(float(ls[3]))])
+    for name,runs in contigs.items():
+        total_len=0
+        covs=[]
+        for s,e,d in runs:
+            total_len += e - s
+            if d >= 1:
+                covs.extend([d] * (e - s))
+        cov_len=len(covs)
+        genome_covered= cov_len / total_len
+        ave_depth= sum(covs) / total_len
+        high_cov_judge='False'
+        if cov_len >= 1:
+            ave_depth_norm= sum(covs) / cov_len
+            ratio='NA' if args.depth is None else str(ave_depth_norm / args.depth)
+            if genome_covered >= params.genome_cov_thresholds and ave_depth_norm >= params.ave_depth_of_mapped_region_threshold:
+                high_cov_judge='True'
+        else:
+            ave_depth_norm=0
+            ratio='NA' if args.depth is None else '0'
+        lines.append('%s\tvirus_exist=%s\tgenome_length=%d;mapped_length=%d;perc_genome_mapped=%f;average_depth=%f;average_depth_of_mapped_region=%f;ratio_ave_virus_depth_to_autosome_depth=%s\tfasta_header=%s\n' % (name, high_cov_judge, total_len, cov_len, 100 * genome_covered, ave_depth, ave_depth_norm, ratio, virus_names[name]))
+    return ''.join(lines)
+
+
+def test_summary_lines_match_bedgraph(tmp_path):
+    depths={'NC_001664.4': [0, 2, 2, 3, 3, 3, 0, 1, 1, 0], 'NC_000898.1': [0] * 6, 'NC_009334.1': [1, 1, 1, 7, 7, 1, 1, 1]}
+    vref=tmp_path / 'vref.fa'
+    with open(vref, 'w') as outfile:
+        for name,depth in depths.items():
+            outfile.write('>%s virus %s\n%s\n' % (name, name, 'A' * len(depth)))
+    virus_names={ name:'virus %s' % name for name in depths }
+    contigs=[]
+    bedgraph=[]
+    for name,depth in depths.items():
+        ends,depths_=covfile.runs_from_events(per_base_events(depth), len(depth))
+        contigs.append([name, len(depth), ends, depths_])
+        for p,d in enumerate(depth):
+            bedgraph.append('%s\t%d\t%d\t%d.0\n' % (name, p, p + 1, d))
+    filenames=types.SimpleNamespace(coverage=str(tmp_path / 'coverage.bin'), summary=str(tmp_path / 'summary.txt'), high_cov_pdf=str(tmp_path / 'high_cov.pdf'))
+    covfile.write(filenames.coverage, contigs)
+    params=types.SimpleNamespace(genome_cov_thresholds=0.5, ave_depth_of_mapped_region_threshold=2)
+    for depth in [None, 30]:
+        args=types.SimpleNamespace(vref=str(vref), depth=depth, alignmentin=True, fastqin=False, ONT_bamin=False, b='sample.bam', c=None)
+        with mock.patch.object(identify_high_cov, 'load_matplotlib', return_value=(mock.MagicMock(), mock.MagicMock())):
+            hhv6a,hhv6b,_=identify_high_cov.identify_high_cov_virus_from_coverage(args, params, filenames)
+        with open(filenames.summary) as infile:
+            assert infile.read() == bedgraph_summary(''.join(bedgraph), args, params, virus_names)
+        assert hhv6a is True and hhv6b is False
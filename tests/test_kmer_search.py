@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import random,types
+import pytest
+np=pytest.importorskip('numpy')
+import kmer_search
+
+
+random.seed(0)
+contig1=''.join([ random.choice('ACGT') for _ in range(300) ])
+contig2=''.join([ random.choice('ACGT') for _ in range(200) ])
+repeat=''.join([ random.choice('ACGT') for _ in range(40) ])
+complement=str.maketrans('ACGTN', 'TGCAN')
+params=types.SimpleNamespace(quick_check_kmer_len=8, quick_check_kmer_seed_step=4, hisat2_mismatch_penalties='6,2')
+
+
+def setup(tmp_path):
+    # contig3 has 7 copies of a 40 bp repeat
+    fasta=tmp_path / 'ref.fa'
+    with open(fasta, 'w') as outfile:
+        outfile.write('>c1\n%s\n>c2\n%s\n>c3\n%s\n' % (contig1, contig2, 'N'.join([repeat] * 7)))
+    args=types.SimpleNamespace(vref=str(fasta))
+    filenames=types.SimpleNamespace(kmer_index=str(tmp_path / 'ref.k8.kmer_index.npz'), kmer_index_outdir=str(tmp_path / 'out.npz'))
+    return args, filenames
+
+
+def count(index, reads, qual='I'):
+    return kmer_search.count_alignments(params, [ (s, qual * len(s)) for s in reads ], index)
+
+
+def mutate(s, positions, base=None):
+    s=list(s)
+    for i in positions:
+        s[i]=base if base is not None else 'ACGT'[('ACGT'.index(s[i]) + 1) % 4]
+    return ''.join(s)
+
+
+def test_index_is_cached(tmp_path):
+    args,filenames=setup(tmp_path)
+    built=kmer_search.load_index(args, params, filenames)
+    cached=kmer_search.load_index(args, params, filenames)
+    for a,b in zip(built, cached):
+        assert np.array_equal(a, b)
+    assert len(built[2]) == (300 - 7) + (200 - 7) + 7 * (40 - 7)
+    assert np.all(built[2][:-1] <= built[2][1:])
+
+
+def test_cache_of_another_reference_is_not_used(tmp_path):
+    args,filenames=setup(tmp_path)
+    kmer_search.load_index(args, params, filenames)
+    with open(args.vref, 'w') as outfile:
+        outfile.write('>c1\n%s\n' % contig1)
+    assert len(kmer_search.load_index(args, params, filenames)[2]) == 300 - 7
+
+
+def test_reverse_complement_packed():
+    for k in [1, 8, 13, 32]:
+        s=''.join([ random.choice('ACGT') for _ in range(k) ])
+        forward,_=kmer_search.pack(kmer_search.encode(s), k)
+        reverse,_=kmer_search.pack(kmer_search.encode(s.translate(complement)[::-1]), k)
+        assert kmer_search.reverse_complement_packed(forward, k)[0] == reverse[0]
+
+
+def test_exact_hits_on_both_strands(tmp_path):
+    args,filenames=setup(tmp_path)
+    index=kmer_search.load_index(args, params, filenames)
+    read=contig2[50:90]
+    assert count(index, [read]) == (1, 1)
+    assert count(index, [read.translate(complement)[::-1]]) == (1, 1)
+    assert count(index, [contig1[0:40], contig1[260:300], contig2[100:151]]) == (3, 3)
+    assert count(index, [''.join([ random.choice('ACGT') for _ in range(40) ])]) == (0, 0)
+
+
+def test_mismatch_penalties(tmp_path):
+    # 40 bp reads may have penalty up to 8; a mismatch costs 6 at quality 40, 2 at quality 2, and 1 against N
+    args,filenames=setup(tmp_path)
+    index=kmer_search.load_index(args, params, filenames)
+    read=contig1[100:140]
+    assert count(index, [mutate(read, [3])]) == (1, 1)
+    assert count(index, [mutate(read, [3, 30])]) == (0, 0)
+    assert count(index, [mutate(read, [3, 12, 30, 37])], qual='#') == (1, 1)
+    assert count(index, [mutate(read, [1, 3, 12, 30, 37])], qual='#') == (0, 0)
+    assert count(index, [mutate(read, [1, 3, 12, 30, 33, 35, 37, 39], 'N')]) == (1, 1)
+    assert count(index, [mutate(read, [0, 1, 3, 12, 30, 33, 35, 37, 39], 'N')]) == (0, 0)
+
+
+def test_read_across_contigs_is_not_aligned(tmp_path):
+    args,filenames=setup(tmp_path)
+    index=kmer_search.load_index(args, params, filenames)
+    assert count(index, [contig1[280:] + contig2[:20]]) == (0, 0)
+
+
+def test_alignments_per_read_are_capped(tmp_path):
+    # as hisat2 -k 5; every read hits all 7 copies
+    args,filenames=setup(tmp_path)
+    index=kmer_search.load_index(args, params, filenames)
+    assert count(index, [repeat, repeat.translate(complement)[::-1], repeat[:20]]) == (15, 3)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import sys,types
+import pytest
+import ont_consensus
+
+
+class read:
+    def __init__(self, start, cigar, seq, flag=0):
+        self.reference_start=start
+        self.cigartuples=cigar
+        self.query_sequence=seq
+        self.flag=flag
+
+
+class alignment_file:
+    # reads overlapping [start, end), as AlignmentFile.fetch of an indexed BAM
+    reads=[]
+
+    def __init__(self, path):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def fetch(self, refid, start, end):
+        for r in self.reads:
+            length=sum([ l for op,l in r.cigartuples if op in (0, 2, 3, 7, 8) ])
+            if r.reference_start < end and r.reference_start + length > start:
+                yield r
+
+
+@pytest.fixture
+def bam(monkeypatch):
+    # pileup_window imports pysam when called; only AlignmentFile.fetch is used
+    monkeypatch.setitem(sys.modules, 'pysam', types.SimpleNamespace(AlignmentFile=alignment_file))
+    monkeypatch.setattr(alignment_file, 'reads', [])
+    return alignment_file.reads
+
+
+def test_majority_base_and_masking(bam):
+    bam.extend([read(0, [(0, 6)], 'ACGTAC'), read(0, [(0, 6)], 'ACGTAC'), read(0, [(0, 6)], 'ACTTAC'), read(2, [(0, 2)], 'GT')])
+    assert ont_consensus.pileup_window(['x.bam', 'r', 0, 8, 2]) == ('ACGTACNN', 2)
+    assert ont_consensus.pileup_window(['x.bam', 'r', 0, 8, 4]) == ('NNGTNNNN', 6)
+
+
+def test_excluded_reads(bam):
+    bam.extend([read(0, [(0, 4)], 'AAAA'), read(0, [(0, 4)], 'CCCC', flag=0x100), read(0, [(0, 4)], 'CCCC', flag=0x400), read(0, [(0, 4)], None)])
+    assert ont_consensus.pileup_window(['x.bam', 'r', 0, 4, 1]) == ('AAAA', 0)
+
+
+def test_deletion_insertion_and_soft_clip(bam):
+    # two of three reads delete position 2 and insert GG after position 3; soft clips are not used
+    bam.extend([read(0, [(4, 3), (0, 2), (2, 1), (0, 1), (1, 2), (0, 2)], 'TTTACAGGAC'),
+                read(0, [(0, 2), (2, 1), (0, 1), (1, 2), (0, 2)], 'ACAGGAC'),
+                read(0, [(0, 6)], 'ACTAAC')])
+    assert ont_consensus.pileup_window(['x.bam', 'r', 0, 6, 1]) == ('ACAGGAC', 0)
+
+
+def test_windows_concatenate(bam):
+    # a read spanning a window boundary is used in both windows; an insertion after the last base of a window belongs to it
+    bam.extend([read(2, [(0, 4), (1, 3), (0, 4)], 'ACGTCCCACGT'), read(3, [(0, 3), (1, 3), (0, 2)], 'CGTCCCAC')])
+    whole=ont_consensus.pileup_window(['x.bam', 'r', 0, 12, 1])
+    left=ont_consensus.pileup_window(['x.bam', 'r', 0, 6, 1])
+    right=ont_consensus.pileup_window(['x.bam', 'r', 6, 12, 1])
+    assert whole == ('NNACGTCCCACGTNN', 4)
+    assert left[0] + right[0] == whole[0]
+    assert left[1] + right[1] == whole[1]
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,types
+import pipeline
+
+
+def write(path, content):
+    with open(path, 'w') as outfile:
+        outfile.write(content)
+
+
+def setup(tmp_path):
+    # input -> [first] -> a (consumed later) -> [second] -> b -> [third] -> c; third runs only when second found something
+    d={ name:str(tmp_path / name) for name in ['input', 'a', 'b', 'c'] }
+    filenames=types.SimpleNamespace(mapped_to_virus_bam=str(tmp_path / 'v.bam'), mapped_to_virus_bai=str(tmp_path / 'v.bam.bai'),
+                                    mapped_to_dr_bam=str(tmp_path / 'dr.bam'), mapped_to_dr_bai=str(tmp_path / 'dr.bam.bai'))
+    always=lambda args, values: True
+    stage_list=[
+        pipeline.stage('first', None, [d['input']], [], [d['a']], always, ['x']),
+        pipeline.stage('second', None, [d['a']], [d['b']], [], always, ['y']),
+        pipeline.stage('third', None, [d['b']], [d['c']], [], lambda args, values: values.get('found') is True, ['z']),
+    ]
+    args=types.SimpleNamespace(x=1, y=2, z=3)
+    params=types.SimpleNamespace(threshold=0.5)
+    for name in d:
+        write(d[name], name)
+    return d, filenames, stage_list, args, params
+
+
+def complete(args, params, stage_list, values):
+    # manifest as written by run_stage after every stage finished
+    manifest={}
+    for st in stage_list:
+        manifest[st.name]={'fingerprint': pipeline.stage_fingerprint(args, params, st), 'inputs': pipeline.digests(st.inputs),
+                           'outputs': pipeline.digests(st.outputs), 'values': values.get(st.name, {}), 'cache_key': None}
+    return manifest
+
+
+def test_all_completed(tmp_path):
+    d,filenames,stage_list,args,params=setup(tmp_path)
+    manifest=complete(args, params, stage_list, {'second': {'found': True}})
+    assert pipeline.plan(args, params, filenames, stage_list, manifest) == len(stage_list)
+
+
+def test_not_completed(tmp_path):
+    d,filenames,stage_list,args,params=setup(tmp_path)
+    manifest=complete(args, params, stage_list, {'second': {'found': True}})
+    del manifest['third']
+    assert pipeline.plan(args, params, filenames, stage_list, manifest) == 2
+
+
+def test_disabled_stage_is_not_run(tmp_path):
+    # values recorded by earlier stages decide whether a later stage is needed
+    d,filenames,stage_list,args,params=setup(tmp_path)
+    manifest=complete(args, params, stage_list, {'second': {'found': False}})
+    del manifest['third']
+    assert pipeline.plan(args, params, filenames, stage_list, manifest) == len(stage_list)
+
+
+def test_parameters_changed(tmp_path):
+    d,filenames,stage_list,args,params=setup(tmp_path)
+    manifest=complete(args, params, stage_list, {'second': {'found': True}})
+    args.y=20
+    assert pipeline.plan(args, params, filenames, stage_list, manifest) == 1
+    args.y=2
+    params.threshold=0.6
+    assert pipeline.plan(args, params, filenames, stage_list, manifest) == 0
+
+
+def test_output_missing_or_changed(tmp_path):
+    d,filenames,stage_list,args,params=setup(tmp_path)
+    manifest=complete(args, params, stage_list, {'second': {'found': True}})
+    write(d['c'], 'edited')
+    assert pipeline.plan(args, params, filenames, stage_list, manifest) == 2
+    os.remove(d['b'])
+    assert pipeline.plan(args, params, filenames, stage_list, manifest) == 1
+
+
+def test_external_input_changed(tmp_path):
+    d,filenames,stage_list,args,params=setup(tmp_path)
+    manifest=complete(args, params, stage_list, {'second': {'found': True}})
+    write(d['input'], 'another sample')
+    assert pipeline.plan(args, params, filenames, stage_list, manifest) == 0
+
+
+def test_consumed_input_is_regenerated(tmp_path):
+    # a temporary output of first is gone, so first runs again before second
+    d,filenames,stage_list,args,params=setup(tmp_path)
+    manifest=complete(args, params, stage_list, {'second': {'found': True}})
+    del manifest['second']
+    assert pipeline.plan(args, params, filenames, stage_list, manifest) == 1
+    os.remove(d['a'])
+    assert pipeline.plan(args, params, filenames, stage_list, manifest) == 0
+
+
+def test_bam_index_is_not_regenerated(tmp_path):
+    # a deleted BAM index is rebuilt from the BAM instead of rerunning the stage which made it
+    d,filenames,stage_list,args,params=setup(tmp_path)
+    stage_list[0].temp_outputs.append(filenames.mapped_to_virus_bai)
+    stage_list[1].inputs.append(filenames.mapped_to_virus_bai)
+    write(filenames.mapped_to_virus_bam, 'bam')
+    manifest=complete(args, params, stage_list, {'second': {'found': True}})
+    del manifest['second']
+    assert pipeline.plan(args, params, filenames, stage_list, manifest) == 1
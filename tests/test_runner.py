@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import sys,time,signal,types
+import runner
+
+
+def test_success():
+    assert runner.run([sys.executable, '-c', 'pass'], limits=runner.limits(mem_gb=1, cpu_sec=10)) == 0
+
+
+def test_timeout_kills_the_pipeline():
+    t=time.time()
+    job=runner.start([[sys.executable, '-c', 'import time; time.sleep(30)'], ['cat']], timeout=0.5)
+    assert job.wait() == -signal.SIGKILL
+    assert job.timed_out is True
+    assert time.time() - t < 10
+
+
+def test_memory_limit():
+    # 512 MB written by a process limited to 256 MB
+    code='bytearray(512 * 1024 ** 2)'
+    assert runner.run([sys.executable, '-c', code]) == 0
+    assert not runner.run([sys.executable, '-c', code], limits=runner.limits(mem_gb=0.25)) == 0
+
+
+def test_cpu_time_limit():
+    t=time.time()
+    assert runner.run([sys.executable, '-c', 'while True: pass'], limits=runner.limits(cpu_sec=1)) == -signal.SIGXCPU
+    assert time.time() - t < 30
+
+
+def test_budget():
+    # the stage budget of the batch scheduler overrides the per-tool default
+    assert runner.budget(types.SimpleNamespace()) is None
+    assert runner.budget(types.SimpleNamespace(), 5).mem_gb == 5
+    assert runner.budget(types.SimpleNamespace(mem_budget_gb=7), 5).mem_gb == 7
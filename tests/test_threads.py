@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import pytest
+import threads
+
+
+tool_sets=[['hisat2', 'samtools view'], ['samtools fastq', 'samtools fastq'], ['picard', 'picard', 'picard'], ['bwa', 'samtools sort', 'bcftools']]
+
+
+@pytest.mark.parametrize('tools', tool_sets)
+@pytest.mark.parametrize('p', [1, 2, 3, 4, 8, 16, 64])
+def test_split_within_p(tools, p):
+    n=threads.split(p, tools)
+    assert len(n) == len(tools)
+    assert min(n) >= 1
+    if p >= len(tools):
+        assert sum(n) <= p
+    assert threads.total(p, tools) <= p
+
+
+def test_split_gives_threads_to_the_most_parallel_tool():
+    n=threads.split(8, ['hisat2', 'bcftools'])
+    assert n[0] > n[1]
+    assert sum(n) <= 8
+
+
+def test_split_with_fewer_threads_than_tools():
+    # each tool still gets one thread, but they are charged p cores in total
+    assert threads.split(2, ['picard', 'picard', 'picard']) == [1, 1, 1]
+    assert threads.total(2, ['picard', 'picard', 'picard']) == 2
+
+
+def test_split_stops_at_useful_threads():
+    # threads which gain less than min_gain are not given out
+    p=64
+    for tool in threads.parallel_fraction:
+        assert threads.split(p, [tool]) == [threads.useful(tool, p)]
+
+
+def test_extra():
+    assert threads.extra('bcftools', 1) == '0'
+    assert int(threads.extra('samtools sort', 16)) == threads.useful('samtools sort', 16) - 1
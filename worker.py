@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+'''
+Copyright (c) 2020 RIKEN
+All Rights Reserved
+See file LICENSE for details.
+'''
+
+
+import os,sys,datetime,argparse,glob,logging
+
+
+# version
+version='2021/April/27'
+
+
+# args
+parser=argparse.ArgumentParser(description='')
+parser.add_argument('-spool', metavar='str', type=str, help='Required. Specify a spool directory. Each job is a sample sheet (.tsv, same format as batch.py) placed in spool/incoming. Finished jobs are moved to spool/done or spool/failed with their status. Create spool/stop to stop the worker.')
+parser.add_argument('-poll', metavar='float', type=float, help='Optional. Interval (sec) to check for new jobs. Default: 5', default=5)
+parser.add_argument('-fa', metavar='str', type=str, help='Required when CRAM files are included. Specify reference genome which are used when input reads were mapped. Example: GRCh38DH.fa')
+parser.add_argument('-use_mate_mapped', help='Optional. Specify if you use unmapped reads with their mate was mapped. Otherwise, only both R1 and R2 unmapped will be used by default.', action='store_true')
+parser.add_argument('-all_discordant', help='Optional. Specify if you use all discordant reads, including not-properly paired reads. Otherwise, only both R1 and R2 unmapped will be used by default.', action='store_true')
+parser.add_argument('-vref', metavar='str', type=str, help='Required. Specify reference of virus genomes, including HHV-6A and B. Example: viral_genomic_200405.fa')
+parser.add_argument('-vrefindex', metavar='str', type=str, help='Required. Specify hisat2 index of virus genomes, including HHV-6A and B. Example: viral_genomic_200405')
+parser.add_argument('-bwa', help='Optional. Specify if you use BWA for mapping instead of hisat2.', action='store_true')
+parser.add_argument('-denovo', help='Optional. Specify if you want to perform de-novo assembly.', action='store_true')
+parser.add_argument('-picard', metavar='str', type=str, help='Required. Specify full path to picard.jar. Example: /path/to/picard/picard.jar')
+parser.add_argument('-outdir', metavar='str', type=str, help='Optional. Specify output directory. Results of each sample will be in outdir/job_name/sample_name. Default: ./result_worker', default='./result_worker')
+parser.add_argument('-keep', help='Optional. Specify if you do not want to delete temporary files.', action='store_true')
+parser.add_argument('-p', metavar='int', type=int, help='Optional. Total number of threads shared by all samples. Default: 2', default=2)
+parser.add_argument('-p_per_sample', metavar='int', type=int, help='Optional. Maximum number of threads used by one stage of one sample. Default: 4', default=4)
+parser.add_argument('-mem', metavar='float', type=float, help='Optional. Total memory (GB) shared by all samples, including JVM heaps. Default: 80%% of physical memory')
+parser.add_argument('-max_io', metavar='int', type=int, help='Optional. Maximum number of I/O-bound unmapped read retrievals running at the same time. Default: 2', default=2)
+parser.add_argument('-tmpdir', metavar='str', type=str, help='Optional. Specify a fast local directory for intermediate files. Only final results are written to -outdir. Intermediates are removed at exit unless -keep is specified.')
+parser.add_argument('-tmpdir_shm', help='Optional. Specify if you write small intermediate files to /dev/shm. Only works with -tmpdir.', action='store_true')
+parser.add_argument('-shm_limit_gb', metavar='float', type=float, help='Optional. Maximum size (GB) of intermediate files in /dev/shm per sample. Above this, -tmpdir is used. Default: 2', default=2)
+parser.add_argument('-cache_dir', metavar='str', type=str, help='Optional. Specify a directory to cache retrieved reads, dedup BAM and coverage. Reruns with the same inputs, references and parameters reuse them. Can be shared by runs.')
+parser.add_argument('-cache_size_gb', metavar='float', type=float, help='Optional. Maximum size (GB) of -cache_dir. Least recently used results are removed. Default: 100', default=100)
+parser.add_argument('-results_db', metavar='str', type=str, help='Optional. Specify a SQLite file to store per-virus summary, stage timings and output paths of completed samples of each job. The file is created if absent and can be shared by workers. Query it with helper_scripts/query_results.py.')
+parser.add_argument('-profile', help='Optional. Specify if you profile Python code of each stage with cProfile. Profiles (.pstats) are written to outdir/profile and the hottest functions are shown at the end.', action='store_true')
+parser.add_argument('-profile_mem', help='Optional. Specify if you also trace memory allocations of each stage with tracemalloc. Only works with -profile. Slows down Python code.', action='store_true')
+parser.add_argument('-v', '--version', help='Print version.', action='store_true')
+parser.add_argument('-singularity', action='store_true', help=argparse.SUPPRESS)
+parser.add_argument('-remove_chr_with_no_read', action='store_true', help=argparse.SUPPRESS)
+parser.set_defaults(sample_sheet=None, overwrite=False, resume=True, alignmentin=False, fastqin=False, single=False, b=None, c=None, fq1=None, fq2=None, depth=None, ONT_bamin=False, ONT_bam=None, ONT_recon_min_depth=None, ONT_cov_refids=None)
+args=parser.parse_args()
+
+
+# start
+import init
+init.init(args, version)
+
+
+# logging
+import log
+args.logfilename='for_debug_worker.log'
+log.start_log(args)
+log.logger.debug('Logging started.')
+
+
+# initial check
+import initial_check
+print()
+log.logger.info('You are using version "%s"' % version)
+log.logger.info('Initial check started.')
+initial_check.check_batch(args, sys.argv, init.base)
+
+
+# set up
+import setup
+setup.setup(args, init.base)
+params=setup.params
+
+
+# jobs are resumed when they were interrupted or submitted again
+import service
+service.serve(args, params, init.base)